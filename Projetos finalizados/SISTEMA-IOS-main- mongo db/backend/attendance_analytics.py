@@ -0,0 +1,156 @@
+"""
+📈 Cálculos de frequência sobre chamadas já carregadas (sem acesso ao banco)
+
+Funções puras usadas pelos relatórios: recebem documentos de attendances
+e devolvem contadores, para que cada endpoint faça uma única leitura por escopo.
+
+JanelaFrequencia guarda as marcações (aluno, data, presente) como arrays
+compactos durante a varredura do cursor, em qualquer ordem, e no fim ordena
+tudo por (aluno, data) com np.lexsort para calcular de uma vez, por aluno:
+totais, última chamada, faltas consecutivas atuais, presenças nas últimas N
+aulas e a taxa na janela dos últimos dias.
+"""
+
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from attendance_rollups import iter_attendance_marks
+
+# Projeção mínima de attendances para os contadores
+MARKS_PROJECTION = {"_id": 0, "turma_id": 1, "data": 1, "records.aluno_id": 1, "records.presente": 1, "presencas": 1}
+
+
+def accumulate_marks(
+    chamadas: Iterable[dict],
+    contagens: Optional[Dict[Tuple[str, str], dict]] = None,
+    sessoes: Optional[Dict[str, int]] = None,
+):
+    """Uma passada pelas chamadas: presenças/faltas por (turma_id, aluno_id) e
+    número de chamadas por turma. Pode ser chamada lote a lote sobre um cursor."""
+    contagens = {} if contagens is None else contagens
+    sessoes = {} if sessoes is None else sessoes
+
+    for chamada in chamadas:
+        turma_id = chamada.get("turma_id")
+        sessoes[turma_id] = sessoes.get(turma_id, 0) + 1
+        for aluno_id, presente in iter_attendance_marks(chamada):
+            chave = (turma_id, aluno_id)
+            contador = contagens.get(chave)
+            if contador is None:
+                contador = contagens[chave] = {"presencas": 0, "faltas": 0}
+            contador["presencas" if presente else "faltas"] += 1
+
+    return contagens, sessoes
+
+
+@dataclass
+class EstatisticasJanela:
+    """Frequência de um aluno com as marcações em ordem de data"""
+    total_chamadas: int
+    presencas: int
+    faltas: int
+    ultima_chamada: str
+    faltas_consecutivas: int
+    presencas_recentes: int
+    chamadas_janela: int
+    presencas_janela: int
+
+    def percentual_janela(self) -> Optional[float]:
+        if not self.chamadas_janela:
+            return None
+        return self.presencas_janela / self.chamadas_janela * 100
+
+
+class JanelaFrequencia:
+    """Acumula marcações de um cursor e calcula as métricas por aluno em uma
+    passada vetorizada. A janela termina na data mais recente das chamadas lidas
+    (o fim do período do relatório) e cobre `dias_janela` dias até ela."""
+
+    def __init__(self, dias_janela: int = 30, ultimas_aulas: int = 5):
+        self.dias_janela = dias_janela
+        self.ultimas_aulas = ultimas_aulas
+        self._alunos: Dict[str, int] = {}
+        self._datas: Dict[str, int] = {}
+        self._aluno = array("i")
+        self._data = array("i")
+        self._presente = array("b")
+
+    def adicionar(self, chamadas: Iterable[dict]):
+        for chamada in chamadas:
+            data_chamada = chamada.get("data") or ""
+            codigo_data = self._datas.setdefault(data_chamada, len(self._datas))
+            for aluno_id, presente in iter_attendance_marks(chamada):
+                self._aluno.append(self._alunos.setdefault(aluno_id, len(self._alunos)))
+                self._data.append(codigo_data)
+                self._presente.append(presente)
+
+    def calcular(self) -> Dict[str, EstatisticasJanela]:
+        if not self._aluno:
+            return {}
+
+        # Datas ISO ordenam como texto; o posto na ordenação vira a chave de ordem
+        textos = sorted(self._datas)
+        posto_por_codigo = np.empty(len(textos), dtype=np.int64)
+        for posto, texto in enumerate(textos):
+            posto_por_codigo[self._datas[texto]] = posto
+        dias = np.array([_dia(texto) for texto in textos], dtype="datetime64[D]")
+
+        aluno = np.frombuffer(self._aluno, dtype=np.int32)
+        posto = posto_por_codigo[np.frombuffer(self._data, dtype=np.int32)]
+        presente = np.frombuffer(self._presente, dtype=np.int8).astype(bool)
+
+        # Ordem estável por (aluno, data): chamadas do mesmo dia mantêm a ordem de leitura
+        ordem = np.lexsort((posto, aluno))
+        aluno, posto, presente = aluno[ordem], posto[ordem], presente[ordem]
+        n = len(aluno)
+        inicios = np.flatnonzero(np.r_[True, aluno[1:] != aluno[:-1]])
+        fins = np.r_[inicios[1:], n]
+
+        total = fins - inicios
+        presencas = np.add.reduceat(presente.astype(np.int64), inicios)
+
+        # Faltas consecutivas atuais: marcações depois da última presença
+        posicoes = np.arange(n)
+        ultima_presenca = np.maximum.reduceat(np.where(presente, posicoes, -1), inicios)
+        faltas_seguidas = fins - 1 - np.maximum(ultima_presenca, inicios - 1)
+
+        # Presenças nas últimas N aulas via soma acumulada
+        acumulado = np.r_[0, np.cumsum(presente, dtype=np.int64)]
+        recentes = acumulado[fins] - acumulado[np.maximum(fins - self.ultimas_aulas, inicios)]
+
+        # Janela dos últimos dias (datas inválidas ficam fora)
+        dia = dias[posto]
+        validos = ~np.isnat(dia)
+        if validos.any():
+            limite = dias[~np.isnat(dias)].max() - np.timedelta64(self.dias_janela - 1, "D")
+            na_janela = validos & (dia >= limite)
+        else:
+            na_janela = np.zeros(n, dtype=bool)
+        chamadas_janela = np.add.reduceat(na_janela.astype(np.int64), inicios)
+        presencas_janela = np.add.reduceat((na_janela & presente).astype(np.int64), inicios)
+
+        ids = list(self._alunos)
+        ultima = posto[fins - 1]
+        return {
+            ids[aluno[inicio]]: EstatisticasJanela(
+                total_chamadas=int(total[g]),
+                presencas=int(presencas[g]),
+                faltas=int(total[g] - presencas[g]),
+                ultima_chamada=textos[ultima[g]],
+                faltas_consecutivas=int(faltas_seguidas[g]),
+                presencas_recentes=int(recentes[g]),
+                chamadas_janela=int(chamadas_janela[g]),
+                presencas_janela=int(presencas_janela[g]),
+            )
+            for g, inicio in enumerate(inicios)
+        }
+
+
+def _dia(texto: str):
+    try:
+        return np.datetime64(texto[:10], "D")
+    except ValueError:
+        return np.datetime64("NaT")
@@ -0,0 +1,177 @@
+"""
+🧮 Matriz de presença por turma (alunos × chamadas) em cache
+
+Cada turma vira duas matrizes booleanas NumPy, com as chamadas em ordem de data
+nas colunas: `registrado` (o aluno consta na chamada) e `presente`. Poucos KB
+por turma respondem, sem voltar ao Mongo, contagens e taxas em qualquer período,
+faltas consecutivas atuais e totais por data.
+
+AttendanceMatrixCache monta as matrizes que faltam com uma única consulta
+(índice turma_id + data) e as guarda em um TTLCache por processo. Gravar ou
+apagar chamadas invalida a turma no processo atual; o TTL limita a defasagem
+dos demais workers, como no ScopeResolver.
+
+Um escopo com mais turmas que o cache (maxsize) expulsaria a cada pedido o que
+acabou de montar, e todo pedido leria o histórico inteiro. Nesse caso as turmas
+que faltam são montadas só com as chamadas do período pedido e não são guardadas.
+"""
+
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from attendance_analytics import MARKS_PROJECTION
+from attendance_rollups import iter_attendance_marks
+from ttl_cache import TTLCache
+
+
+class AttendanceMatrix:
+    """Presenças de uma turma: linhas = alunos, colunas = chamadas ordenadas por data"""
+
+    def __init__(self, turma_id: str, alunos: List[str], datas: List[str], registrado: np.ndarray, presente: np.ndarray):
+        self.turma_id = turma_id
+        self.alunos = alunos
+        self.datas = datas
+        self.registrado = registrado
+        self.presente = presente
+        self.linha = {aluno_id: i for i, aluno_id in enumerate(alunos)}
+
+    @classmethod
+    def from_attendances(cls, turma_id: str, chamadas: Iterable[dict]) -> "AttendanceMatrix":
+        """`chamadas` da turma; são ordenadas por data aqui (estável para o mesmo dia)"""
+        chamadas = sorted(chamadas, key=lambda c: c.get("data") or "")
+        alunos: Dict[str, int] = {}
+        linhas, colunas, presencas = [], [], []
+        for coluna, chamada in enumerate(chamadas):
+            for aluno_id, presente in iter_attendance_marks(chamada):
+                linhas.append(alunos.setdefault(aluno_id, len(alunos)))
+                colunas.append(coluna)
+                presencas.append(presente)
+
+        forma = (len(alunos), len(chamadas))
+        registrado = np.zeros(forma, dtype=bool)
+        presente = np.zeros(forma, dtype=bool)
+        if linhas:
+            registrado[linhas, colunas] = True
+            presente[linhas, colunas] = presencas
+        return cls(turma_id, list(alunos), [c.get("data") or "" for c in chamadas], registrado, presente)
+
+    @property
+    def nbytes(self) -> int:
+        return self.registrado.nbytes + self.presente.nbytes
+
+    def columns(self, inicio: Optional[str] = None, fim: Optional[str] = None) -> slice:
+        """Chamadas com inicio <= data <= fim (datas ISO, limites opcionais)"""
+        primeira = bisect_left(self.datas, inicio) if inicio else 0
+        ultima = bisect_right(self.datas, fim) if fim else len(self.datas)
+        return slice(primeira, max(primeira, ultima))
+
+    def sessions(self, inicio: Optional[str] = None, fim: Optional[str] = None) -> int:
+        janela = self.columns(inicio, fim)
+        return janela.stop - janela.start
+
+    def totals(self, inicio: Optional[str] = None, fim: Optional[str] = None):
+        """(presenças, registros) por aluno no período"""
+        janela = self.columns(inicio, fim)
+        return self.presente[:, janela].sum(axis=1), self.registrado[:, janela].sum(axis=1)
+
+    def counts(self, inicio: Optional[str] = None, fim: Optional[str] = None) -> Dict[str, dict]:
+        """aluno_id -> {"presencas", "faltas"} dos alunos com registro no período"""
+        presencas, registros = self.totals(inicio, fim)
+        return {
+            self.alunos[i]: {"presencas": int(presencas[i]), "faltas": int(registros[i] - presencas[i])}
+            for i in np.flatnonzero(registros)
+        }
+
+    def rates(self, inicio: Optional[str] = None, fim: Optional[str] = None) -> np.ndarray:
+        """Percentual de presença por aluno no período (NaN sem registros)"""
+        presencas, registros = self.totals(inicio, fim)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(registros > 0, presencas * 100.0 / registros, np.nan)
+
+    def absence_streaks(self, fim: Optional[str] = None) -> np.ndarray:
+        """Faltas registradas depois da última presença de cada aluno (até `fim`)"""
+        janela = self.columns(None, fim)
+        presente = self.presente[:, janela]
+        faltou = self.registrado[:, janela] & ~presente
+        indices = np.arange(presente.shape[1])
+        ultima_presenca = np.where(presente, indices, -1).max(axis=1, initial=-1)
+        return (faltou & (indices > ultima_presenca[:, None])).sum(axis=1)
+
+    def totals_by_date(self, inicio: Optional[str] = None, fim: Optional[str] = None) -> Dict[str, dict]:
+        """data -> {"presentes", "total"} (chamadas do mesmo dia são somadas)"""
+        janela = self.columns(inicio, fim)
+        presentes = self.presente[:, janela].sum(axis=0)
+        registros = self.registrado[:, janela].sum(axis=0)
+        totais: Dict[str, dict] = {}
+        for data, p, t in zip(self.datas[janela], presentes.tolist(), registros.tolist()):
+            total = totais.setdefault(data, {"presentes": 0, "total": 0})
+            total["presentes"] += p
+            total["total"] += t
+        return totais
+
+
+class AttendanceMatrixCache:
+    """Matrizes por turma montadas sob demanda e invalidadas a cada chamada gravada"""
+
+    def __init__(self, db, maxsize: int = 512, ttl: float = 300.0):
+        self.db = db
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # Incrementada a cada invalidação: uma carga que começou antes não é guardada
+        self._versoes: Dict[str, int] = {}
+        self._geracao = 0
+
+    async def get_many(self, turma_ids: Iterable[str], inicio: Optional[str] = None,
+                       fim: Optional[str] = None) -> Dict[str, AttendanceMatrix]:
+        """Matrizes das turmas. `inicio`/`fim` (datas ISO) só importam quando o escopo não
+        cabe no cache: aí as matrizes montadas cobrem apenas esse período"""
+        turma_ids = list(dict.fromkeys(turma_ids))
+        matrizes, faltando = {}, []
+        for turma_id in turma_ids:
+            matriz = self.cache.get(turma_id)
+            if matriz is None:
+                faltando.append(turma_id)
+            else:
+                matrizes[turma_id] = matriz
+        if not faltando:
+            return matrizes
+
+        geracao = self._geracao
+        versoes = {turma_id: self._versoes.get(turma_id, 0) for turma_id in faltando}
+        chamadas: Dict[str, List[dict]] = {turma_id: [] for turma_id in faltando}
+        filtro = {"turma_id": {"$in": faltando}}
+        guardar = len(turma_ids) <= self.cache.maxsize
+        if not guardar:
+            periodo = {}
+            if inicio:
+                periodo["$gte"] = inicio
+            if fim:
+                periodo["$lte"] = fim
+            if periodo:
+                filtro["data"] = periodo
+        cursor = self.db.attendances.find(filtro, MARKS_PROJECTION)
+        async for chamada in cursor.sort([("turma_id", 1), ("data", 1)]):
+            chamadas[chamada["turma_id"]].append(chamada)
+
+        for turma_id, lista in chamadas.items():
+            matriz = AttendanceMatrix.from_attendances(turma_id, lista)
+            matrizes[turma_id] = matriz
+            if guardar and geracao == self._geracao and versoes[turma_id] == self._versoes.get(turma_id, 0):
+                self.cache.set(turma_id, matriz)
+        return matrizes
+
+    async def get(self, turma_id: str) -> AttendanceMatrix:
+        return (await self.get_many([turma_id]))[turma_id]
+
+    def invalidate(self, turma_id: Optional[str] = None):
+        """Descarta a matriz de uma turma (ou todas, sem turma_id)"""
+        if turma_id is None:
+            self._geracao += 1
+            self.cache.clear()
+        else:
+            self._versoes[turma_id] = self._versoes.get(turma_id, 0) + 1
+            self.cache.pop(turma_id)
+
+    def stats(self) -> dict:
+        return self.cache.stats()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+📊 Visões materializadas das chamadas (collection attendances)
+
+- student_attendance_summary: um documento por (aluno_id, turma_id) com
+  presenças/faltas acumuladas, atualizado com $inc a cada chamada gravada.
+- turma_daily_rollup: um documento por (turma_id, data) com presentes/ausentes/total,
+  base das taxas mensais e semanais do dashboard.
+
+Os relatórios leem O(alunos) documentos pequenos em vez de varrer todas as
+chamadas. Execute este arquivo para reconstruir a partir de attendances.
+"""
+
+import asyncio
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from indexes import reconcile_indexes
+
+SUMMARY_COLLECTION = "student_attendance_summary"
+DAILY_ROLLUP_COLLECTION = "turma_daily_rollup"
+
+
+def iter_attendance_marks(chamada: dict) -> Iterable[Tuple[str, bool]]:
+    """Gera (aluno_id, presente) para os dois formatos de chamada:
+    `records` (attendance/{data}) e `presencas` (POST /attendance legado)"""
+    for record in chamada.get("records") or []:
+        aluno_id = record.get("aluno_id")
+        if aluno_id:
+            yield aluno_id, bool(record.get("presente", False))
+    for aluno_id, dados in (chamada.get("presencas") or {}).items():
+        if aluno_id:
+            yield aluno_id, bool((dados or {}).get("presente", False))
+
+
+# Mesma normalização em pipeline de agregação (usada nas reconstruções)
+MARKS_STAGE = {
+    "$project": {
+        "_id": 0,
+        "turma_id": 1,
+        "data": 1,
+        "marks": {
+            "$concatArrays": [
+                {
+                    "$map": {
+                        "input": {"$ifNull": ["$records", []]},
+                        "as": "r",
+                        "in": {"aluno_id": "$$r.aluno_id", "presente": {"$eq": ["$$r.presente", True]}},
+                    }
+                },
+                {
+                    "$map": {
+                        "input": {"$objectToArray": {"$ifNull": ["$presencas", {}]}},
+                        "as": "p",
+                        "in": {"aluno_id": "$$p.k", "presente": {"$eq": ["$$p.v.presente", True]}},
+                    }
+                },
+            ]
+        },
+    }
+}
+
+
+async def ensure_rollup_indexes(db):
+    """Índices únicos que garantem um documento por chave nos upserts (declarados em indexes.py)"""
+    return await reconcile_indexes(db, [SUMMARY_COLLECTION, DAILY_ROLLUP_COLLECTION])
+
+
+async def apply_attendance_to_summary(db, chamada: dict):
+    """Incrementa os contadores dos alunos de uma chamada recém-gravada"""
+    turma_id = chamada.get("turma_id")
+    data_chamada = chamada.get("data")
+    agora = datetime.now(timezone.utc).isoformat()
+
+    ops = []
+    for aluno_id, presente in iter_attendance_marks(chamada):
+        ops.append(UpdateOne(
+            {"aluno_id": aluno_id, "turma_id": turma_id},
+            {
+                "$inc": {
+                    "presencas": 1 if presente else 0,
+                    "faltas": 0 if presente else 1,
+                    "total_chamadas": 1,
+                },
+                "$min": {"primeira_chamada": data_chamada},
+                "$max": {"ultima_chamada": data_chamada},
+                "$set": {"updated_at": agora},
+            },
+            upsert=True,
+        ))
+
+    if ops:
+        await db[SUMMARY_COLLECTION].bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+async def apply_attendance_to_daily_rollup(db, chamada: dict):
+    """Soma os totais de uma chamada recém-gravada no rollup (turma_id, data)"""
+    presentes = 0
+    total = 0
+    for _, presente in iter_attendance_marks(chamada):
+        total += 1
+        presentes += 1 if presente else 0
+
+    await db[DAILY_ROLLUP_COLLECTION].update_one(
+        {"turma_id": chamada.get("turma_id"), "data": chamada.get("data")},
+        {
+            "$inc": {"presentes": presentes, "ausentes": total - presentes, "total": total},
+            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()},
+        },
+        upsert=True,
+    )
+
+
+async def remove_turma_rollups(db, turma_id: str):
+    """Remove os contadores de uma turma (chamadas da turma foram apagadas)"""
+    await db[SUMMARY_COLLECTION].delete_many({"turma_id": turma_id})
+    await db[DAILY_ROLLUP_COLLECTION].delete_many({"turma_id": turma_id})
+
+
+async def clear_attendance_rollups(db):
+    """Apaga todos os resumos (reset total do banco)"""
+    await db[SUMMARY_COLLECTION].delete_many({})
+    await db[DAILY_ROLLUP_COLLECTION].delete_many({})
+
+
+async def rebuild_student_attendance_summary(db) -> int:
+    """🔄 Reconstrói a collection inteira a partir de attendances ($out é atômico
+    e preserva os índices). Escritas concorrentes durante a execução podem se perder:
+    rode em horário de pouco movimento."""
+    agora = datetime.now(timezone.utc).isoformat()
+    pipeline = [
+        MARKS_STAGE,
+        {"$unwind": "$marks"},
+        {"$match": {"marks.aluno_id": {"$nin": [None, ""]}}},
+        {
+            "$group": {
+                "_id": {"aluno_id": "$marks.aluno_id", "turma_id": "$turma_id"},
+                "presencas": {"$sum": {"$cond": ["$marks.presente", 1, 0]}},
+                "faltas": {"$sum": {"$cond": ["$marks.presente", 0, 1]}},
+                "total_chamadas": {"$sum": 1},
+                "primeira_chamada": {"$min": "$data"},
+                "ultima_chamada": {"$max": "$data"},
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "aluno_id": "$_id.aluno_id",
+                "turma_id": "$_id.turma_id",
+                "presencas": 1,
+                "faltas": 1,
+                "total_chamadas": 1,
+                "primeira_chamada": 1,
+                "ultima_chamada": 1,
+                "updated_at": {"$literal": agora},
+            }
+        },
+        {"$out": SUMMARY_COLLECTION},
+    ]
+    await ensure_rollup_indexes(db)
+    async for _ in db.attendances.aggregate(pipeline, allowDiskUse=True):
+        pass
+    return await db[SUMMARY_COLLECTION].count_documents({})
+
+
+async def rebuild_turma_daily_rollup(db) -> int:
+    """🔄 Reconstrói turma_daily_rollup a partir de attendances (mesmas ressalvas do resumo por aluno)"""
+    agora = datetime.now(timezone.utc).isoformat()
+    pipeline = [
+        MARKS_STAGE,
+        {
+            "$group": {
+                "_id": {"turma_id": "$turma_id", "data": "$data"},
+                "presentes": {"$sum": {"$size": {"$filter": {"input": "$marks", "as": "m", "cond": "$$m.presente"}}}},
+                "total": {"$sum": {"$size": "$marks"}},
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "turma_id": "$_id.turma_id",
+                "data": "$_id.data",
+                "presentes": 1,
+                "ausentes": {"$subtract": ["$total", "$presentes"]},
+                "total": 1,
+                "updated_at": {"$literal": agora},
+            }
+        },
+        {"$out": DAILY_ROLLUP_COLLECTION},
+    ]
+    await ensure_rollup_indexes(db)
+    async for _ in db.attendances.aggregate(pipeline, allowDiskUse=True):
+        pass
+    return await db[DAILY_ROLLUP_COLLECTION].count_documents({})
+
+
+async def reconcile_daily_rollup(db, data: str) -> dict:
+    """Recalcula o rollup de um único dia a partir de attendances (corrige deriva dos $inc
+    e chamadas apagadas); idempotente, usado pelo agendador todas as noites"""
+    agora = datetime.now(timezone.utc).isoformat()
+    totais: Dict[str, dict] = {}
+    async for chamada in db.attendances.find({"data": data}, {"_id": 0, "turma_id": 1, "records": 1, "presencas": 1}):
+        total = totais.setdefault(chamada.get("turma_id"), {"presentes": 0, "total": 0})
+        for _, presente in iter_attendance_marks(chamada):
+            total["total"] += 1
+            total["presentes"] += 1 if presente else 0
+
+    ops = [
+        UpdateOne(
+            {"turma_id": turma_id, "data": data},
+            {"$set": {
+                "presentes": total["presentes"],
+                "ausentes": total["total"] - total["presentes"],
+                "total": total["total"],
+                "updated_at": agora,
+            }},
+            upsert=True,
+        )
+        for turma_id, total in totais.items()
+    ]
+    if ops:
+        await db[DAILY_ROLLUP_COLLECTION].bulk_write(ops, ordered=False)
+    removidos = await db[DAILY_ROLLUP_COLLECTION].delete_many({"data": data, "turma_id": {"$nin": list(totais)}})
+    return {"data": data, "turmas": len(ops), "removidos": removidos.deleted_count}
+
+
+async def sum_daily_rollup(db, data_inicio: str, data_fim: Optional[str] = None,
+                           turma_ids: Optional[list] = None) -> Tuple[int, int]:
+    """(presentes, ausentes) num intervalo de datas ISO: um $group indexado por data"""
+    match = {"data": {"$gte": data_inicio}}
+    if data_fim:
+        match["data"]["$lte"] = data_fim
+    if turma_ids is not None:
+        match["turma_id"] = {"$in": list(turma_ids)}
+
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": None, "presentes": {"$sum": "$presentes"}, "ausentes": {"$sum": "$ausentes"}}},
+    ]
+    async for doc in db[DAILY_ROLLUP_COLLECTION].aggregate(pipeline):
+        return doc.get("presentes", 0), doc.get("ausentes", 0)
+    return 0, 0
+
+
+async def load_summary_counts(db, turma_ids: Optional[list] = None) -> Dict[Tuple[str, str], dict]:
+    """Carrega os contadores por (turma_id, aluno_id); sem turma_ids carrega todos"""
+    query = {"turma_id": {"$in": list(turma_ids)}} if turma_ids is not None else {}
+    contagens = {}
+    async for doc in db[SUMMARY_COLLECTION].find(query, {"_id": 0}):
+        contagens[(doc["turma_id"], doc["aluno_id"])] = doc
+    return contagens
+
+
+def iter_summaries(db, turma_filter=None, batch_size: int = 500):
+    """Cursor dos resumos em ordem de primeira chamada; `turma_filter` é um id ou {"$in": [...]}"""
+    query = {"turma_id": turma_filter} if turma_filter is not None else {}
+    return db[SUMMARY_COLLECTION].find(query, {"_id": 0}).sort("primeira_chamada", 1).batch_size(batch_size)
+
+
+async def count_sessions_by_turma(db, turma_ids: list) -> Dict[str, int]:
+    """Número de chamadas registradas por turma (uma agregação coberta pelo índice turma_id)"""
+    sessoes = {}
+    pipeline = [
+        {"$match": {"turma_id": {"$in": list(turma_ids)}}},
+        {"$group": {"_id": "$turma_id", "total": {"$sum": 1}}},
+    ]
+    async for doc in db.attendances.aggregate(pipeline):
+        sessoes[doc["_id"]] = doc["total"]
+    return sessoes
+
+
+async def main():
+    """Reconstrução manual (mesmo padrão de create_attendance_indexes.py)"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    mongo_url = os.environ.get('MONGO_URL')
+    db_name = os.environ.get('DB_NAME', 'ios_sistema')
+
+    if not mongo_url:
+        print("❌ MONGO_URL não encontrada no .env")
+        return
+
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[db_name]
+    try:
+        print(f"🔗 Conectando ao MongoDB: {db_name}")
+        total = await rebuild_student_attendance_summary(db)
+        print(f"✅ {SUMMARY_COLLECTION} reconstruída: {total} documentos")
+        total = await rebuild_turma_daily_rollup(db)
+        print(f"✅ {DAILY_ROLLUP_COLLECTION} reconstruída: {total} documentos")
+    except Exception as e:
+        print(f"❌ Erro ao reconstruir resumos: {e}")
+    finally:
+        client.close()
+        print("🔌 Conexão MongoDB fechada")
+
+
+if __name__ == "__main__":
+    print("🚀 Reconstruindo resumos de frequência (por aluno e diário por turma)...")
+    print("=" * 60)
+    asyncio.run(main())
+    print("=" * 60)
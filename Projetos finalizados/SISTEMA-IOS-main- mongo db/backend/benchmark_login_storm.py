@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+⏱️ Benchmark: latência de endpoints comuns durante um pico de logins
+
+Mede a latência de GET /ping (ou --probe-path) primeiro com o servidor ocioso
+e depois enquanto várias threads disparam POST /api/auth/login, simulando os
+instrutores entrando às 8:00. Com bcrypt no event loop o p99 do /ping sobe para
+centenas de ms; com o pool de password_hashing ele deve ficar próximo do ocioso.
+
+Uso: python benchmark_login_storm.py --url http://localhost:8000 \\
+        --email instrutor@ios.com.br --senha 123456 --logins 200 --concorrencia 20
+"""
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentis(amostras):
+    if not amostras:
+        return "sem amostras"
+    ordenadas = sorted(amostras)
+    ultimo = len(ordenadas) - 1
+
+    def p(q):
+        return ordenadas[min(ultimo, int(q * len(ordenadas)))]
+
+    return f"p50={p(0.50):7.1f} ms  p95={p(0.95):7.1f} ms  p99={p(0.99):7.1f} ms  max={ordenadas[-1]:7.1f} ms  (n={len(ordenadas)})"
+
+
+def sondar(url: str, parar: threading.Event, intervalo: float, amostras: list):
+    """Uma requisição leve por vez, registrando a latência"""
+    sessao = requests.Session()
+    while not parar.is_set():
+        inicio = time.perf_counter()
+        try:
+            sessao.get(url, timeout=30)
+            amostras.append((time.perf_counter() - inicio) * 1000)
+        except requests.RequestException as e:
+            print(f"⚠️ Falha na sonda: {e}")
+        time.sleep(intervalo)
+
+
+def login(url: str, email: str, senha: str, resultados: dict):
+    inicio = time.perf_counter()
+    try:
+        resposta = requests.post(url, json={"email": email, "senha": senha}, timeout=60)
+        chave = resposta.status_code
+    except requests.RequestException:
+        chave = "erro"
+    resultados.setdefault(chave, []).append((time.perf_counter() - inicio) * 1000)
+
+
+def medir_sonda(url: str, duracao: float, intervalo: float):
+    amostras = []
+    parar = threading.Event()
+    thread = threading.Thread(target=sondar, args=(url, parar, intervalo, amostras))
+    thread.start()
+    time.sleep(duracao)
+    parar.set()
+    thread.join()
+    return amostras
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latência de endpoints durante pico de logins")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--senha", required=True)
+    parser.add_argument("--logins", type=int, default=200, help="total de logins no pico")
+    parser.add_argument("--concorrencia", type=int, default=20, help="logins simultâneos")
+    parser.add_argument("--probe-path", default="/ping")
+    parser.add_argument("--intervalo-ms", type=float, default=20, help="pausa entre sondas")
+    parser.add_argument("--ocioso-s", type=float, default=5, help="duração da medição sem carga")
+    args = parser.parse_args()
+
+    base = args.url.rstrip("/")
+    url_sonda = base + args.probe_path
+    url_login = base + "/api/auth/login"
+    intervalo = args.intervalo_ms / 1000
+
+    print(f"🎯 Sonda: GET {url_sonda}")
+    print("1️⃣  Servidor ocioso...")
+    ocioso = medir_sonda(url_sonda, args.ocioso_s, intervalo)
+    print(f"   {percentis(ocioso)}")
+
+    print(f"2️⃣  Pico: {args.logins} logins com {args.concorrencia} em paralelo...")
+    amostras = []
+    resultados = {}
+    parar = threading.Event()
+    sonda = threading.Thread(target=sondar, args=(url_sonda, parar, intervalo, amostras))
+    sonda.start()
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concorrencia) as pool:
+        for _ in range(args.logins):
+            pool.submit(login, url_login, args.email, args.senha, resultados)
+    duracao = time.perf_counter() - inicio
+    parar.set()
+    sonda.join()
+
+    print(f"   Sonda durante o pico: {percentis(amostras)}")
+    for status_code, latencias in sorted(resultados.items(), key=lambda item: str(item[0])):
+        print(f"   Login {status_code}: {percentis(latencias)}")
+    print(f"   Vazão: {args.logins / duracao:.1f} logins/s em {duracao:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
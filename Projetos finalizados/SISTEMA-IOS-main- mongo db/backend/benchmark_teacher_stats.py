@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+⏱️ Benchmark do cálculo de /reports/teacher-stats
+
+Compara o algoritmo antigo (uma consulta de attendances por aluno + varredura de
+todos os records) com a passada única de attendance_analytics.accumulate_marks.
+
+Dois modos:
+- sem --mongo-url: MODELO de round-trips. Nenhum banco é consultado; cada
+  consulta vira um asyncio.sleep(--rtt-ms). Os tempos impressos estimam o custo
+  das idas ao banco, não são uma medição.
+- com --mongo-url: MEDIÇÃO. Os dados sintéticos são gravados em um banco
+  descartável (--db, apagado ao final) e os dois algoritmos fazem as consultas
+  de verdade.
+
+Uso: python benchmark_teacher_stats.py --turmas 30 --alunos 30 --aulas 80 --rtt-ms 5
+     python benchmark_teacher_stats.py --mongo-url mongodb://localhost:27017
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from datetime import date, timedelta
+
+from attendance_analytics import accumulate_marks
+
+
+def gerar_dados(n_turmas: int, n_alunos: int, n_aulas: int, seed: int = 42):
+    """Unidade sintética: turmas com alunos próprios e uma chamada por aula"""
+    rnd = random.Random(seed)
+    turmas = []
+    chamadas = []
+    inicio = date(2025, 2, 3)
+    for t in range(n_turmas):
+        alunos_ids = [f"aluno-{t}-{a}" for a in range(n_alunos)]
+        turmas.append({"id": f"turma-{t}", "nome": f"Turma {t}", "alunos_ids": alunos_ids})
+        for d in range(n_aulas):
+            chamadas.append({
+                "turma_id": f"turma-{t}",
+                "data": (inicio + timedelta(days=d)).isoformat(),
+                "records": [{"aluno_id": a, "presente": rnd.random() < 0.8} for a in alunos_ids],
+            })
+    return turmas, chamadas
+
+
+async def consulta_simulada(rtt: float, resultado):
+    """Um round-trip ao banco"""
+    await asyncio.sleep(rtt)
+    return resultado
+
+
+async def algoritmo_antigo(turmas, chamadas, rtt: float):
+    """Uma consulta por aluno, varrendo todos os records da turma para achar o aluno"""
+    por_turma = {}
+    for chamada in chamadas:
+        por_turma.setdefault(chamada["turma_id"], []).append(chamada)
+
+    consultas = 0
+    resultado = {}
+    for turma in turmas:
+        alunos = await consulta_simulada(rtt, turma["alunos_ids"])
+        consultas += 1
+        for aluno_id in alunos:
+            chamadas_turma = await consulta_simulada(rtt, por_turma.get(turma["id"], []))
+            consultas += 1
+            presencas = faltas = 0
+            for chamada in chamadas_turma:
+                for record in chamada.get("records", []):
+                    if record.get("aluno_id") == aluno_id:
+                        if record.get("presente", False):
+                            presencas += 1
+                        else:
+                            faltas += 1
+            resultado[(turma["id"], aluno_id)] = {"presencas": presencas, "faltas": faltas}
+    return resultado, consultas
+
+
+async def algoritmo_novo(turmas, chamadas, rtt: float):
+    """Uma consulta de alunos e uma de attendances para o escopo inteiro"""
+    await consulta_simulada(rtt, [a for t in turmas for a in t["alunos_ids"]])
+    todas = await consulta_simulada(rtt, chamadas)
+    contagens, _ = accumulate_marks(todas)
+    return contagens, 2
+
+
+async def algoritmo_antigo_mongo(db, turmas):
+    """Como o endpoint antigo: alunos por turma e um find de attendances por aluno"""
+    consultas = 0
+    resultado = {}
+    for turma in turmas:
+        alunos = await db.alunos.find({"id": {"$in": turma["alunos_ids"]}}, {"_id": 0, "id": 1}).to_list(None)
+        consultas += 1
+        for aluno in alunos:
+            chamadas_turma = await db.attendances.find({"turma_id": turma["id"]}, {"_id": 0}).to_list(None)
+            consultas += 1
+            presencas = faltas = 0
+            for chamada in chamadas_turma:
+                for record in chamada.get("records", []):
+                    if record.get("aluno_id") == aluno["id"]:
+                        if record.get("presente", False):
+                            presencas += 1
+                        else:
+                            faltas += 1
+            resultado[(turma["id"], aluno["id"])] = {"presencas": presencas, "faltas": faltas}
+    return resultado, consultas
+
+
+async def algoritmo_novo_mongo(db, turmas):
+    """Um $in de alunos e um cursor de attendances para o escopo inteiro"""
+    alunos_ids = [a for t in turmas for a in t["alunos_ids"]]
+    await db.alunos.find({"id": {"$in": alunos_ids}}, {"_id": 0, "id": 1}).to_list(None)
+    cursor = db.attendances.find({"turma_id": {"$in": [t["id"] for t in turmas]}}, {"_id": 0})
+    contagens, _ = accumulate_marks([chamada async for chamada in cursor])
+    return contagens, 2
+
+
+async def preparar_banco(db, turmas, chamadas):
+    await db.client.drop_database(db.name)
+    await db.alunos.insert_many([{"id": a} for t in turmas for a in t["alunos_ids"]])
+    await db.turmas.insert_many([dict(t) for t in turmas])
+    await db.attendances.insert_many([dict(c) for c in chamadas])
+    await db.alunos.create_index("id")
+    await db.attendances.create_index([("turma_id", 1), ("data", 1)])
+
+
+async def medir(nome, func, *args):
+    inicio = time.perf_counter()
+    resultado, consultas = await func(*args)
+    duracao = (time.perf_counter() - inicio) * 1000
+    print(f"   {nome:<22} {duracao:>10.1f} ms   ({consultas} consultas)")
+    return resultado, duracao
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark de /reports/teacher-stats")
+    parser.add_argument("--turmas", type=int, default=30)
+    parser.add_argument("--alunos", type=int, default=30, help="alunos por turma")
+    parser.add_argument("--aulas", type=int, default=80, help="chamadas por turma")
+    parser.add_argument("--rtt-ms", type=float, default=5.0, help="round-trip simulado por consulta (só no modelo)")
+    parser.add_argument("--mongo-url", help="mede contra um MongoDB real em vez do modelo de round-trips")
+    parser.add_argument("--db", default="benchmark_teacher_stats", help="banco descartável usado com --mongo-url")
+    args = parser.parse_args()
+
+    turmas, chamadas = gerar_dados(args.turmas, args.alunos, args.aulas)
+    total_records = sum(len(c["records"]) for c in chamadas)
+    print(f"📊 {args.turmas} turmas x {args.alunos} alunos x {args.aulas} aulas = {total_records} records")
+
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        client = AsyncIOMotorClient(args.mongo_url)
+        db = client[args.db]
+        print(f"🗄️ MEDIÇÃO contra {args.mongo_url} (banco {args.db})")
+        try:
+            await preparar_banco(db, turmas, chamadas)
+            antigo, t_antigo = await medir("Antigo (por aluno)", algoritmo_antigo_mongo, db, turmas)
+            novo, t_novo = await medir("Passada única", algoritmo_novo_mongo, db, turmas)
+        finally:
+            await client.drop_database(args.db)
+            client.close()
+        rotulo = "medido"
+    else:
+        rtt = args.rtt_ms / 1000
+        print(f"🧮 MODELO de round-trips: nenhum banco consultado, cada consulta = sleep de {args.rtt_ms} ms")
+        antigo, t_antigo = await medir("Antigo (por aluno)", algoritmo_antigo, turmas, chamadas, rtt)
+        novo, t_novo = await medir("Passada única", algoritmo_novo, turmas, chamadas, rtt)
+        rotulo = "estimado pelo modelo, não medido"
+
+    if antigo != novo:
+        print("❌ Resultados diferentes entre os algoritmos!")
+        return
+    print(f"✅ Resultados idênticos - {t_antigo / t_novo:.0f}x mais rápido ({rotulo})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 Script para criar índices únicos necessários para o sistema de attendance
-Execute este script UMA VEZ após fazer deploy do backend
+Pode ser executado quantas vezes quiser: só cria o que estiver faltando
+(para todos os índices e o relatório de uso, execute indexes.py)
 """
 
 import asyncio
@@ -9,6 +10,8 @@ import os
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 
+from indexes import reconcile_indexes
+
 # Carregar variáveis de ambiente
 load_dotenv()
 
@@ -30,42 +33,29 @@ async def create_attendance_indexes():
     try:
         print(f"🔗 Conectando ao MongoDB: {db_name}")
         
-        # 1) Índice único para impedir duplicação de presença por turma/data
-        print("📋 Criando índice único (turma_id, data)...")
-        result1 = await db.attendances.create_index(
-            [("turma_id", 1), ("data", 1)], 
-            unique=True,
-            name="unique_turma_data"
-        )
-        print(f"✅ Índice único criado: {result1}")
-        
-        # 2) Índice para consultas rápidas por turma
-        print("📋 Criando índice por turma_id...")
-        result2 = await db.attendances.create_index([("turma_id", 1)])
-        print(f"✅ Índice turma_id criado: {result2}")
-        
-        # 3) Índice para consultas rápidas nas turmas por instrutor
-        print("📋 Criando índice instrutor_id em classes...")
-        result3 = await db.classes.create_index([("instrutor_id", 1)])
-        print(f"✅ Índice instrutor_id criado: {result3}")
+        # Índices declarados em indexes.py: (turma_id, data) único e data em attendances,
+        # instrutor_id em turmas (a collection usada pelo server - não "classes")
+        print("📋 Reconciliando índices de attendances e turmas...")
+        resultado = await reconcile_indexes(db, ["attendances", "turmas"])
+        for chave, itens in resultado.items():
+            for item in itens:
+                print(f"   {chave}: {item}")
         
-        # 4) Verificar se os índices foram criados
+        # Verificar se os índices foram criados
         print("\n📊 Verificando índices criados:")
         
-        # Listar índices da collection attendances
-        attendance_indexes = await db.attendances.list_indexes().to_list(None)
-        print("\n🔍 Índices em attendances:")
-        for idx in attendance_indexes:
-            print(f"   - {idx['name']}: {idx.get('key', 'N/A')}")
+        for collection in ("attendances", "turmas"):
+            indexes = await db[collection].list_indexes().to_list(None)
+            print(f"\n🔍 Índices em {collection}:")
+            for idx in indexes:
+                print(f"   - {idx['name']}: {idx.get('key', 'N/A')}")
         
-        # Listar índices da collection classes  
-        classes_indexes = await db.classes.list_indexes().to_list(None)
-        print("\n🔍 Índices em classes:")
-        for idx in classes_indexes:
-            print(f"   - {idx['name']}: {idx.get('key', 'N/A')}")
+        if resultado["conflitos"] or resultado["erros"]:
+            print("\n⚠️  Alguns índices não puderam ser criados (veja acima)")
+            return
         
         print("\n🎉 Todos os índices foram criados com sucesso!")
-        print("⚠️  IMPORTANTE: Execute este script apenas UMA VEZ")
+        print("ℹ️  O server também aplica estes índices no startup (indexes.py)")
         
     except Exception as e:
         print(f"❌ Erro ao criar índices: {e}")
@@ -0,0 +1,70 @@
+"""
+📊 Estatísticas do dashboard em poucas consultas concorrentes
+
+O /dashboard/stats carregava todos os alunos só para contar status e fazia um
+count_documents/find_one depois do outro. Aqui cada collection responde em uma
+única ida ao banco (status dos alunos num $group, mês e semana do rollup num
+$facet) e o server dispara as consultas independentes juntas com asyncio.gather.
+O payload pronto fica DASHBOARD_CACHE_TTL segundos em cache por escopo.
+"""
+
+import os
+from typing import Dict, Iterable, Optional, Tuple
+
+from attendance_rollups import DAILY_ROLLUP_COLLECTION
+
+DASHBOARD_CACHE_TTL = float(os.environ.get("DASHBOARD_CACHE_TTL", "5"))
+STATUS_CONTADOS = ("ativo", "desistente")
+
+
+def taxa_presenca(presentes: int, faltas: int) -> float:
+    total = presentes + faltas
+    return round((presentes / total * 100) if total > 0 else 0, 1)
+
+
+async def contar_status_alunos(db, aluno_ids: Optional[Iterable[str]] = None) -> Dict[str, int]:
+    """{"ativo": n, "desistente": n}; sem aluno_ids conta a collection inteira"""
+    contagens = {status: 0 for status in STATUS_CONTADOS}
+    match = {"status": {"$in": list(STATUS_CONTADOS)}}
+    if aluno_ids is not None:
+        aluno_ids = list(aluno_ids)
+        if not aluno_ids:
+            return contagens
+        match["id"] = {"$in": aluno_ids}
+
+    pipeline = [{"$match": match}, {"$group": {"_id": "$status", "total": {"$sum": 1}}}]
+    async for doc in db.alunos.aggregate(pipeline):
+        contagens[doc["_id"]] = doc["total"]
+    return contagens
+
+
+async def somar_rollup_periodos(db, inicios: Dict[str, str],
+                                turma_ids: Optional[Iterable[str]] = None) -> Dict[str, Tuple[int, int]]:
+    """nome -> (presentes, ausentes) de cada período [inicio, hoje], todos num $facet"""
+    resultado = {nome: (0, 0) for nome in inicios}
+    if not inicios:
+        return resultado
+    match = {"data": {"$gte": min(inicios.values())}}
+    if turma_ids is not None:
+        match["turma_id"] = {"$in": list(turma_ids)}
+
+    soma = {"_id": None, "presentes": {"$sum": "$presentes"}, "ausentes": {"$sum": "$ausentes"}}
+    pipeline = [
+        {"$match": match},
+        {"$facet": {
+            nome: [{"$match": {"data": {"$gte": inicio}}}, {"$group": soma}]
+            for nome, inicio in inicios.items()
+        }},
+    ]
+    async for doc in db[DAILY_ROLLUP_COLLECTION].aggregate(pipeline):
+        for nome, grupos in doc.items():
+            if grupos:
+                resultado[nome] = (grupos[0].get("presentes", 0), grupos[0].get("ausentes", 0))
+    return resultado
+
+
+async def buscar_nome(collection, documento_id: Optional[str], padrao: str) -> str:
+    if not documento_id:
+        return padrao
+    documento = await collection.find_one({"id": documento_id}, {"_id": 0, "nome": 1})
+    return (documento or {}).get("nome", padrao)
@@ -0,0 +1,127 @@
+"""
+📊 Frequência por aluno calculada no MongoDB (relatório /reports/student-frequency)
+
+Com período, o pipeline parte de attendances: $match no escopo e nas datas,
+normaliza os dois formatos de chamada (MARKS_STAGE), $unwind das marcações e
+$group por aluno. Sem período, soma os resumos materializados, que já têm os
+mesmos contadores. Nos dois casos o $lookup em alunos, o percentual e a
+classificação de risco são feitos no próprio pipeline, que devolve as linhas
+prontas, ordenadas por nome, para o CSV em streaming ou para a página JSON.
+"""
+
+from typing import List, Optional
+
+from attendance_rollups import MARKS_STAGE, SUMMARY_COLLECTION
+from risk_scoring import FAIXA_FREQUENCIA_PADRAO, FAIXAS_FREQUENCIA
+
+FREQUENCY_CSV_HEADER = [
+    "Nome do Aluno", "CPF", "Total de Chamadas", "Presencas", "Faltas",
+    "% Presença (Preciso)", "Classificação de Risco", "Status do Aluno",
+    "Data de Nascimento", "Email"
+]
+
+
+def _estagios_por_chamadas(query: dict) -> List[dict]:
+    return [
+        {"$match": query},
+        MARKS_STAGE,
+        {"$unwind": "$marks"},
+        {"$match": {"marks.aluno_id": {"$nin": [None, ""]}}},
+        {"$group": {
+            "_id": "$marks.aluno_id",
+            "turma_id": {"$first": "$turma_id"},
+            "total_chamadas": {"$sum": 1},
+            "total_presencas": {"$sum": {"$cond": ["$marks.presente", 1, 0]}},
+            "total_faltas": {"$sum": {"$cond": ["$marks.presente", 0, 1]}},
+        }},
+    ]
+
+
+def _estagios_por_resumos(turma_filter) -> List[dict]:
+    match = {"turma_id": turma_filter} if turma_filter is not None else {}
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": "$aluno_id",
+            "turma_id": {"$first": "$turma_id"},
+            "total_chamadas": {"$sum": "$total_chamadas"},
+            "total_presencas": {"$sum": "$presencas"},
+            "total_faltas": {"$sum": "$faltas"},
+        }},
+    ]
+
+
+# Dados do aluno, percentual com 2 casas e faixa de risco
+_ESTAGIOS_LINHA = [
+    {"$lookup": {"from": "alunos", "localField": "_id", "foreignField": "id", "as": "aluno"}},
+    {"$match": {"aluno.0": {"$exists": True}}},
+    {"$addFields": {"aluno": {"$arrayElemAt": ["$aluno", 0]}}},
+    {"$project": {
+        "_id": 0,
+        "aluno_id": "$_id",
+        "turma_id": 1,
+        "nome": {"$ifNull": ["$aluno.nome", ""]},
+        "cpf": {"$ifNull": ["$aluno.cpf", ""]},
+        "status": {"$ifNull": ["$aluno.status", "ativo"]},
+        "data_nascimento": "$aluno.data_nascimento",
+        "email": {"$ifNull": ["$aluno.email", "N/A"]},
+        "total_chamadas": 1,
+        "total_presencas": 1,
+        "total_faltas": 1,
+        "percentual": {"$cond": [
+            {"$gt": ["$total_chamadas", 0]},
+            {"$round": [{"$multiply": [{"$divide": ["$total_presencas", "$total_chamadas"]}, 100]}, 2]},
+            0.0,
+        ]},
+    }},
+    {"$addFields": {"risco": {"$switch": {
+        "branches": [
+            {"case": {"$gte": ["$percentual", minimo]}, "then": rotulo}
+            for minimo, rotulo in FAIXAS_FREQUENCIA
+        ],
+        "default": FAIXA_FREQUENCIA_PADRAO,
+    }}}},
+    {"$sort": {"nome": 1, "aluno_id": 1}},
+]
+
+
+def frequency_pipeline(query: dict, por_resumos: bool, skip: Optional[int] = None, limit: Optional[int] = None):
+    """(collection, pipeline) do relatório. Com skip/limit devolve um único
+    documento {"items": [...], "total": [{"n": ...}]} via $facet."""
+    if por_resumos:
+        collection = SUMMARY_COLLECTION
+        pipeline = _estagios_por_resumos(query.get("turma_id"))
+    else:
+        collection = "attendances"
+        pipeline = _estagios_por_chamadas(query)
+    pipeline = pipeline + _ESTAGIOS_LINHA
+
+    if limit is not None:
+        pipeline.append({"$facet": {
+            "items": [{"$skip": skip or 0}, {"$limit": limit}],
+            "total": [{"$count": "n"}],
+        }})
+    return collection, pipeline
+
+
+def formatar_data_nascimento(data_nasc) -> str:
+    if not data_nasc:
+        return "N/A"
+    if isinstance(data_nasc, str):
+        return data_nasc
+    return data_nasc.strftime("%d/%m/%Y") if hasattr(data_nasc, "strftime") else str(data_nasc)
+
+
+def frequency_csv_row(linha: dict) -> list:
+    return [
+        linha["nome"],
+        linha["cpf"],
+        linha["total_chamadas"],
+        linha["total_presencas"],
+        linha["total_faltas"],
+        f"{linha['percentual']:.2f}%",
+        linha["risco"],
+        str(linha["status"]).title(),
+        formatar_data_nascimento(linha.get("data_nascimento")),
+        linha["email"],
+    ]
@@ -0,0 +1,309 @@
+"""
+📦 Importação de alunos em segundo plano, com checkpoint e retomada
+
+O POST só guarda o arquivo no GridFS (bucket "imports") e cria o documento em
+`import_jobs`. Um worker no próprio processo lê o arquivo em lotes, chama o
+processador do tipo de importação e, a cada lote, grava os contadores e a
+quantidade de linhas processadas (checkpoint) junto com a renovação do lease.
+
+Se a instância cair ou for reiniciada no meio, o lease expira e qualquer
+instância retoma o job a partir do último lote confirmado. Os ids de alunos
+novos são determinísticos por (job, linha), então o lote interrompido pode ser
+refeito sem duplicar alunos. Os erros ficam em `import_job_errors`, paginados.
+"""
+
+import asyncio
+import os
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument
+
+from import_pipeline import iter_upload_chunks
+
+IMPORT_JOB_BATCH = int(os.environ.get("IMPORT_JOB_BATCH", "500"))
+IMPORT_JOB_LEASE = float(os.environ.get("IMPORT_JOB_LEASE_SECONDS", "300"))
+IMPORT_JOB_POLL = float(os.environ.get("IMPORT_JOB_POLL_SECONDS", "60"))
+
+# Status no mesmo vocabulário dos jobs de CSV de relatório
+STATUS_PENDENTES = ("queued", "processing")
+
+_NAMESPACE_IMPORT = uuid.UUID("6f1c2a8e-3b7d-4e59-9a0c-51d2e7b4c3a1")
+
+
+def id_deterministico(job_id: str, linha: Any) -> str:
+    """Id do aluno criado pela linha `linha` do job: o mesmo em qualquer tentativa"""
+    return str(uuid.uuid5(_NAMESPACE_IMPORT, f"{job_id}:{linha}"))
+
+
+@dataclass(frozen=True)
+class TipoImportacao:
+    """Como um tipo de importação é executado pelo worker"""
+    # job -> estado compartilhado entre os lotes (lança HTTPException se o job não pode rodar)
+    preparar: Callable[[dict], Awaitable[Any]]
+    # (arquivo do GridFS, job, estado ou None na contagem) -> linhas do arquivo
+    linhas: Callable[[Any, dict, Any], Awaitable[AsyncIterator[dict]]]
+    # (estado, lote) -> (contadores do lote, erros do lote com "line")
+    processar_lote: Callable[[Any, List[dict]], Awaitable[Tuple[Dict[str, int], List[dict]]]]
+
+
+async def _lotes(linhas: AsyncIterator[dict], pular: int, tamanho: int) -> AsyncIterator[List[dict]]:
+    """Descarta as `pular` linhas já confirmadas e agrupa o resto em lotes"""
+    lote = []
+    async for linha in linhas:
+        if pular:
+            pular -= 1
+            continue
+        lote.append(linha)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _agora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class ImportJobRunner:
+    """Fila de importações persistida no Mongo, executada por tarefas asyncio"""
+
+    def __init__(self, db, bucket_name: str = "imports"):
+        self.db = db
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=bucket_name)
+        self.instancia = str(uuid.uuid4())
+        self.tipos: Dict[str, TipoImportacao] = {}
+        self._tarefas: Dict[str, asyncio.Task] = {}
+        self._vigia: Optional[asyncio.Task] = None
+
+    def registrar(self, tipo: str, importacao: TipoImportacao):
+        self.tipos[tipo] = importacao
+
+    async def criar(self, tipo: str, upload, filename: str, user_id: str, params: dict) -> dict:
+        """Copia o upload para o GridFS em blocos, registra o job e agenda a execução"""
+        if tipo not in self.tipos:
+            raise ValueError(f"Tipo de importação desconhecido: {tipo}")
+
+        grid_in = self.bucket.open_upload_stream(
+            filename, metadata={"tipo": "import_job", "uploaded_by": user_id}
+        )
+        try:
+            async for bloco in iter_upload_chunks(upload):
+                await grid_in.write(bloco)
+        except BaseException:
+            await grid_in.abort()
+            raise
+        await grid_in.close()
+
+        agora = _agora()
+        job = {
+            "id": str(uuid.uuid4()),
+            "type": tipo,
+            "status": "queued",
+            "user_id": user_id,
+            "filename": filename,
+            "file_id": grid_in._id,
+            "params": params,
+            "total_rows": None,
+            "processed_rows": 0,
+            "errors_count": 0,
+            "counters": {},
+            "attempts": 0,
+            "lease_owner": None,
+            "lease_until": None,
+            "error": None,
+            "created_at": agora,
+            "updated_at": agora,
+            "completed_at": None,
+        }
+        await self.db.import_jobs.insert_one(dict(job))
+        self._agendar(job["id"])
+        return job
+
+    async def obter(self, job_id: str) -> Optional[dict]:
+        job = await self.db.import_jobs.find_one({"id": job_id}, {"_id": 0, "file_id": 0, "lease_owner": 0})
+        if job is None:
+            return None
+        total = job.get("total_rows")
+        if job["status"] == "completed":
+            job["progress"] = 100
+        elif total:
+            job["progress"] = min(99, int(job["processed_rows"] * 100 / total))
+        else:
+            job["progress"] = 0
+        return job
+
+    async def listar_erros(self, job_id: str, skip: int, limit: int) -> dict:
+        filtro = {"job_id": job_id}
+        total = await self.db.import_job_errors.count_documents(filtro)
+        itens = await self.db.import_job_errors.find(
+            filtro, {"_id": 0, "job_id": 0}
+        ).sort("seq", 1).skip(skip).limit(limit).to_list(limit)
+        return {"items": itens, "total": total, "skip": skip, "limit": limit}
+
+    # ------------------------------------------------------------------
+    # Execução
+    # ------------------------------------------------------------------
+    def _agendar(self, job_id: str):
+        tarefa = self._tarefas.get(job_id)
+        if tarefa is not None and not tarefa.done():
+            return
+        self._tarefas[job_id] = asyncio.create_task(self._executar(job_id))
+
+    async def _reservar(self, job_id: str) -> Optional[dict]:
+        """Pega o lease do job se ninguém o detém (ou se o lease anterior expirou)"""
+        agora = _agora()
+        return await self.db.import_jobs.find_one_and_update(
+            {
+                "id": job_id,
+                "status": {"$in": list(STATUS_PENDENTES)},
+                "$or": [{"lease_until": None}, {"lease_until": {"$lt": agora}}],
+            },
+            {
+                "$set": {
+                    "status": "processing",
+                    "lease_owner": self.instancia,
+                    "lease_until": agora + timedelta(seconds=IMPORT_JOB_LEASE),
+                    "updated_at": agora,
+                },
+                "$min": {"started_at": agora},
+                "$inc": {"attempts": 1},
+            },
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _checkpoint(self, job_id: str, contadores: Dict[str, int], linhas: int, erros: int) -> bool:
+        """Confirma um lote e renova o lease; False se outra instância assumiu o job"""
+        agora = _agora()
+        incrementos = {f"counters.{chave}": valor for chave, valor in contadores.items()}
+        incrementos["processed_rows"] = linhas
+        incrementos["errors_count"] = erros
+        resultado = await self.db.import_jobs.update_one(
+            {"id": job_id, "lease_owner": self.instancia},
+            {
+                "$inc": incrementos,
+                "$set": {"lease_until": agora + timedelta(seconds=IMPORT_JOB_LEASE), "updated_at": agora},
+            },
+        )
+        return resultado.matched_count == 1
+
+    async def _finalizar(self, job: dict, status: str, erro: Optional[str] = None):
+        agora = _agora()
+        await self.db.import_jobs.update_one(
+            {"id": job["id"], "lease_owner": self.instancia},
+            {"$set": {
+                "status": status,
+                "error": erro,
+                "lease_owner": None,
+                "lease_until": None,
+                "updated_at": agora,
+                "completed_at": agora,
+            }},
+        )
+        try:
+            await self.bucket.delete(job["file_id"])
+        except Exception as e:
+            print(f"⚠️ Erro ao remover arquivo do job {job['id']} do GridFS: {e}")
+
+    async def _contar_linhas(self, tipo: TipoImportacao, job: dict) -> int:
+        arquivo = await self.bucket.open_download_stream(job["file_id"])
+        total = 0
+        async for _ in await tipo.linhas(arquivo, job, None):
+            total += 1
+        return total
+
+    async def _executar(self, job_id: str):
+        job = await self._reservar(job_id)
+        if job is None:
+            return
+        tipo = self.tipos[job["type"]]
+        print(f"📦 Job de importação {job_id} ({job['type']}) - tentativa {job['attempts']}, "
+              f"retomando da linha {job['processed_rows']}")
+
+        try:
+            estado = await tipo.preparar(job)
+
+            # Erros gravados depois do último checkpoint pertencem ao lote que será refeito
+            await self.db.import_job_errors.delete_many({"job_id": job_id, "seq": {"$gte": job["errors_count"]}})
+
+            if job.get("total_rows") is None:
+                total = await self._contar_linhas(tipo, job)
+                await self.db.import_jobs.update_one({"id": job_id}, {"$set": {"total_rows": total}})
+                # A contagem relê o arquivo inteiro: renova o lease antes do primeiro lote
+                await self._checkpoint(job_id, {}, 0, 0)
+
+            seq = job["errors_count"]
+            arquivo = await self.bucket.open_download_stream(job["file_id"])
+            linhas = await tipo.linhas(arquivo, job, estado)
+            async for lote in _lotes(linhas, job["processed_rows"], IMPORT_JOB_BATCH):
+                contadores, erros = await tipo.processar_lote(estado, lote)
+                if erros:
+                    await self.db.import_job_errors.insert_many([
+                        {**erro, "job_id": job_id, "seq": seq + i} for i, erro in enumerate(erros)
+                    ])
+                seq += len(erros)
+                if not await self._checkpoint(job_id, contadores, len(lote), len(erros)):
+                    print(f"⚠️ Job {job_id}: lease perdido, outra instância continua a importação")
+                    return
+
+            await self._finalizar(job, "completed")
+            print(f"✅ Job de importação {job_id} concluído")
+        except asyncio.CancelledError:
+            # Desligamento: parar() libera o lease e o job é retomado em seguida
+            raise
+        except Exception as e:
+            # HTTPException (permissão, cabeçalho inválido...) traz a mensagem em detail
+            detalhe = getattr(e, "detail", None) or str(e)
+            print(f"❌ Job de importação {job_id} falhou: {detalhe}")
+            await self._finalizar(job, "failed", str(detalhe))
+        finally:
+            self._tarefas.pop(job_id, None)
+
+    async def retomar_pendentes(self) -> int:
+        """Agenda os jobs sem dono (criados por outra instância ou com lease expirado)"""
+        agendados = 0
+        cursor = self.db.import_jobs.find(
+            {
+                "status": {"$in": list(STATUS_PENDENTES)},
+                "$or": [{"lease_until": None}, {"lease_until": {"$lt": _agora()}}],
+            },
+            {"_id": 0, "id": 1},
+        )
+        async for job in cursor:
+            self._agendar(job["id"])
+            agendados += 1
+        return agendados
+
+    async def _vigiar(self):
+        while True:
+            try:
+                agendados = await self.retomar_pendentes()
+                if agendados:
+                    print(f"📦 {agendados} job(s) de importação retomados")
+            except Exception as e:
+                print(f"⚠️ Erro ao procurar jobs de importação pendentes: {e}")
+            await asyncio.sleep(IMPORT_JOB_POLL)
+
+    def iniciar(self):
+        """Chamado no startup: retoma pendentes agora e verifica de novo a cada IMPORT_JOB_POLL"""
+        if self._vigia is None:
+            self._vigia = asyncio.create_task(self._vigiar())
+
+    async def parar(self):
+        """Chamado no shutdown: interrompe os workers e libera os leases desta instância"""
+        tarefas = list(self._tarefas.values())
+        if self._vigia is not None:
+            tarefas.append(self._vigia)
+            self._vigia = None
+        for tarefa in tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+        await self.db.import_jobs.update_many(
+            {"lease_owner": self.instancia, "status": "processing"},
+            {"$set": {"lease_owner": None, "lease_until": None}},
+        )
@@ -0,0 +1,320 @@
+"""
+📥 Leitura em streaming dos arquivos de importação de alunos (CSV, XLSX, XLS)
+
+O UploadFile é lido em blocos e decodificado incrementalmente. Cada registro
+CSV é fechado quando a quantidade de aspas acumulada fica par, o que respeita
+campos entre aspas com quebra de linha. XLSX é copiado para um arquivo
+temporário e lido pelo openpyxl em modo read_only, em lotes numa thread. Assim
+o pico de memória não depende do tamanho da planilha. O XLS legado continua
+passando pelo pandas.
+"""
+
+import asyncio
+import codecs
+import csv
+import heapq
+import os
+import tempfile
+from itertools import islice
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+IMPORT_READ_CHUNK = 64 * 1024  # bytes por leitura do UploadFile
+IMPORT_XLSX_BATCH = 500  # linhas da planilha lidas por ida à thread
+
+
+class ErrosLimitados:
+    """Guarda só os `limite` erros de menor linha e conta todos os demais"""
+
+    def __init__(self, limite: int = 50):
+        self.limite = limite
+        self.total = 0
+        self._heap = []  # (-linha, ordem, erro): o topo é a maior linha guardada
+
+    def append(self, erro: Dict[str, Any]):
+        self.total += 1
+        linha = erro.get("line")
+        chave = (-(linha if isinstance(linha, int) else 0), -self.total, erro)
+        if len(self._heap) < self.limite:
+            heapq.heappush(self._heap, chave)
+        elif chave[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, chave)
+
+    def __len__(self) -> int:
+        return self.total
+
+    def primeiros(self) -> List[Dict[str, Any]]:
+        return [erro for _, _, erro in sorted(self._heap, key=lambda item: (-item[0], -item[1]))]
+
+
+async def iter_upload_chunks(upload, chunk_size: int = IMPORT_READ_CHUNK) -> AsyncIterator[bytes]:
+    while True:
+        bloco = await upload.read(chunk_size)
+        if not bloco:
+            break
+        yield bloco
+
+
+class _DecodificadorAuto:
+    """UTF-8 enquanto for válido; no primeiro byte inválido passa a Windows-1252
+    (Excel brasileiro) e, se nem isso servir, ISO-8859-1 - a mesma ordem de antes"""
+
+    def __init__(self):
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.encoding = "utf-8"
+
+    def decode(self, dados: bytes, final: bool = False) -> str:
+        if self.encoding == "utf-8":
+            pendente = self._utf8.getstate()[0]
+            try:
+                return self._utf8.decode(dados, final)
+            except UnicodeDecodeError:
+                dados = pendente + dados
+                self.encoding = "windows-1252"
+        if self.encoding == "windows-1252":
+            try:
+                return dados.decode("windows-1252")
+            except UnicodeDecodeError:
+                self.encoding = "iso-8859-1"
+        return dados.decode("iso-8859-1")
+
+
+async def iter_text(upload, encoding: str = "auto", errors: str = "strict") -> AsyncIterator[str]:
+    """Texto do upload em blocos; encoding="auto" aplica o fallback UTF-8 -> 1252 -> latin-1"""
+    if encoding == "auto":
+        decodificador = _DecodificadorAuto()
+    else:
+        decodificador = codecs.getincrementaldecoder(encoding)(errors)
+    async for bloco in iter_upload_chunks(upload):
+        texto = decodificador.decode(bloco)
+        if texto:
+            yield texto
+    texto = decodificador.decode(b"", final=True)
+    if texto:
+        yield texto
+
+
+async def iter_lines(textos: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Linhas terminadas em \\n (como StringIO), sem montar o arquivo inteiro"""
+    resto = ""
+    async for texto in textos:
+        partes = (resto + texto).split("\n")
+        resto = partes.pop()
+        for parte in partes:
+            yield parte + "\n"
+    if resto:
+        yield resto
+
+
+async def iter_records(linhas: AsyncIterator[str]) -> AsyncIterator[List[str]]:
+    """Agrupa linhas em registros CSV: um registro termina quando as aspas fecham"""
+    registro = []
+    aspas = 0
+    async for linha in linhas:
+        registro.append(linha)
+        aspas += linha.count('"')
+        if aspas % 2 == 0:
+            yield registro
+            registro = []
+            aspas = 0
+    if registro:
+        yield registro
+
+
+class _FilaDeLinhas:
+    """Iterador retomável para o csv.reader: recebe as linhas de um registro por vez"""
+
+    def __init__(self):
+        self.linhas = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.linhas:
+            raise StopIteration
+        return self.linhas.pop(0)
+
+
+class CsvDictStream:
+    """Equivalente assíncrono do csv.DictReader sobre o upload (mesmas regras de
+    linhas vazias, colunas sobrando em None e faltando como None)"""
+
+    def __init__(self, upload, encoding: str = "auto", errors: str = "strict"):
+        self._registros = iter_records(iter_lines(iter_text(upload, encoding, errors)))
+        self._fila = _FilaDeLinhas()
+        self._reader = None
+        self.delimiter = None
+        self.fieldnames: Optional[List[str]] = None
+
+    async def _proxima_linha_csv(self) -> Optional[List[str]]:
+        # Aspa solta no meio de um campo (ex.: 5" polegadas) engana a paridade e junta
+        # linhas a mais; o reader devolve só a primeira e o resto fica na fila
+        if self._fila.linhas:
+            return next(self._reader, [])
+        try:
+            registro = await self._registros.__anext__()
+        except StopAsyncIteration:
+            return None
+        if self._reader is None:
+            # Detectar separador pela primeira linha (vírgula ou ponto e vírgula)
+            self.delimiter = "," if "," in registro[0].split("\n")[0] else ";"
+            self._reader = csv.reader(self._fila, delimiter=self.delimiter)
+        self._fila.linhas.extend(registro)
+        return next(self._reader, [])
+
+    async def start(self) -> Optional[List[str]]:
+        """Lê o cabeçalho; None se o arquivo não tem nenhuma linha"""
+        self.fieldnames = await self._proxima_linha_csv()
+        return self.fieldnames
+
+    async def __aiter__(self):
+        if self.fieldnames is None:
+            await self.start()
+        if self.fieldnames is None:
+            return
+        total_colunas = len(self.fieldnames)
+        while True:
+            linha = await self._proxima_linha_csv()
+            if linha is None:
+                return
+            if linha == []:
+                continue
+            registro = dict(zip(self.fieldnames, linha))
+            if total_colunas < len(linha):
+                registro[None] = linha[total_colunas:]
+            elif total_colunas > len(linha):
+                for coluna in self.fieldnames[len(linha):]:
+                    registro[coluna] = None
+            yield registro
+
+
+async def spool_upload(upload, sufixo: str) -> str:
+    """Copia o upload em blocos para um arquivo temporário e devolve o caminho"""
+    destino = tempfile.NamedTemporaryFile(suffix=sufixo, delete=False)
+    try:
+        async for bloco in iter_upload_chunks(upload):
+            await asyncio.to_thread(destino.write, bloco)
+    except BaseException:
+        destino.close()
+        os.unlink(destino.name)
+        raise
+    destino.close()
+    return destino.name
+
+
+def _nomes_colunas(cabecalho) -> List[str]:
+    """Nomes de coluna como o pandas gera (vazios viram "Unnamed: i", repetidos ganham .1, .2)"""
+    nomes = []
+    vistos: Dict[str, int] = {}
+    for i, valor in enumerate(cabecalho):
+        nome = str(valor) if valor is not None else f"Unnamed: {i}"
+        if nome in vistos:
+            vistos[nome] += 1
+            nome = f"{nome}.{vistos[nome]}"
+        else:
+            vistos[nome] = 0
+        nomes.append(nome)
+    return nomes
+
+
+def _abrir_xlsx(caminho: str):
+    from openpyxl import load_workbook
+
+    planilha = load_workbook(caminho, read_only=True, data_only=True)
+    return planilha, planilha.worksheets[0].iter_rows(values_only=True)
+
+
+async def iter_xlsx_rows(upload, lote: int = IMPORT_XLSX_BATCH, cabecalho: Optional[List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Linhas da primeira aba como {coluna: texto, "_line": n}; linhas vazias no
+    fim da planilha são descartadas (como no pandas)"""
+    caminho = await spool_upload(upload, ".xlsx")
+    try:
+        planilha, linhas = await asyncio.to_thread(_abrir_xlsx, caminho)
+        try:
+            primeira = await asyncio.to_thread(next, linhas, None)
+            if primeira is None:
+                return
+            colunas = [nome.strip() for nome in _nomes_colunas(primeira)]
+            if cabecalho is not None:
+                cabecalho.extend(colunas)
+            numero = 1  # header é a linha 1
+            vazias = []
+            while True:
+                bloco = await asyncio.to_thread(lambda: list(islice(linhas, lote)))
+                if not bloco:
+                    break
+                for valores in bloco:
+                    numero += 1
+                    clean_row = {"_line": numero}
+                    for coluna, valor in zip(colunas, valores):
+                        if valor is not None and str(valor).strip():
+                            clean_row[coluna] = str(valor).strip()
+                    if len(clean_row) == 1:
+                        vazias.append(clean_row)
+                        continue
+                    for vazia in vazias:
+                        yield vazia
+                    vazias.clear()
+                    yield clean_row
+        finally:
+            planilha.close()
+    finally:
+        os.unlink(caminho)
+
+
+def _ler_xls(caminho: str, cabecalho: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    import pandas as pd
+
+    df = pd.read_excel(caminho, dtype=str)
+    df = df.fillna("")  # Substituir NaN por string vazia
+    if cabecalho is not None:
+        cabecalho.extend(str(k).strip() for k in df.columns)
+    linhas = []
+    for idx, r in df.iterrows():
+        clean_row = {"_line": idx + 2}  # +2 porque header é linha 1
+        for k, v in r.items():
+            if not pd.isna(v) and str(v).strip():
+                clean_row[str(k).strip()] = str(v).strip()
+        linhas.append(clean_row)
+    return linhas
+
+
+async def iter_xls_rows(upload, cabecalho: Optional[List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """XLS legado (formato binário): sem leitor em streaming, continua no pandas"""
+    caminho = await spool_upload(upload, ".xls")
+    try:
+        for clean_row in await asyncio.to_thread(_ler_xls, caminho, cabecalho):
+            yield clean_row
+    finally:
+        os.unlink(caminho)
+
+
+def _limpar(valor) -> str:
+    # Remover BOM e caracteres especiais
+    return str(valor).strip().lstrip('\ufeff').lstrip('�')
+
+
+async def iter_csv_clean_rows(upload, encoding: str = "utf-8", errors: str = "replace",
+                              cabecalho: Optional[List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Linhas do CSV limpas e numeradas ("_line" a partir de 2), só com campos preenchidos"""
+    leitor = CsvDictStream(upload, encoding, errors)
+    if cabecalho is not None and await leitor.start():
+        cabecalho.extend(_limpar(k) for k in leitor.fieldnames if k)
+    i = 1
+    async for r in leitor:
+        i += 1
+        clean_row = {"_line": i}
+        for k, v in r.items():
+            if k and v:
+                clean_row[_limpar(k)] = _limpar(v)
+        yield clean_row
+
+
+def iter_upload_rows(upload, filename: str, cabecalho: Optional[List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """CSV (ou extensão desconhecida), XLSX ou XLS conforme o nome do arquivo.
+    Se `cabecalho` for uma lista, recebe os nomes das colunas antes da primeira linha"""
+    if filename.endswith(".xlsx"):
+        return iter_xlsx_rows(upload, cabecalho=cabecalho)
+    if filename.endswith(".xls"):
+        return iter_xls_rows(upload, cabecalho)
+    return iter_csv_clean_rows(upload, cabecalho=cabecalho)
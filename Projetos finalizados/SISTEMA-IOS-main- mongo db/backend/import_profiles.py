@@ -0,0 +1,89 @@
+"""
+🗺️ Perfis de importação: de qual coluna da planilha vem cada campo do aluno
+
+Cada parceiro manda planilhas com cabeçalhos próprios ("CPF do Aluno",
+"Dt. Nasc."...). Um perfil salvo em `import_profiles` lista, por campo, os
+cabeçalhos daquele modelo de planilha. Por arquivo, o cabeçalho é compilado uma
+única vez em campo -> colunas candidatas (perfil primeiro, depois os aliases
+padrão), e cada linha passa a ser lida direto pelas colunas, sem comparar
+nomes normalizados linha a linha.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Aliases aceitos desde sempre pelo upload em massa (mesma ordem de prioridade)
+CAMPOS_PADRAO: Dict[str, Tuple[str, ...]] = {
+    "nome": ("nome_completo", "nome", "full_name", "student_name"),
+    "data_nascimento": ("data_nascimento", "data nascimento", "birthdate", "dob", "data_nasc"),
+    "cpf": ("cpf", "CPF", "Cpf", "document"),
+    "email": ("email", "e-mail", "Email"),
+    "telefone": ("telefone", "phone", "celular", "tel"),
+    "rg": ("rg", "RG", "identidade"),
+    "genero": ("genero", "sexo", "gender"),
+    "endereco": ("endereco", "endereço", "address"),
+}
+
+MapaCampos = Dict[str, Tuple[str, ...]]
+
+
+def normalizar_coluna(nome: str) -> str:
+    return nome.lower().replace(" ", "_").replace("-", "_")
+
+
+def validar_mapeamento(mapeamento: Dict[str, List[str]]) -> Optional[str]:
+    """Mensagem de erro se o mapeamento usa campo desconhecido ou cabeçalho vazio"""
+    desconhecidos = [campo for campo in mapeamento if campo not in CAMPOS_PADRAO]
+    if desconhecidos:
+        return f"Campos desconhecidos: {', '.join(desconhecidos)}. Válidos: {', '.join(CAMPOS_PADRAO)}"
+    for campo, cabecalhos in mapeamento.items():
+        if not cabecalhos or any(not str(c).strip() for c in cabecalhos):
+            return f"Informe ao menos um cabeçalho não vazio para '{campo}'"
+    return None
+
+
+def compilar_mapa(colunas: Iterable[str], perfil: Optional[dict] = None) -> MapaCampos:
+    """campo -> colunas da planilha a consultar, em ordem. Para cada alias vale a
+    coluna de nome idêntico e depois as de nome normalizado igual (a mesma
+    precedência da antiga busca por aliases, feita agora uma vez por arquivo)"""
+    colunas = [c for c in colunas if c != "_line"]
+    existentes = set(colunas)
+    por_nome_normalizado: Dict[str, List[str]] = {}
+    for coluna in colunas:
+        por_nome_normalizado.setdefault(normalizar_coluna(coluna), []).append(coluna)
+
+    mapeamento = (perfil or {}).get("mapeamento") or {}
+    mapa = {}
+    for campo, padrao in CAMPOS_PADRAO.items():
+        candidatos = []
+        for alias in [*mapeamento.get(campo, []), *padrao]:
+            if alias in existentes:
+                candidatos.append(alias)
+            candidatos.extend(por_nome_normalizado.get(normalizar_coluna(alias), []))
+        mapa[campo] = tuple(dict.fromkeys(candidatos))
+    return mapa
+
+
+def valor_campo(linha: Dict[str, Any], candidatos: Tuple[str, ...]):
+    """Primeiro valor preenchido entre as colunas candidatas"""
+    for coluna in candidatos:
+        valor = linha.get(coluna)
+        if valor:
+            return valor
+    return None
+
+
+def detectar_perfil(colunas: Iterable[str], perfis: List[dict]) -> Optional[dict]:
+    """Perfil com mais cabeçalhos presentes na planilha (em empate, o primeiro da
+    lista, que vem ordenada do mais recente); None se nenhum cabeçalho bate"""
+    presentes = {normalizar_coluna(c) for c in colunas}
+    melhor, melhor_pontos = None, 0
+    for perfil in perfis:
+        cabecalhos = {
+            normalizar_coluna(c)
+            for lista in (perfil.get("mapeamento") or {}).values()
+            for c in lista
+        }
+        pontos = len(cabecalhos & presentes)
+        if pontos > melhor_pontos:
+            melhor, melhor_pontos = perfil, pontos
+    return melhor
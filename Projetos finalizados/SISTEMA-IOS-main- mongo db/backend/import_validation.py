@@ -0,0 +1,223 @@
+"""
+✅ Validação dos campos de importação de alunos (CPF e data de nascimento)
+
+As funções linha a linha (normalize_cpf, validate_cpf, parse_date_str) continuam
+sendo a referência. validar_lote() faz o mesmo trabalho para um lote inteiro com
+NumPy: os textos viram uma matriz de code points, os dígitos verificadores do CPF
+são calculados de uma vez e as datas nos formatos fixos de 10 caracteres são
+decompostas por posição. Toda linha que o caminho vetorizado não consegue
+decidir com certeza (caracteres não ASCII, data fora dos formatos fixos,
+data inválida) passa pelas funções de referência, então resultados e mensagens
+de erro são os mesmos.
+"""
+
+import re
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import List, Optional, Sequence
+
+import numpy as np
+from dateutil import parser as dateutil_parser
+
+# Formatos testados por parse_date_str, na mesma ordem
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%Y/%m/%d")
+
+# Posições (ano, mês, dia, separadores) de cada formato em um texto de 10 caracteres
+_LAYOUTS = (
+    {"ano": (0, 4), "mes": (5, 7), "dia": (8, 10), "sep": "-", "pos_sep": (4, 7)},
+    {"ano": (6, 10), "mes": (3, 5), "dia": (0, 2), "sep": "/", "pos_sep": (2, 5)},
+    {"ano": (6, 10), "mes": (3, 5), "dia": (0, 2), "sep": "-", "pos_sep": (2, 5)},
+    {"ano": (0, 4), "mes": (5, 7), "dia": (8, 10), "sep": "/", "pos_sep": (4, 7)},
+)
+
+CPF_MAX_CHARS = 32  # CPFs maiores que isso (lixo na célula) vão pelo caminho linha a linha
+_PESOS_D1 = np.arange(10, 1, -1)
+_PESOS_D2 = np.arange(11, 1, -1)
+_ZERO = ord("0")
+
+
+def normalize_cpf(raw: str) -> str:
+    """Remove all non-digit characters from CPF"""
+    if raw is None:
+        return ""
+    s = re.sub(r"\D", "", str(raw))
+    return s
+
+def validate_cpf(cpf: str) -> bool:
+    """Validate Brazilian CPF number"""
+    cpf = normalize_cpf(cpf)
+    if len(cpf) != 11:
+        return False
+    # evita sequências iguais
+    if cpf == cpf[0] * 11:
+        return False
+
+    def calc_digit(cpf_slice: str) -> int:
+        size = len(cpf_slice) + 1
+        total = 0
+        for i, ch in enumerate(cpf_slice):
+            total += int(ch) * (size - i)
+        r = total % 11
+        return 0 if r < 2 else 11 - r
+
+    d1 = calc_digit(cpf[:9])
+    d2 = calc_digit(cpf[:10])
+    return d1 == int(cpf[9]) and d2 == int(cpf[10])
+
+def parse_date_str(s: str) -> date:
+    """Parse date string in various formats"""
+    if s is None:
+        raise ValueError("Data vazia")
+    s = str(s).strip()
+    # tenta formatos comuns
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(s, fmt).date()
+        except Exception:
+            pass
+    # fallback mais flexível
+    try:
+        return dateutil_parser.parse(s, dayfirst=True).date()
+    except Exception as e:
+        raise ValueError("Formato de data inválido. Utilize YYYY-MM-DD ou DD/MM/YYYY") from e
+
+
+def _matriz(textos: Sequence[str], largura: int) -> np.ndarray:
+    """Textos (todos com len <= largura) como matriz (n, largura) de code points, 0 no preenchimento"""
+    if not textos:
+        return np.zeros((0, largura), dtype=np.uint32)
+    return np.array(textos, dtype=f"<U{largura}").view(np.uint32).reshape(len(textos), largura)
+
+
+def _numero(digitos: np.ndarray) -> np.ndarray:
+    """Colunas de dígitos ASCII -> inteiro por linha"""
+    valor = np.zeros(len(digitos), dtype=np.int64)
+    for coluna in range(digitos.shape[1]):
+        valor = valor * 10 + (digitos[:, coluna].astype(np.int64) - _ZERO)
+    return valor
+
+
+def cpfs_em_lote(cpfs_raw: Sequence[Optional[str]]):
+    """(normalizados, válidos) para uma coluna de CPFs, equivalente a normalize_cpf/validate_cpf"""
+    n = len(cpfs_raw)
+    normalizados: List[str] = [""] * n
+    validos = np.zeros(n, dtype=bool)
+
+    textos = ["" if c is None else str(c) for c in cpfs_raw]
+    rapidos = [i for i, t in enumerate(textos) if len(t) <= CPF_MAX_CHARS and t.isascii()]
+    rapidos_set = set(rapidos)
+    for i in range(n):
+        if i not in rapidos_set:
+            # \D do regex respeita dígitos Unicode: só o caminho de referência garante o mesmo texto
+            normalizados[i] = normalize_cpf(cpfs_raw[i])
+            validos[i] = validate_cpf(normalizados[i])
+
+    if not rapidos:
+        return normalizados, validos
+
+    chars = _matriz([textos[i] for i in rapidos], CPF_MAX_CHARS)
+    eh_digito = (chars >= _ZERO) & (chars <= _ZERO + 9)
+    quantidade = eh_digito.sum(axis=1)
+    # Ordenação estável por "não é dígito" empurra os dígitos para a esquerda sem mudar a ordem
+    ordem = np.argsort(~eh_digito, axis=1, kind="stable")
+    compactado = np.take_along_axis(chars, ordem, axis=1)
+    compactado[np.arange(CPF_MAX_CHARS)[None, :] >= quantidade[:, None]] = 0
+    textos_norm = compactado.copy().view(f"<U{CPF_MAX_CHARS}").ravel().tolist()
+
+    d = compactado[:, :11].astype(np.int64) - _ZERO
+    onze = quantidade == 11
+    iguais = (d == d[:, :1]).all(axis=1)
+    r1 = (d[:, :9] @ _PESOS_D1) % 11
+    r2 = (d[:, :10] @ _PESOS_D2) % 11
+    d1 = np.where(r1 < 2, 0, 11 - r1)
+    d2 = np.where(r2 < 2, 0, 11 - r2)
+    ok = onze & ~iguais & (d1 == d[:, 9]) & (d2 == d[:, 10])
+
+    for pos, i in enumerate(rapidos):
+        normalizados[i] = textos_norm[pos]
+    validos[np.array(rapidos)] = ok
+    return normalizados, validos
+
+
+def datas_em_lote(datas_raw: Sequence[Optional[str]]):
+    """(iso, erros) para uma coluna de datas: iso[i] no formato YYYY-MM-DD ou None,
+    erros[i] com a mensagem de parse_date_str quando a data é inválida"""
+    n = len(datas_raw)
+    iso: List[Optional[str]] = [None] * n
+    erros: List[Optional[str]] = [None] * n
+
+    textos = ["" if d is None else str(d).strip() for d in datas_raw]
+    candidatos = [i for i, t in enumerate(textos) if len(t) == 10 and t.isascii()]
+    resolvidos = np.zeros(n, dtype=bool)
+
+    if candidatos:
+        chars = _matriz([textos[i] for i in candidatos], 10)
+        eh_digito = (chars >= _ZERO) & (chars <= _ZERO + 9)
+        pendente = np.ones(len(candidatos), dtype=bool)
+
+        # Mesma precedência de parse_date_str: o primeiro formato com o layout decide
+        for layout in _LAYOUTS:
+            p1, p2 = layout["pos_sep"]
+            colunas_digito = [c for c in range(10) if c not in (p1, p2)]
+            casa = (
+                pendente
+                & (chars[:, p1] == ord(layout["sep"]))
+                & (chars[:, p2] == ord(layout["sep"]))
+                & eh_digito[:, colunas_digito].all(axis=1)
+            )
+            if not casa.any():
+                continue
+            pendente &= ~casa
+
+            ano = _numero(chars[:, slice(*layout["ano"])])
+            mes = _numero(chars[:, slice(*layout["mes"])])
+            dia = _numero(chars[:, slice(*layout["dia"])])
+            mes_valido = (mes >= 1) & (mes <= 12)
+            inicio_mes = (
+                (np.clip(ano, 1, 9999) - 1970).astype("datetime64[Y]").astype("datetime64[M]")
+                + (np.clip(mes, 1, 12) - 1)
+            )
+            dias_no_mes = ((inicio_mes + 1).astype("datetime64[D]") - inicio_mes.astype("datetime64[D]")).astype(np.int64)
+            # Ano 0000 e datas impossíveis (31/02) ficam para parse_date_str decidir
+            valida = casa & (ano >= 1) & mes_valido & (dia >= 1) & (dia <= dias_no_mes)
+
+            if valida.any():
+                a, m, d = ano[valida], mes[valida], dia[valida]
+                saida = np.char.add(
+                    np.char.add(np.char.add(np.char.zfill(a.astype(str), 4), "-"), np.char.zfill(m.astype(str), 2)),
+                    np.char.add("-", np.char.zfill(d.astype(str), 2)),
+                ).tolist()
+                for pos, texto in zip(np.flatnonzero(valida), saida):
+                    i = candidatos[pos]
+                    iso[i] = texto
+                    resolvidos[i] = True
+
+    for i in np.flatnonzero(~resolvidos):
+        if not datas_raw[i]:
+            continue
+        try:
+            iso[i] = parse_date_str(datas_raw[i]).isoformat()
+        except Exception as e:
+            erros[i] = str(e)
+    return iso, erros
+
+
+@dataclass
+class LoteValidado:
+    """Resultado de validar_lote: listas alinhadas às linhas do lote"""
+    cpf_normalizado: List[str]
+    cpf_valido: np.ndarray
+    data_iso: List[Optional[str]]
+    data_erro: List[Optional[str]]
+
+    @property
+    def mascara_erro(self) -> np.ndarray:
+        """True nas linhas recusadas por CPF ou data"""
+        return ~self.cpf_valido | np.array([e is not None for e in self.data_erro], dtype=bool)
+
+
+def validar_lote(cpfs_raw: Sequence[Optional[str]], datas_raw: Sequence[Optional[str]]) -> LoteValidado:
+    """Valida as colunas de CPF e data de nascimento de um lote de uma vez"""
+    cpf_normalizado, cpf_valido = cpfs_em_lote(cpfs_raw)
+    data_iso, data_erro = datas_em_lote(datas_raw)
+    return LoteValidado(cpf_normalizado, cpf_valido, data_iso, data_erro)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+🗂️ Índices do MongoDB declarados em um só lugar
+
+INDEX_SPECS lista todos os índices que os caminhos quentes do server precisam.
+reconcile_indexes() cria os que faltam de forma idempotente (chamado no
+startup) e index_report() aponta índices ausentes, divergentes, não declarados
+e sem uso segundo $indexStats. Execute este arquivo para aplicar e ver o relatório.
+"""
+
+import asyncio
+import os
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+from pymongo.errors import OperationFailure
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    collection: str
+    keys: Tuple[Tuple[str, int], ...]
+    name: str
+    unique: bool = False
+    motivo: str = ""
+    expire_after: Optional[int] = None  # segundos; índice TTL quando definido
+
+    def options(self) -> dict:
+        opcoes = {"name": self.name}
+        if self.unique:
+            opcoes["unique"] = True
+        if self.expire_after is not None:
+            opcoes["expireAfterSeconds"] = self.expire_after
+        return opcoes
+
+
+INDEX_SPECS: List[IndexSpec] = [
+    # Autenticação: get_current_user e login buscam por email
+    IndexSpec("usuarios", (("email", 1),), "unique_email", unique=True, motivo="login / token"),
+    IndexSpec("usuarios", (("id", 1),), "id_1", motivo="joins por id"),
+    # Alunos: joins por id em todos os relatórios, CPF nos imports
+    IndexSpec("alunos", (("id", 1),), "id_1", motivo="joins por id"),
+    IndexSpec("alunos", (("cpf", 1),), "cpf_1", motivo="bulk upload / duplicidade"),
+    IndexSpec("alunos", (("status", 1),), "status_1", motivo="contagem por status do dashboard"),
+    # Turmas: escopo RBAC por instrutor, unidade/curso e aluno
+    IndexSpec("turmas", (("id", 1),), "id_1", motivo="joins por id"),
+    IndexSpec("turmas", (("instrutor_id", 1),), "instrutor_id_1", motivo="escopo do instrutor"),
+    IndexSpec("turmas", (("unidade_id", 1), ("curso_id", 1)), "unidade_id_1_curso_id_1", motivo="escopo pedagogo/monitor"),
+    IndexSpec("turmas", (("alunos_ids", 1),), "alunos_ids_1", motivo="turmas de um aluno (multikey)"),
+    # Chamadas: uma por turma/data, relatórios por período
+    IndexSpec("attendances", (("turma_id", 1), ("data", 1)), "unique_turma_data", unique=True, motivo="chamada única por dia"),
+    IndexSpec("attendances", (("data", 1),), "data_1", motivo="relatórios por período"),
+    IndexSpec("justifications", (("student_id", 1),), "student_id_1", motivo="justificativas do aluno"),
+    IndexSpec("atestados", (("aluno_id", 1),), "aluno_id_1", motivo="atestados do aluno"),
+    IndexSpec("desistentes", (("aluno_id", 1),), "aluno_id_1", motivo="desistência do aluno"),
+    # Visões materializadas (attendance_rollups.py)
+    IndexSpec("student_attendance_summary", (("aluno_id", 1), ("turma_id", 1)), "unique_aluno_turma", unique=True, motivo="upsert por aluno/turma"),
+    IndexSpec("student_attendance_summary", (("turma_id", 1),), "turma_id_1", motivo="resumos por turma"),
+    IndexSpec("turma_daily_rollup", (("turma_id", 1), ("data", 1)), "unique_turma_data", unique=True, motivo="upsert por turma/dia"),
+    IndexSpec("turma_daily_rollup", (("data", 1),), "data_1", motivo="taxas do dashboard"),
+    # Jobs de importação (import_jobs.py)
+    IndexSpec("import_jobs", (("id", 1),), "id_1", motivo="status do job"),
+    IndexSpec("import_jobs", (("status", 1), ("lease_until", 1)), "status_1_lease_until_1", motivo="retomada de jobs"),
+    IndexSpec("import_job_errors", (("job_id", 1), ("seq", 1)), "unique_job_seq", unique=True, motivo="erros paginados"),
+    IndexSpec("import_profiles", (("id", 1),), "id_1", motivo="perfil escolhido no upload"),
+    # Jobs de relatório (report_jobs.py): o documento expira sozinho, o arquivo pela limpeza
+    IndexSpec("report_jobs", (("id", 1),), "id_1", motivo="status/download do job"),
+    IndexSpec("report_jobs", (("expires_at", 1),), "ttl_expires_at", expire_after=0, motivo="expiração dos jobs (TTL)"),
+    IndexSpec("report_jobs", (("status", 1), ("updated_at", 1)), "status_1_updated_at_1", motivo="jobs órfãos"),
+    IndexSpec("reports.files", (("metadata.expires_at", 1),), "metadata_expires_at_1", motivo="limpeza de arquivos expirados"),
+    # Feriados (schedule.py): um por data e unidade
+    IndexSpec("feriados", (("data", 1), ("unidade_id", 1)), "unique_data_unidade", unique=True, motivo="feriado único por dia/unidade"),
+    IndexSpec("feriados", (("id", 1),), "id_1", motivo="remoção por id"),
+    # Snapshots diários de risco de evasão (risk_scoring.py)
+    IndexSpec("risk_snapshots", (("data", 1), ("turma_id", 1), ("aluno_id", 1)), "unique_data_turma_aluno", unique=True, motivo="upsert do snapshot do dia"),
+    IndexSpec("risk_snapshots", (("data", 1), ("pontuacao", -1)), "data_1_pontuacao_-1", motivo="ranking de um dia"),
+    # Agendador (scheduler.py): histórico de execuções expira sozinho
+    IndexSpec("scheduler_runs", (("expires_at", 1),), "ttl_expires_at", expire_after=0, motivo="expiração do histórico (TTL)"),
+    IndexSpec("scheduler_runs", (("inicio", -1),), "inicio_-1", motivo="últimas execuções"),
+    # Tickets do stream de notificações (notifications.py): uso único, expiram sozinhos
+    IndexSpec("notification_tickets", (("expires_at", 1),), "ttl_expires_at", expire_after=0, motivo="expiração dos tickets (TTL)"),
+]
+
+
+def _key_tuple(key_doc) -> Tuple[Tuple[str, int], ...]:
+    return tuple((campo, int(direcao)) for campo, direcao in key_doc.items())
+
+
+async def _existing_indexes(db, collection: str) -> dict:
+    """{chave: documento do índice} de uma collection (vazio se ela ainda não existe)"""
+    existentes = {}
+    async for indice in db[collection].list_indexes():
+        existentes[_key_tuple(indice["key"])] = indice
+    return existentes
+
+
+def _specs_for(collections: Optional[Iterable[str]]) -> List[IndexSpec]:
+    if collections is None:
+        return list(INDEX_SPECS)
+    nomes = set(collections)
+    return [spec for spec in INDEX_SPECS if spec.collection in nomes]
+
+
+async def reconcile_indexes(db, collections: Optional[Iterable[str]] = None) -> dict:
+    """Cria os índices declarados que faltam. Nunca apaga nada: índices com a mesma
+    chave e opções diferentes (ex.: não-único onde se declara único) viram conflito."""
+    resultado = {"criados": [], "existentes": [], "conflitos": [], "erros": []}
+    cache = {}
+
+    for spec in _specs_for(collections):
+        if spec.collection not in cache:
+            cache[spec.collection] = await _existing_indexes(db, spec.collection)
+        atual = cache[spec.collection].get(spec.keys)
+        rotulo = f"{spec.collection}.{spec.name}"
+
+        if atual is not None:
+            if bool(atual.get("unique", False)) != spec.unique:
+                resultado["conflitos"].append(
+                    f"{rotulo}: existe como '{atual['name']}' com unique={bool(atual.get('unique', False))}"
+                )
+            else:
+                resultado["existentes"].append(rotulo)
+            continue
+
+        try:
+            await db[spec.collection].create_index(list(spec.keys), **spec.options())
+            resultado["criados"].append(rotulo)
+        except OperationFailure as e:
+            # Ex.: dados duplicados impedem o índice único
+            resultado["erros"].append(f"{rotulo}: {e}")
+
+    return resultado
+
+
+async def index_report(db) -> dict:
+    """Ausentes/divergentes (declarados), extras (não declarados) e sem uso ($indexStats)"""
+    relatorio = {"ausentes": [], "divergentes": [], "nao_declarados": [], "sem_uso": [], "estatisticas_indisponiveis": []}
+    por_collection = {}
+    for spec in INDEX_SPECS:
+        por_collection.setdefault(spec.collection, []).append(spec)
+
+    for collection, specs in por_collection.items():
+        existentes = await _existing_indexes(db, collection)
+        declarados = {spec.keys for spec in specs}
+
+        for spec in specs:
+            atual = existentes.get(spec.keys)
+            if atual is None:
+                relatorio["ausentes"].append({"collection": collection, "nome": spec.name, "motivo": spec.motivo})
+            elif bool(atual.get("unique", False)) != spec.unique:
+                relatorio["divergentes"].append({"collection": collection, "nome": atual["name"], "unique_esperado": spec.unique})
+
+        for chave, indice in existentes.items():
+            if chave not in declarados and indice["name"] != "_id_":
+                relatorio["nao_declarados"].append({"collection": collection, "nome": indice["name"], "chave": dict(chave)})
+
+        try:
+            async for estatistica in db[collection].aggregate([{"$indexStats": {}}]):
+                acessos = estatistica.get("accesses", {})
+                if estatistica["name"] != "_id_" and acessos.get("ops", 0) == 0:
+                    since = acessos.get("since")
+                    relatorio["sem_uso"].append({
+                        "collection": collection,
+                        "nome": estatistica["name"],
+                        "desde": since.isoformat() if hasattr(since, "isoformat") else since,
+                    })
+        except Exception:
+            # $indexStats exige permissão clusterMonitor (ou não existe no servidor)
+            relatorio["estatisticas_indisponiveis"].append(collection)
+
+    return relatorio
+
+
+async def main():
+    """Aplica os índices declarados e imprime o relatório (mesmo padrão dos scripts de manutenção)"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    mongo_url = os.environ.get('MONGO_URL')
+    db_name = os.environ.get('DB_NAME', 'ios_sistema')
+
+    if not mongo_url:
+        print("❌ MONGO_URL não encontrada no .env")
+        return
+
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[db_name]
+    try:
+        print(f"🔗 Conectando ao MongoDB: {db_name}")
+        resultado = await reconcile_indexes(db)
+        for chave, itens in resultado.items():
+            print(f"\n📋 {chave}: {len(itens)}")
+            for item in itens:
+                print(f"   - {item}")
+
+        relatorio = await index_report(db)
+        print("\n📊 Relatório de índices:")
+        for chave, itens in relatorio.items():
+            print(f"\n🔍 {chave}: {len(itens)}")
+            for item in itens:
+                print(f"   - {item}")
+    except Exception as e:
+        print(f"❌ Erro ao reconciliar índices: {e}")
+    finally:
+        client.close()
+        print("🔌 Conexão MongoDB fechada")
+
+
+if __name__ == "__main__":
+    print("🚀 Reconciliando índices declarados...")
+    print("=" * 60)
+    asyncio.run(main())
+    print("=" * 60)
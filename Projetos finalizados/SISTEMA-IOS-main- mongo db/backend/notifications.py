@@ -0,0 +1,278 @@
+"""
+🔔 Chamadas pendentes por push (Server-Sent Events)
+
+Em vez de cada painel aberto consultar /notifications/pending-calls e
+/instructor/me/pending-attendances a cada poucos segundos, o navegador abre um
+único GET /notifications/stream. Como EventSource não envia cabeçalhos, o JWT
+não vai na URL (onde acabaria nos logs): o cliente troca o token por um ticket
+de uso único e curta duração (StreamTickets) e abre o stream com ?ticket=.
+
+O estado pendente é recalculado só quando pode ter mudado:
+- uma chamada foi gravada em uma turma do escopo do usuário (avisar(turma_id));
+- chegou o horário de início de alguma turma ou virou o dia (relógio);
+- outro worker gravou uma chamada (change stream em attendances, quando o
+  MongoDB é replica set, como no Atlas). Se o change stream cair (failover,
+  rede), ele é reaberto com backoff e todas as conexões recalculam, porque o
+  que mudou durante a queda não chegou; só "não é replica set" desiste de vez.
+Sinais próximos são agrupados (NOTIFY_DEBOUNCE_SECONDS) e um evento só é
+enviado se o conteúdo mudou; entre eles vai um comentário de keepalive. Conexões
+com a mesma chave de escopo compartilham o cálculo: no relógio, N painéis do
+mesmo usuário (ou N admins) fazem uma consulta, não N.
+
+A cada despertar e a cada keepalive o usuário é revalidado (desativado, cadastro
+alterado via invalidate_principal); o stream fecha com o evento "sessao-encerrada"
+quando a revalidação falha ou o JWT expira. Uma falha no cálculo (ex.: erro
+transitório do Mongo) não derruba o stream, que é de ticket único: a conexão
+recebe o evento "erro" e tenta de novo no próximo sinal ou keepalive.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+from pymongo.errors import OperationFailure
+
+NOTIFY_KEEPALIVE_SECONDS = float(os.environ.get("NOTIFY_KEEPALIVE_SECONDS", "15"))
+NOTIFY_DEBOUNCE_SECONDS = float(os.environ.get("NOTIFY_DEBOUNCE_SECONDS", "1"))
+NOTIFY_MAX_CONNECTIONS = int(os.environ.get("NOTIFY_MAX_CONNECTIONS", "1000"))
+NOTIFY_TICKET_TTL_SECONDS = int(os.environ.get("NOTIFY_TICKET_TTL_SECONDS", "30"))
+NOTIFY_WATCH_RETRY_SECONDS = float(os.environ.get("NOTIFY_WATCH_RETRY_SECONDS", "1"))
+NOTIFY_WATCH_RETRY_MAX_SECONDS = float(os.environ.get("NOTIFY_WATCH_RETRY_MAX_SECONDS", "60"))
+NOTIFY_RETRY_MS = 5000  # espera do EventSource antes de reconectar
+CODIGO_SEM_REPLICA_SET = 40573  # "$changeStream stage is only supported on replica sets"
+TICKETS_COLLECTION = "notification_tickets"
+
+# (eventos {nome: payload}, turma_ids do escopo) de um usuário
+Calculo = Callable[[object], Awaitable[Tuple[Dict[str, object], Iterable[str]]]]
+# Usuário atualizado da conexão, ou None se ela não pode mais continuar
+Revalidacao = Callable[[], Awaitable[Optional[object]]]
+
+
+class LimiteConexoes(Exception):
+    pass
+
+
+def evento_sse(nome: str, dados: str) -> str:
+    return f"event: {nome}\ndata: {dados}\n\n"
+
+
+def _sem_change_stream(erro: Exception) -> bool:
+    """Servidor standalone (ou client sem suporte): o change stream nunca vai abrir"""
+    if isinstance(erro, NotImplementedError):
+        return True
+    return isinstance(erro, OperationFailure) and erro.code == CODIGO_SEM_REPLICA_SET
+
+
+def _hash_ticket(ticket: str) -> str:
+    return hashlib.sha256(ticket.encode()).hexdigest()
+
+
+class StreamTickets:
+    """Tickets de uso único para abrir o stream; no banco fica só o hash, e o
+    documento expira pelo índice TTL em expires_at"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def emitir(self, email: str, token_exp: float) -> str:
+        ticket = secrets.token_urlsafe(32)
+        await self.db[TICKETS_COLLECTION].insert_one({
+            "_id": _hash_ticket(ticket),
+            "email": email,
+            "token_exp": token_exp,
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=NOTIFY_TICKET_TTL_SECONDS),
+        })
+        return ticket
+
+    async def consumir(self, ticket: str) -> Optional[dict]:
+        """{"email", "token_exp"} do ticket, removendo-o; None se não existe ou venceu"""
+        return await self.db[TICKETS_COLLECTION].find_one_and_delete(
+            {"_id": _hash_ticket(ticket), "expires_at": {"$gt": datetime.now(timezone.utc)}},
+            projection={"_id": 0, "email": 1, "token_exp": 1},
+        )
+
+
+class _Conexao:
+    def __init__(self, user, revalidar: Revalidacao, expira_em: float):
+        self.user = user
+        self.revalidar = revalidar
+        self.expira_em = expira_em  # epoch do exp do JWT
+        self.turma_ids: Set[str] = set()
+        self.sinal = asyncio.Event()
+        self.sinalizada_em = time.monotonic()
+        self.enviados: Dict[str, str] = {}
+
+
+class _Calculo:
+    def __init__(self, tarefa: asyncio.Future):
+        self.inicio = time.monotonic()
+        self.tarefa = tarefa
+
+
+class PendingNotifier:
+    def __init__(self, db, calcular: Calculo, chave: Callable[[object], Hashable]):
+        self.db = db
+        self.calcular = calcular
+        self.chave = chave  # usuários com a mesma chave recebem os mesmos eventos
+        self._conexoes: Set[_Conexao] = set()
+        self._calculos: Dict[Hashable, _Calculo] = {}
+        self._tarefas: list = []
+
+    @property
+    def conexoes(self) -> int:
+        return len(self._conexoes)
+
+    def avisar(self, turma_id: Optional[str] = None):
+        """Marca para recálculo as conexões que enxergam a turma (todas, sem turma_id)"""
+        for conexao in self._conexoes:
+            if turma_id is None or turma_id in conexao.turma_ids:
+                conexao.sinalizada_em = time.monotonic()
+                conexao.sinal.set()
+
+    def verificar_limite(self):
+        if len(self._conexoes) >= NOTIFY_MAX_CONNECTIONS:
+            raise LimiteConexoes("Limite de conexões de notificação atingido")
+
+    async def _calcular(self, conexao: _Conexao):
+        """Reaproveita um cálculo da mesma chave iniciado depois do sinal da conexão"""
+        chave = self.chave(conexao.user)
+        calculo = self._calculos.get(chave)
+        if calculo is None or calculo.inicio < conexao.sinalizada_em:
+            calculo = _Calculo(asyncio.ensure_future(self.calcular(conexao.user)))
+            self._calculos[chave] = calculo
+        try:
+            # shield: uma conexão que cai não cancela o cálculo das outras
+            return await asyncio.shield(calculo.tarefa)
+        except Exception:
+            # Não reaproveita a falha: a próxima tentativa calcula de novo
+            if self._calculos.get(chave) is calculo:
+                del self._calculos[chave]
+            raise
+
+    def _descartar_calculos(self):
+        ativas = {self.chave(conexao.user) for conexao in self._conexoes}
+        for chave in list(self._calculos):
+            if chave not in ativas:
+                del self._calculos[chave]
+
+    async def _revalidar(self, conexao: _Conexao) -> bool:
+        if time.time() >= conexao.expira_em:
+            return False
+        user = await conexao.revalidar()
+        if user is None:
+            return False
+        if user != conexao.user:
+            # Perfil/escopo mudou: recalcula com o usuário novo
+            conexao.user = user
+            conexao.sinalizada_em = time.monotonic()
+            conexao.sinal.set()
+        return True
+
+    async def stream(self, user, revalidar: Revalidacao, expira_em: float):
+        """Gerador SSE: estado inicial, depois só mudanças, até a sessão deixar de valer"""
+        conexao = _Conexao(user, revalidar, expira_em)
+        self._conexoes.add(conexao)
+        try:
+            yield f"retry: {NOTIFY_RETRY_MS}\n\n"
+            while True:
+                try:
+                    eventos, turma_ids = await self._calcular(conexao)
+                    falhou = False
+                except Exception as e:
+                    print(f"⚠️ Erro ao calcular notificações pendentes: {e}")
+                    eventos, turma_ids, falhou = {}, conexao.turma_ids, True
+                    detalhe = {"detail": "Falha ao atualizar as pendências, tentando de novo"}
+                    yield evento_sse("erro", json.dumps(detalhe, ensure_ascii=False))
+                conexao.turma_ids = set(turma_ids)
+                for nome, payload in eventos.items():
+                    dados = json.dumps(payload, default=str, ensure_ascii=False, sort_keys=True)
+                    if conexao.enviados.get(nome) != dados:
+                        conexao.enviados[nome] = dados
+                        yield evento_sse(nome, dados)
+
+                while True:
+                    espera = min(NOTIFY_KEEPALIVE_SECONDS, conexao.expira_em - time.time())
+                    try:
+                        await asyncio.wait_for(conexao.sinal.wait(), max(espera, 0))
+                    except asyncio.TimeoutError:
+                        pass
+                    if not await self._revalidar(conexao):
+                        yield evento_sse("sessao-encerrada", "{}")
+                        return
+                    if conexao.sinal.is_set() or falhou:
+                        break
+                    yield ": keepalive\n\n"
+                # Várias chamadas gravadas em sequência viram um único recálculo
+                await asyncio.sleep(NOTIFY_DEBOUNCE_SECONDS)
+                conexao.sinal.clear()
+        finally:
+            self._conexoes.discard(conexao)
+            self._descartar_calculos()
+
+    async def _proximo_horario(self, agora: datetime) -> datetime:
+        """Próximo início de aula de hoje (horario_inicio das turmas ativas) ou a meia-noite"""
+        proximo = datetime.combine(agora.date() + timedelta(days=1), datetime.min.time())
+        for horario in await self.db.turmas.distinct("horario_inicio", {"ativo": True}):
+            try:
+                hora, minuto = (int(parte) for parte in str(horario).split(":")[:2])
+                inicio = agora.replace(hour=hora, minute=minuto, second=0, microsecond=0)
+            except ValueError:
+                continue
+            if agora < inicio < proximo:
+                proximo = inicio
+        return proximo
+
+    async def _relogio(self):
+        while True:
+            try:
+                agora = datetime.now()
+                espera = (await self._proximo_horario(agora) - agora).total_seconds()
+                await asyncio.sleep(max(espera, 1))
+                if self._conexoes:
+                    self.avisar()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Erro no relógio de notificações: {e}")
+                await asyncio.sleep(60)
+
+    async def _observar(self):
+        """Chamadas gravadas por outros workers. Quedas reabrem o change stream com
+        backoff; sem replica set, só os avisos locais valem"""
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "replace", "update", "delete"]}}}]
+        espera = NOTIFY_WATCH_RETRY_SECONDS
+        reaberto = False
+        while True:
+            try:
+                async with self.db.attendances.watch(pipeline, full_document="updateLookup") as mudancas:
+                    espera = NOTIFY_WATCH_RETRY_SECONDS
+                    if reaberto:
+                        # O que foi gravado durante a queda não chegou por aqui
+                        self.avisar()
+                    async for mudanca in mudancas:
+                        self.avisar((mudanca.get("fullDocument") or {}).get("turma_id"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if _sem_change_stream(e):
+                    print(f"⚠️ Change stream de chamadas indisponível, apenas avisos locais: {e}")
+                    return
+                print(f"⚠️ Change stream de chamadas caiu, reabrindo em {espera:.0f}s: {e}")
+            reaberto = True
+            await asyncio.sleep(espera)
+            espera = min(espera * 2, NOTIFY_WATCH_RETRY_MAX_SECONDS)
+
+    def iniciar(self):
+        if not self._tarefas:
+            self._tarefas = [asyncio.create_task(self._relogio()), asyncio.create_task(self._observar())]
+
+    async def parar(self):
+        for tarefa in self._tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*self._tarefas, return_exceptions=True)
+        self._tarefas = []
@@ -0,0 +1,138 @@
+"""
+🔐 Hash e verificação de senha fora do event loop
+
+bcrypt custa ~100-300 ms de CPU por chamada. Executado direto num `async def`
+ele trava todas as outras requisições do worker; aqui cada operação roda num
+pool limitado (threads por padrão, processos com PASSWORD_HASH_EXECUTOR=process
+para backends de bcrypt que não liberam o GIL).
+
+- PASSWORD_HASH_WORKERS: operações simultâneas (padrão: min(4, CPUs))
+- PASSWORD_HASH_MAX_WAITING: fila máxima antes de recusar com PasswordHashingBusy
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from passlib.hash import bcrypt
+
+HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_MAX_WAITING = int(os.environ.get("PASSWORD_HASH_MAX_WAITING", "64"))
+HASH_EXECUTOR = os.environ.get("PASSWORD_HASH_EXECUTOR", "thread")
+
+
+class PasswordHashingBusy(Exception):
+    """Fila de hash cheia: o servidor responde 503 em vez de acumular espera"""
+
+
+def _hash(senha: str) -> str:
+    return bcrypt.hash(senha)
+
+
+def _verify(senha: str, senha_hash: str) -> bool:
+    return bcrypt.verify(senha, senha_hash)
+
+
+class PasswordHasher:
+    """Pool limitado com métricas de fila (tempo esperando vaga x tempo de CPU)"""
+
+    def __init__(self, workers: int = HASH_WORKERS, max_waiting: int = HASH_MAX_WAITING,
+                 executor: str = HASH_EXECUTOR):
+        self.workers = max(1, workers)
+        self.max_waiting = max_waiting
+        self.executor_kind = executor
+        self._executor: Executor = None
+        self._semaphore = asyncio.Semaphore(self.workers)
+        self.waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.errors = 0
+        self._queue_ms = deque(maxlen=1000)
+        self._run_ms = deque(maxlen=1000)
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, func, *args):
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise PasswordHashingBusy("Muitas operações de senha simultâneas, tente novamente")
+
+        enfileirado = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        inicio = time.perf_counter()
+        self._queue_ms.append((inicio - enfileirado) * 1000)
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._run_ms.append((time.perf_counter() - inicio) * 1000)
+            self._semaphore.release()
+
+    async def hash(self, senha: str) -> str:
+        return await self._run(_hash, senha)
+
+    async def verify(self, senha: str, senha_hash: str) -> bool:
+        return await self._run(_verify, senha, senha_hash)
+
+    def metrics(self) -> dict:
+        return {
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "max_waiting": self.max_waiting,
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "queue_ms": _percentis(self._queue_ms),
+            "run_ms": _percentis(self._run_ms),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def _percentis(amostras) -> dict:
+    """p50/p95/p99/max das últimas amostras (janela de 1000 operações)"""
+    if not amostras:
+        return {"p50": 0, "p95": 0, "p99": 0, "max": 0}
+    ordenadas = sorted(amostras)
+    ultimo = len(ordenadas) - 1
+
+    def p(q):
+        return round(ordenadas[min(ultimo, int(q * len(ordenadas)))], 2)
+
+    return {"p50": p(0.50), "p95": p(0.95), "p99": p(0.99), "max": round(ordenadas[-1], 2)}
+
+
+password_hasher = PasswordHasher()
+
+
+async def hash_password(senha: str) -> str:
+    return await password_hasher.hash(senha)
+
+
+async def verify_password(senha: str, senha_hash: str) -> bool:
+    return await password_hasher.verify(senha, senha_hash)
@@ -0,0 +1,63 @@
+"""
+📅 Chamadas pendentes em lote (notificações e painel do instrutor)
+
+Em vez de um find_one por (turma, dia) e uma consulta de alunos por pendência,
+os dois endpoints fazem um número fixo de consultas, qualquer que seja a
+quantidade de turmas ou o tamanho da janela: uma em attendances
+({turma_id: $in, data: $in}), uma em cursos e uma no roster das turmas que de
+fato têm pendência. O cruzamento é feito em memória.
+"""
+
+import os
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Set, Tuple
+
+PENDING_LOOKBACK_DAYS = int(os.environ.get("PENDING_LOOKBACK_DAYS", "3"))  # hoje, ontem, anteontem
+PENDING_LOOKBACK_MAX = 31
+ROSTER_MAX_POR_TURMA = 1000
+
+
+def datas_recentes(hoje: date, dias: int) -> List[date]:
+    """[hoje, ontem, ...] com `dias` datas"""
+    return [hoje - timedelta(days=dias_atras) for dias_atras in range(dias)]
+
+
+async def buscar_por_ids(collection, ids: Iterable, projecao: dict) -> Dict[str, dict]:
+    """id -> documento (o primeiro encontrado) em uma consulta $in"""
+    ids = list({i for i in ids if i})
+    if not ids:
+        return {}
+    documentos = {}
+    async for documento in collection.find({"id": {"$in": ids}}, {"_id": 0, "id": 1, **projecao}):
+        documentos.setdefault(documento["id"], documento)
+    return documentos
+
+
+async def chamadas_realizadas(db, turma_ids: Iterable[str], datas: Iterable[date]) -> Set[Tuple[str, str]]:
+    """(turma_id, data ISO) das chamadas já feitas na janela, em uma consulta"""
+    turma_ids = list(turma_ids)
+    if not turma_ids:
+        return set()
+    cursor = db.attendances.find(
+        {"turma_id": {"$in": turma_ids}, "data": {"$in": [d.isoformat() for d in datas]}},
+        {"_id": 0, "turma_id": 1, "data": 1},
+    )
+    return {(chamada["turma_id"], chamada["data"]) async for chamada in cursor}
+
+
+async def rosters(db, turmas: Iterable[dict]) -> Dict[str, List[dict]]:
+    """turma_id -> [{"id", "nome"}] na ordem natural da collection alunos, uma consulta para todas"""
+    turmas_do_aluno: Dict[str, List[str]] = {}
+    resultado: Dict[str, List[dict]] = {}
+    for turma in turmas:
+        resultado[turma["id"]] = []
+        for aluno_id in set(turma.get("alunos_ids", []) or []):
+            turmas_do_aluno.setdefault(aluno_id, []).append(turma["id"])
+    if not turmas_do_aluno:
+        return resultado
+
+    async for aluno in db.alunos.find({"id": {"$in": list(turmas_do_aluno)}}, {"_id": 0, "id": 1, "nome": 1}):
+        for turma_id in turmas_do_aluno.get(aluno.get("id"), ()):
+            if len(resultado[turma_id]) < ROSTER_MAX_POR_TURMA:
+                resultado[turma_id].append({"id": aluno.get("id"), "nome": aluno.get("nome")})
+    return resultado
@@ -0,0 +1,385 @@
+"""
+📄 Jobs de relatório CSV persistidos no Mongo, com o arquivo no GridFS
+
+Cada job é um documento em `report_jobs` (status, progresso, dono) e o CSV é
+gravado em blocos no bucket GridFS "reports" enquanto é gerado, sem montar o
+arquivo inteiro em memória. Qualquer worker do uvicorn enxerga o job e serve o
+download, lendo o arquivo do GridFS bloco a bloco.
+
+Expiração: o índice TTL em `expires_at` apaga o documento do job; os arquivos
+levam o mesmo `expires_at` no metadata e são removidos por limpar_expirados(),
+que o agendador (scheduler.py) roda a cada REPORT_JOB_CLEANUP segundos na
+réplica líder, ou em cada réplica com SCHEDULER_ENABLED=0 (apagar um arquivo
+já apagado é ignorado). Jobs
+ativos sem sinal de vida há REPORT_JOB_STALE segundos (worker que caiu) são
+marcados como falhos.
+
+Execução: ReportWorkerPool mantém uma fila limitada e REPORT_WORKERS corrotinas
+por processo, fora das tarefas das requisições. Os limites de jobs ativos por
+usuário e no total são contados no Mongo, valendo para todos os workers: o job
+é gravado primeiro e depois conta os ativos, ele incluso; acima do limite é
+marcado como falho e o envio recebe 429. Dois envios simultâneos (no mesmo
+processo ou em outro) nunca passam juntos pela última vaga: no pior caso os dois
+recusam e o cliente tenta de novo após o Retry-After. O
+cancelamento marca o job como "cancelled"; o processo dono interrompe a tarefa
+na hora (se for ele quem recebeu o DELETE) ou no próximo sinal de vida.
+"""
+
+import asyncio
+import csv
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument
+
+REPORT_JOB_TTL = float(os.environ.get("REPORT_JOB_TTL_SECONDS", "86400"))
+REPORT_JOB_STALE = float(os.environ.get("REPORT_JOB_STALE_SECONDS", "600"))
+REPORT_JOB_CLEANUP = float(os.environ.get("REPORT_JOB_CLEANUP_SECONDS", "900"))
+REPORT_JOB_HEARTBEAT = float(os.environ.get("REPORT_JOB_HEARTBEAT_SECONDS", "60"))
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", "2"))
+REPORT_QUEUE_MAX = int(os.environ.get("REPORT_QUEUE_MAX", "20"))
+REPORT_MAX_PER_USER = int(os.environ.get("REPORT_MAX_PER_USER", "2"))
+REPORT_MAX_GLOBAL = int(os.environ.get("REPORT_MAX_GLOBAL", "10"))
+# Tamanho do buffer de texto antes de enviar um bloco ao GridFS
+REPORT_FLUSH_BYTES = 256 * 1024
+
+STATUS_ATIVOS = ("queued", "processing")
+
+
+class LimiteRelatorios(Exception):
+    """Fila cheia ou limite de jobs simultâneos atingido (429 no endpoint)"""
+
+
+def _agora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class SaidaCsv:
+    """csv.writer que descarrega o buffer no GridFS a cada REPORT_FLUSH_BYTES"""
+
+    def __init__(self, grid_in):
+        self.grid_in = grid_in
+        self.buffer = StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.linhas = 0
+        self.tamanho = 0
+
+    async def escrever(self, linha: list):
+        self.writer.writerow(linha)
+        self.linhas += 1
+        if self.buffer.tell() >= REPORT_FLUSH_BYTES:
+            await self._descarregar()
+
+    async def escrever_texto(self, texto: str):
+        self.buffer.write(texto)
+        await self._descarregar()
+
+    async def _descarregar(self):
+        conteudo = self.buffer.getvalue()
+        if conteudo:
+            dados = conteudo.encode("utf-8")
+            await self.grid_in.write(dados)
+            self.tamanho += len(dados)
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    async def fechar(self):
+        await self._descarregar()
+        await self.grid_in.close()
+
+    async def abortar(self):
+        await self.grid_in.abort()
+
+
+class ReportJobStore:
+    """Estado dos jobs de relatório compartilhado entre workers/instâncias"""
+
+    def __init__(self, db, bucket_name: str = "reports"):
+        self.db = db
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=bucket_name)
+        self.instancia = str(uuid.uuid4())
+
+    async def criar(self, user_id: str, params: dict, tipo: str = "csv") -> dict:
+        agora = _agora()
+        job = {
+            "id": str(uuid.uuid4()),
+            "type": tipo,
+            "status": "queued",
+            "owner": self.instancia,
+            "user_id": user_id,
+            "params": params,
+            "progress": 0,
+            "total_records": 0,
+            "file_id": None,
+            "filename": None,
+            "size": None,
+            "error": None,
+            "created_at": agora,
+            "updated_at": agora,
+            "completed_at": None,
+            "expires_at": agora + timedelta(seconds=REPORT_JOB_TTL),
+        }
+        await self.db.report_jobs.insert_one(dict(job))
+        return job
+
+    async def obter(self, job_id: str) -> Optional[dict]:
+        """Job ainda válido (o monitor de TTL pode levar até um minuto para apagar)"""
+        job = await self.db.report_jobs.find_one({"id": job_id}, {"_id": 0})
+        if job is None or _expirado(job):
+            return None
+        return job
+
+    async def contar_ativos(self, user_id: Optional[str] = None) -> int:
+        filtro = {"status": {"$in": list(STATUS_ATIVOS)}}
+        if user_id is not None:
+            filtro["user_id"] = user_id
+        return await self.db.report_jobs.count_documents(filtro)
+
+    async def recusar(self, job_id: str, erro: str):
+        """Job criado que não coube na fila ou nos limites: sai da contagem de ativos"""
+        agora = _agora()
+        await self.db.report_jobs.update_one(
+            {"id": job_id, "status": "queued"},
+            {"$set": {"status": "failed", "error": erro, "updated_at": agora, "completed_at": agora}},
+        )
+
+    async def iniciar_processamento(self, job_id: str) -> Optional[dict]:
+        """queued -> processing; None se o job foi cancelado enquanto esperava na fila"""
+        return await self.db.report_jobs.find_one_and_update(
+            {"id": job_id, "status": "queued"},
+            {"$set": {"status": "processing", "started_at": _agora(), "updated_at": _agora()}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def cancelar(self, job_id: str) -> bool:
+        agora = _agora()
+        resultado = await self.db.report_jobs.update_one(
+            {"id": job_id, "status": {"$in": list(STATUS_ATIVOS)}},
+            {"$set": {"status": "cancelled", "progress": 0, "updated_at": agora, "completed_at": agora}},
+        )
+        return resultado.modified_count == 1
+
+    async def sinal_de_vida(self, job_ids: List[str]):
+        if job_ids:
+            await self.db.report_jobs.update_many(
+                {"id": {"$in": job_ids}, "status": {"$in": list(STATUS_ATIVOS)}},
+                {"$set": {"updated_at": _agora()}},
+            )
+
+    async def cancelados(self, job_ids: List[str]) -> List[str]:
+        """Quais destes jobs foram cancelados (possivelmente por outro worker)"""
+        if not job_ids:
+            return []
+        cursor = self.db.report_jobs.find({"id": {"$in": job_ids}, "status": "cancelled"}, {"_id": 0, "id": 1})
+        return [job["id"] async for job in cursor]
+
+    async def atualizar(self, job_id: str, **campos: Any):
+        """Grava progresso/contadores; updated_at serve de sinal de vida do worker"""
+        campos["updated_at"] = _agora()
+        await self.db.report_jobs.update_one({"id": job_id, "status": "processing"}, {"$set": campos})
+
+    def abrir_saida(self, job: dict, filename: str) -> SaidaCsv:
+        grid_in = self.bucket.open_upload_stream(
+            filename,
+            metadata={
+                "tipo": "report_job",
+                "job_id": job["id"],
+                "user_id": job["user_id"],
+                "content_type": "text/csv",
+                "expires_at": job["expires_at"],
+            },
+        )
+        return SaidaCsv(grid_in)
+
+    async def concluir(self, job_id: str, saida: SaidaCsv, filename: str, **campos: Any):
+        await saida.fechar()
+        agora = _agora()
+        resultado = await self.db.report_jobs.update_one(
+            {"id": job_id, "status": "processing"},
+            {"$set": {
+                **campos,
+                "status": "completed",
+                "progress": 100,
+                "file_id": saida.grid_in._id,
+                "filename": filename,
+                "size": saida.tamanho,
+                "updated_at": agora,
+                "completed_at": agora,
+            }},
+        )
+        if resultado.matched_count == 0:
+            # Job expirou ou foi marcado como falho enquanto gerava: o arquivo não tem dono
+            await self._apagar_arquivo(saida.grid_in._id)
+
+    async def descartar(self, job_id: str, saida: Optional[SaidaCsv]):
+        """Apaga os blocos já gravados de um arquivo que não será concluído"""
+        if saida is not None:
+            try:
+                await saida.abortar()
+            except Exception as e:
+                print(f"⚠️ Erro ao descartar arquivo parcial do job {job_id}: {e}")
+
+    async def falhar(self, job_id: str, erro: str, saida: Optional[SaidaCsv] = None):
+        await self.descartar(job_id, saida)
+        await self.db.report_jobs.update_one(
+            {"id": job_id, "status": "processing"},
+            {"$set": {"status": "failed", "error": erro, "progress": 0, "updated_at": _agora()}},
+        )
+
+    async def abrir_arquivo(self, job: dict):
+        return await self.bucket.open_download_stream(job["file_id"])
+
+    async def blocos_arquivo(self, grid_out) -> AsyncIterator[bytes]:
+        """Conteúdo do arquivo em blocos do GridFS (um chunk por vez em memória)"""
+        while True:
+            bloco = await grid_out.readchunk()
+            if not bloco:
+                break
+            yield bloco
+
+    # ------------------------------------------------------------------
+    # Limpeza
+    # ------------------------------------------------------------------
+    async def _apagar_arquivo(self, file_id) -> bool:
+        try:
+            await self.bucket.delete(file_id)
+            return True
+        except NoFile:
+            # Outro worker já apagou
+            return False
+
+    async def limpar_expirados(self) -> dict:
+        """Remove arquivos expirados e encerra jobs órfãos; seguro em paralelo"""
+        agora = _agora()
+        arquivos = 0
+        cursor = self.bucket.find({"metadata.expires_at": {"$lt": agora}})
+        async for arquivo in cursor:
+            if await self._apagar_arquivo(arquivo._id):
+                arquivos += 1
+
+        orfaos = await self.db.report_jobs.update_many(
+            {"status": {"$in": list(STATUS_ATIVOS)}, "updated_at": {"$lt": agora - timedelta(seconds=REPORT_JOB_STALE)}},
+            {"$set": {"status": "failed", "error": "Geração interrompida (worker reiniciado)", "updated_at": agora}},
+        )
+        return {"arquivos": arquivos, "jobs_orfaos": orfaos.modified_count}
+
+
+class ReportWorkerPool:
+    """Fila limitada + corrotinas dedicadas para gerar relatórios"""
+
+    def __init__(self, store: ReportJobStore, executar: Callable[[dict, Any], Awaitable[None]],
+                 workers: int = REPORT_WORKERS, fila_max: int = REPORT_QUEUE_MAX):
+        self.store = store
+        self.executar = executar
+        self.workers = workers
+        self.fila: asyncio.Queue = asyncio.Queue(maxsize=fila_max)
+        self._na_fila: Dict[str, Any] = {}
+        self._execucoes: Dict[str, asyncio.Task] = {}
+        self._tarefas: List[asyncio.Task] = []
+        self._envio = asyncio.Lock()
+
+    async def _conferir_limites(self, job: dict):
+        """Conferido depois de gravar o job, que conta a si mesmo"""
+        ativos_usuario = await self.store.contar_ativos(job["user_id"])
+        if ativos_usuario > REPORT_MAX_PER_USER:
+            raise LimiteRelatorios(
+                f"Você já tem {ativos_usuario - 1} relatório(s) em andamento (máximo {REPORT_MAX_PER_USER})"
+            )
+        if await self.store.contar_ativos() > REPORT_MAX_GLOBAL:
+            raise LimiteRelatorios("Muitos relatórios em andamento no sistema, tente novamente em instantes")
+
+    async def enviar(self, user_id: str, params: dict, contexto: Any) -> dict:
+        """Cria o job e o coloca na fila; LimiteRelatorios se não há vaga"""
+        fila_cheia = "Fila de relatórios cheia, tente novamente em instantes"
+        # Um envio por vez neste processo: a vaga na fila conferida aqui é a usada no put
+        async with self._envio:
+            if self.fila.full():
+                raise LimiteRelatorios(fila_cheia)
+            job = await self.store.criar(user_id, params)
+            try:
+                await self._conferir_limites(job)
+                self._na_fila[job["id"]] = contexto
+                self.fila.put_nowait(job["id"])
+            except (LimiteRelatorios, asyncio.QueueFull) as e:
+                self._na_fila.pop(job["id"], None)
+                motivo = str(e) if isinstance(e, LimiteRelatorios) else fila_cheia
+                await self.store.recusar(job["id"], motivo)
+                raise LimiteRelatorios(motivo) from e
+        return job
+
+    async def cancelar(self, job_id: str) -> bool:
+        cancelado = await self.store.cancelar(job_id)
+        tarefa = self._execucoes.get(job_id)
+        if tarefa is not None:
+            tarefa.cancel()
+        return cancelado
+
+    async def _worker(self):
+        while True:
+            job_id = await self.fila.get()
+            contexto = self._na_fila.pop(job_id, None)
+            try:
+                job = await self.store.iniciar_processamento(job_id)
+                if job is None:
+                    continue
+                tarefa = asyncio.create_task(self.executar(job, contexto))
+                self._execucoes[job_id] = tarefa
+                # wait() não propaga o cancelamento da tarefa para o worker
+                await asyncio.wait([tarefa])
+                if tarefa.cancelled():
+                    print(f"🛑 Job de relatório {job_id} cancelado")
+                elif tarefa.exception() is not None:
+                    print(f"❌ Job de relatório {job_id} falhou: {tarefa.exception()}")
+            except Exception as e:
+                print(f"⚠️ Erro no worker de relatórios ({job_id}): {e}")
+            finally:
+                self._execucoes.pop(job_id, None)
+                self.fila.task_done()
+
+    async def _vigiar(self):
+        while True:
+            await asyncio.sleep(REPORT_JOB_HEARTBEAT)
+            try:
+                await self.store.sinal_de_vida([*self._na_fila, *self._execucoes])
+                for job_id in await self.store.cancelados(list(self._execucoes)):
+                    tarefa = self._execucoes.get(job_id)
+                    if tarefa is not None:
+                        tarefa.cancel()
+            except Exception as e:
+                print(f"⚠️ Erro no sinal de vida dos relatórios: {e}")
+
+    def iniciar(self):
+        """Chamado no startup: sobe os workers e o sinal de vida"""
+        if not self._tarefas:
+            self._tarefas = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            self._tarefas.append(asyncio.create_task(self._vigiar()))
+
+    async def parar(self):
+        """Chamado no shutdown: jobs deste processo não sobrevivem ao reinício"""
+        pendentes = [*self._na_fila, *self._execucoes]
+        tarefas = [*self._execucoes.values(), *self._tarefas]
+        for tarefa in tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+        self._tarefas = []
+        if pendentes:
+            await self.store.db.report_jobs.update_many(
+                {"id": {"$in": pendentes}, "status": {"$in": list(STATUS_ATIVOS)}},
+                {"$set": {"status": "failed", "error": "Servidor reiniciado durante a geração", "updated_at": _agora()}},
+            )
+
+
+def _expirado(job: dict) -> bool:
+    expira = job.get("expires_at")
+    if expira is None:
+        return False
+    if expira.tzinfo is None:
+        # Motor devolve datetimes sem fuso (UTC) a menos que o client use tz_aware
+        expira = expira.replace(tzinfo=timezone.utc)
+    return expira <= _agora()
@@ -0,0 +1,168 @@
+"""
+🚨 Risco de evasão: limites centralizados e pontuação em lote
+
+Todos os relatórios usam os limites daqui: o corte de "aluno em risco"
+(RISCO_LIMITE_PRESENCA), as faixas do CSV completo (Baixo/Médio/Alto) e as do
+relatório de frequência (Situação Normal/Atenção/Crítica).
+
+pontuar() calcula de uma vez, para todos os alunos do escopo, uma pontuação de
+0 a 100 a partir da taxa geral, da taxa dos últimos RISCO_JANELA_DIAS dias, das
+faltas consecutivas atuais e da tendência (janela atual contra a anterior). As
+métricas vêm das matrizes de presença em cache (attendance_matrix.py).
+"""
+
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pymongo import UpdateOne
+
+# Abaixo deste percentual de presença o aluno conta como "em risco"
+RISCO_LIMITE_PRESENCA = 75
+
+# (percentual mínimo, rótulo) em ordem decrescente; abaixo de todas vale o padrão
+FAIXAS_CSV_COMPLETO: Tuple[Tuple[float, str], ...] = ((80, "Baixo"), (60, "Médio"))
+FAIXA_CSV_COMPLETO_PADRAO = "Alto"
+FAIXAS_FREQUENCIA: Tuple[Tuple[float, str], ...] = ((75, "Situação Normal"), (50, "Atenção"))
+FAIXA_FREQUENCIA_PADRAO = "Situação Crítica"
+# Observação "baixa frequência" do CSV completo
+LIMITE_BAIXA_FREQUENCIA = 70
+# Faltas seguidas que já colocam o aluno em risco
+FALTAS_CONSECUTIVAS_ALERTA = 3
+
+RISCO_JANELA_DIAS = 30
+# Pesos da pontuação (somam 1) e teto das faltas seguidas consideradas
+PESO_TAXA_GERAL = 0.35
+PESO_TAXA_RECENTE = 0.35
+PESO_FALTAS_SEGUIDAS = 0.2
+PESO_TENDENCIA = 0.1
+FALTAS_SEGUIDAS_TETO = 5
+# Faixas da pontuação (pontuação mínima, nível)
+NIVEIS_PONTUACAO: Tuple[Tuple[float, str], ...] = ((50, "alto"), (30, "medio"))
+NIVEL_PONTUACAO_PADRAO = "baixo"
+
+RISK_SNAPSHOT_HOUR = int(os.environ.get("RISK_SNAPSHOT_HOUR", "3"))  # hora local do snapshot diário
+SNAPSHOT_COLLECTION = "risk_snapshots"
+
+
+def classificar(percentual: float, faixas: Sequence[Tuple[float, str]], padrao: str) -> str:
+    for minimo, rotulo in faixas:
+        if percentual >= minimo:
+            return rotulo
+    return padrao
+
+
+def em_risco(percentual: float) -> bool:
+    return percentual < RISCO_LIMITE_PRESENCA
+
+
+def pontuar(taxa_geral: np.ndarray, taxa_recente: np.ndarray, faltas_seguidas: np.ndarray, tendencia: np.ndarray):
+    """(pontuação 0-100, nível) por aluno. Taxas em %, NaN quando não há chamadas:
+    sem chamadas recentes vale a taxa geral, sem janela anterior a tendência é zero"""
+    taxa_geral = np.nan_to_num(np.asarray(taxa_geral, dtype=float), nan=100.0)
+    taxa_recente = np.asarray(taxa_recente, dtype=float)
+    taxa_recente = np.where(np.isnan(taxa_recente), taxa_geral, taxa_recente)
+    tendencia = np.nan_to_num(np.asarray(tendencia, dtype=float), nan=0.0)
+    faltas = np.minimum(np.asarray(faltas_seguidas, dtype=float), FALTAS_SEGUIDAS_TETO) / FALTAS_SEGUIDAS_TETO
+
+    pontuacao = (
+        PESO_TAXA_GERAL * (100 - taxa_geral)
+        + PESO_TAXA_RECENTE * (100 - taxa_recente)
+        + PESO_FALTAS_SEGUIDAS * 100 * faltas
+        + PESO_TENDENCIA * np.clip(-tendencia, 0, 100)
+    )
+    pontuacao = np.round(np.clip(pontuacao, 0, 100), 1)
+
+    nivel = np.full(len(pontuacao), NIVEL_PONTUACAO_PADRAO, dtype=object)
+    for minimo, rotulo in reversed(NIVEIS_PONTUACAO):
+        nivel[pontuacao >= minimo] = rotulo
+    return pontuacao, nivel
+
+
+def _arredondar(valores: np.ndarray) -> List[Optional[float]]:
+    return [None if np.isnan(v) else round(float(v), 1) for v in valores]
+
+
+def metricas_risco(matrizes: Dict[str, object], membros: Dict[str, Iterable[str]], hoje: date) -> List[dict]:
+    """Uma linha por (turma, aluno da turma com chamadas), já pontuada e sem ordem definida"""
+    fim = hoje.isoformat()
+    inicio_recente = (hoje - timedelta(days=RISCO_JANELA_DIAS - 1)).isoformat()
+    inicio_anterior = (hoje - timedelta(days=2 * RISCO_JANELA_DIAS - 1)).isoformat()
+    fim_anterior = (hoje - timedelta(days=RISCO_JANELA_DIAS)).isoformat()
+
+    turmas, alunos, partes = [], [], {"geral": [], "recente": [], "anterior": [], "faltas": []}
+    for turma_id, matriz in matrizes.items():
+        linhas = [matriz.linha[a] for a in dict.fromkeys(membros.get(turma_id, ())) if a in matriz.linha]
+        if not linhas:
+            continue
+        linhas = np.array(linhas)
+        turmas.extend([turma_id] * len(linhas))
+        alunos.extend(matriz.alunos[i] for i in linhas)
+        partes["geral"].append(matriz.rates(None, fim)[linhas])
+        partes["recente"].append(matriz.rates(inicio_recente, fim)[linhas])
+        partes["anterior"].append(matriz.rates(inicio_anterior, fim_anterior)[linhas])
+        partes["faltas"].append(matriz.absence_streaks(fim)[linhas])
+
+    if not alunos:
+        return []
+    geral, recente, anterior, faltas = (np.concatenate(partes[k]) for k in ("geral", "recente", "anterior", "faltas"))
+    tendencia = recente - anterior
+    pontuacao, nivel = pontuar(geral, recente, faltas, tendencia)
+
+    return [
+        {
+            "turma_id": turma_id,
+            "aluno_id": aluno_id,
+            "taxa_geral": g,
+            "taxa_30_dias": r,
+            "faltas_consecutivas": int(f),
+            "tendencia": t,
+            "pontuacao": float(p),
+            "nivel": n,
+            "em_risco": bool((g is not None and em_risco(g)) or f >= FALTAS_CONSECUTIVAS_ALERTA),
+        }
+        for turma_id, aluno_id, g, r, f, t, p, n in zip(
+            turmas, alunos, _arredondar(geral), _arredondar(recente), faltas.tolist(),
+            _arredondar(tendencia), pontuacao.tolist(), nivel.tolist(),
+        )
+    ]
+
+
+def ordenar_por_risco(linhas: List[dict]) -> List[dict]:
+    """Maior pontuação primeiro; empate pela menor taxa geral e pelo id"""
+    return sorted(linhas, key=lambda l: (-l["pontuacao"], l["taxa_geral"] if l["taxa_geral"] is not None else 100, l["aluno_id"]))
+
+
+async def gravar_snapshot(db, linhas: List[dict], dia: date) -> int:
+    """Upsert por (data, turma, aluno): refazer o snapshot do dia não duplica nada"""
+    agora = datetime.now(timezone.utc)
+    ops = [
+        UpdateOne(
+            {"data": dia.isoformat(), "turma_id": linha["turma_id"], "aluno_id": linha["aluno_id"]},
+            {"$set": {**linha, "data": dia.isoformat(), "created_at": agora}},
+            upsert=True,
+        )
+        for linha in linhas
+    ]
+    for inicio in range(0, len(ops), 1000):
+        await db[SNAPSHOT_COLLECTION].bulk_write(ops[inicio:inicio + 1000], ordered=False)
+    return len(ops)
+
+
+class RiskSnapshotter:
+    """Grava o snapshot do dia; o agendador (scheduler.py) chama executar() às
+    RISK_SNAPSHOT_HOUR. Rodar de novo no mesmo dia não refaz nada (sem forcar).
+    O dia é a data local, o mesmo relógio do agendador"""
+
+    def __init__(self, db, gerar):
+        self.db = db
+        self.gerar = gerar  # coroutine () -> linhas de todos os alunos
+
+    async def executar(self, dia: Optional[date] = None, forcar: bool = False) -> dict:
+        dia = dia or date.today()
+        if not forcar and await self.db[SNAPSHOT_COLLECTION].find_one({"data": dia.isoformat()}, {"_id": 1}):
+            return {"data": dia.isoformat(), "gravados": 0, "ignorado": True}
+        linhas = await self.gerar()
+        gravados = await gravar_snapshot(self.db, linhas, dia)
+        return {"data": dia.isoformat(), "gravados": gravados, "ignorado": False}
@@ -0,0 +1,227 @@
+"""
+📆 Calendário de aulas por turma: dias da semana, período e feriados
+
+Os dias de aula vinham de dois helpers incompatíveis (nomes em curso.dias_aula
+e inteiros em curso.dias_semana) e nenhum conhecia feriados nem os dias da
+própria turma. Aqui cada turma vira um CalendarioTurma:
+- máscara semanal: turma.dias_semana > curso.dias_aula > curso.dias_semana > seg-qui
+- período: data_inicio/data_fim da turma (cada limite é opcional)
+- feriados: os gerais (sem unidade_id) mais os da unidade da turma
+
+As datas são geradas com np.busdaycalendar/np.is_busday/np.busday_count, com um
+calendário NumPy por (máscara, unidade) compartilhado entre turmas. Assim
+grade() e contar_aulas() respondem, para milhares de turmas, "quais dias tinham
+aula" e "quantas aulas eram previstas" com uma operação por calendário distinto.
+"""
+
+import unicodedata
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ttl_cache import TTLCache
+
+DIAS_SEMANA = ("segunda", "terca", "quarta", "quinta", "sexta", "sabado", "domingo")
+DIAS_AULA_PADRAO = ("segunda", "terca", "quarta", "quinta")  # fallback histórico: seg-qui
+FERIADOS_COLLECTION = "feriados"
+
+
+def _nome_dia(valor) -> Optional[int]:
+    """"Terça", "terca-feira", "sáb", 1... -> 0=segunda .. 6=domingo (None se não reconhecer)"""
+    if isinstance(valor, bool):
+        return None
+    if isinstance(valor, int):
+        return valor if 0 <= valor <= 6 else None
+    texto = unicodedata.normalize("NFKD", str(valor)).encode("ascii", "ignore").decode().strip().lower()
+    for indice, nome in enumerate(DIAS_SEMANA):
+        if len(texto) >= 3 and nome.startswith(texto[:3]):
+            return indice
+    return None
+
+
+def mascara_semana(dias: Optional[Iterable]) -> Optional[str]:
+    """Máscara do NumPy ("1111100" = seg a sex) ou None se a lista não tiver dia válido"""
+    indices = {i for i in (_nome_dia(d) for d in dias or []) if i is not None}
+    if not indices:
+        return None
+    return "".join("1" if i in indices else "0" for i in range(7))
+
+
+def resolver_mascara(turma: dict, curso: Optional[dict]) -> str:
+    curso = curso or {}
+    for dias in (turma.get("dias_semana"), curso.get("dias_aula"), curso.get("dias_semana")):
+        mascara = mascara_semana(dias)
+        if mascara:
+            return mascara
+    return mascara_semana(DIAS_AULA_PADRAO)
+
+
+def _dia(valor) -> Optional[np.datetime64]:
+    if not valor:
+        return None
+    if isinstance(valor, datetime):
+        valor = valor.date()
+    if isinstance(valor, str):
+        valor = valor[:10]
+    try:
+        return np.datetime64(valor, "D")
+    except ValueError:
+        return None
+
+
+@dataclass(frozen=True)
+class CalendarioTurma:
+    turma_id: str
+    mascara: str
+    inicio: Optional[np.datetime64]
+    fim: Optional[np.datetime64]
+    calendario: np.busdaycalendar
+
+    @property
+    def dias_aula(self) -> List[str]:
+        return [nome for nome, bit in zip(DIAS_SEMANA, self.mascara) if bit == "1"]
+
+    def _recorte(self, inicio, fim) -> Tuple[np.datetime64, np.datetime64]:
+        inicio, fim = np.datetime64(inicio, "D"), np.datetime64(fim, "D")
+        if self.inicio is not None:
+            inicio = max(inicio, self.inicio)
+        if self.fim is not None:
+            fim = min(fim, self.fim)
+        return inicio, fim
+
+    def dias(self, inicio, fim) -> np.ndarray:
+        """Dias de aula em [inicio, fim] (datetime64[D], em ordem)"""
+        inicio, fim = self._recorte(inicio, fim)
+        if fim < inicio:
+            return np.array([], dtype="datetime64[D]")
+        datas = np.arange(inicio, fim + 1, dtype="datetime64[D]")
+        return datas[np.is_busday(datas, busdaycal=self.calendario)]
+
+    def contar(self, inicio, fim) -> int:
+        inicio, fim = self._recorte(inicio, fim)
+        if fim < inicio:
+            return 0
+        return int(np.busday_count(inicio, fim + 1, busdaycal=self.calendario))
+
+    def eh_dia_de_aula(self, dia) -> bool:
+        return self.contar(dia, dia) == 1
+
+
+def _por_calendario(calendarios: Sequence[CalendarioTurma]) -> Dict[int, List[int]]:
+    """Posições das turmas agrupadas pelo np.busdaycalendar compartilhado"""
+    grupos: Dict[int, List[int]] = {}
+    for posicao, calendario in enumerate(calendarios):
+        grupos.setdefault(id(calendario.calendario), []).append(posicao)
+    return grupos
+
+
+def _limites(calendarios: Sequence[CalendarioTurma]) -> Tuple[np.ndarray, np.ndarray]:
+    minimo, maximo = np.datetime64("0001-01-01", "D"), np.datetime64("9999-12-31", "D")
+    inicios = np.array([c.inicio if c.inicio is not None else minimo for c in calendarios], dtype="datetime64[D]")
+    fins = np.array([c.fim if c.fim is not None else maximo for c in calendarios], dtype="datetime64[D]")
+    return inicios, fins
+
+
+def grade(calendarios: Sequence[CalendarioTurma], datas: Sequence) -> np.ndarray:
+    """Matriz booleana turmas × datas: True onde a turma tinha aula naquele dia"""
+    datas = np.asarray(datas, dtype="datetime64[D]")
+    resultado = np.zeros((len(calendarios), len(datas)), dtype=bool)
+    if not len(calendarios) or not len(datas):
+        return resultado
+    for posicoes in _por_calendario(calendarios).values():
+        resultado[posicoes] = np.is_busday(datas, busdaycal=calendarios[posicoes[0]].calendario)
+    inicios, fins = _limites(calendarios)
+    resultado &= (datas[None, :] >= inicios[:, None]) & (datas[None, :] <= fins[:, None])
+    return resultado
+
+
+def contar_aulas(calendarios: Sequence[CalendarioTurma], inicio, fim) -> np.ndarray:
+    """Aulas previstas por turma em [inicio, fim], já recortado pelo período de cada turma"""
+    contagens = np.zeros(len(calendarios), dtype=np.int64)
+    if not len(calendarios):
+        return contagens
+    inicios, fins = _limites(calendarios)
+    inicios = np.maximum(inicios, np.datetime64(inicio, "D"))
+    fins = np.maximum(np.minimum(fins, np.datetime64(fim, "D")) + 1, inicios)
+    for posicoes in _por_calendario(calendarios).values():
+        contagens[posicoes] = np.busday_count(inicios[posicoes], fins[posicoes], busdaycal=calendarios[posicoes[0]].calendario)
+    return contagens
+
+
+class ScheduleCache:
+    """Calendários por turma em cache; a tabela de feriados é relida a cada `ttl`
+    segundos ou na hora em que um feriado é gravado/apagado (invalidate)"""
+
+    def __init__(self, db, maxsize: int = 4096, ttl: float = 300.0):
+        self.db = db
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._feriados = TTLCache(maxsize=1, ttl=ttl)
+        self._calendarios: Dict[Tuple[str, Optional[str]], np.busdaycalendar] = {}
+        self._geracao = 0
+
+    async def feriados(self) -> Dict[Optional[str], List[str]]:
+        """unidade_id (None = todas as unidades) -> datas ISO"""
+        tabela = self._feriados.get("feriados")
+        if tabela is None:
+            geracao = self._geracao
+            tabela = {}
+            async for feriado in self.db[FERIADOS_COLLECTION].find({}, {"_id": 0, "data": 1, "unidade_id": 1}):
+                tabela.setdefault(feriado.get("unidade_id") or None, []).append(feriado["data"])
+            if geracao == self._geracao:
+                self._feriados.set("feriados", tabela)
+                # Tabela nova: calendários montados com a anterior deixam de valer
+                self._calendarios.clear()
+                self.cache.clear()
+        return tabela
+
+    def _calendario(self, mascara: str, unidade_id: Optional[str], feriados: Dict[Optional[str], List[str]]) -> np.busdaycalendar:
+        chave = (mascara, unidade_id)
+        calendario = self._calendarios.get(chave)
+        if calendario is None:
+            datas = feriados.get(None, []) + (feriados.get(unidade_id, []) if unidade_id else [])
+            calendario = np.busdaycalendar(weekmask=mascara, holidays=np.array(sorted(set(datas)), dtype="datetime64[D]"))
+            self._calendarios[chave] = calendario
+        return calendario
+
+    async def calendarios(self, turmas: Iterable[dict], cursos: Optional[Dict[str, dict]] = None) -> Dict[str, CalendarioTurma]:
+        """turma_id -> CalendarioTurma. Sem `cursos`, busca os necessários em uma consulta $in"""
+        turmas = list(turmas)
+        if cursos is None:
+            curso_ids = list({t.get("curso_id") for t in turmas if t.get("curso_id")})
+            cursos = {}
+            if curso_ids:
+                async for curso in self.db.cursos.find({"id": {"$in": curso_ids}}, {"_id": 0, "id": 1, "dias_aula": 1, "dias_semana": 1}):
+                    cursos.setdefault(curso["id"], curso)
+
+        feriados = await self.feriados()
+        resultado = {}
+        for turma in turmas:
+            mascara = resolver_mascara(turma, cursos.get(turma.get("curso_id")))
+            assinatura = (mascara, turma.get("unidade_id"), str(turma.get("data_inicio") or ""), str(turma.get("data_fim") or ""), self._geracao)
+            guardado = self.cache.get(turma["id"])
+            if guardado is not None and guardado[0] == assinatura:
+                resultado[turma["id"]] = guardado[1]
+                continue
+            calendario = CalendarioTurma(
+                turma_id=turma["id"],
+                mascara=mascara,
+                inicio=_dia(turma.get("data_inicio")),
+                fim=_dia(turma.get("data_fim")),
+                calendario=self._calendario(mascara, turma.get("unidade_id"), feriados),
+            )
+            self.cache.set(turma["id"], (assinatura, calendario))
+            resultado[turma["id"]] = calendario
+        return resultado
+
+    def invalidate(self):
+        """Chamado após gravar ou apagar feriados"""
+        self._geracao += 1
+        self._feriados.clear()
+        self._calendarios.clear()
+        self.cache.clear()
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "calendarios": len(self._calendarios)}
+
@@ -0,0 +1,250 @@
+"""
+⏰ Agendador em processo (asyncio) com eleição de líder no Mongo
+
+Cada réplica roda o mesmo laço, mas só a que detém o lease do documento
+`scheduler_locks` executa as tarefas globais (rollups, snapshots, limpeza). O
+líder renova o lease a cada SCHEDULER_LEASE/3 segundos; se cair, outra réplica
+assume quando o lease expira e retoma a agenda gravada em `scheduler_jobs`,
+executando uma vez o que ficou para trás. Tarefas `local=True` (aquecer caches
+do próprio processo) rodam em todas as réplicas.
+
+SCHEDULER_ENABLED=0 desliga a eleição e as tarefas desta réplica, exceto as
+registradas com `sem_agendador=True` (limpeza de relatórios): essas passam a
+rodar localmente, como antes do agendador, para que nada fique sem limpeza.
+
+Horários são locais (os mesmos de horario_inicio das turmas). Cada execução
+vai para `scheduler_runs` (status, duração, resultado ou erro; TTL de
+SCHEDULER_RUNS_TTL_DAYS) e os totais por tarefa ficam em `scheduler_jobs`.
+"""
+
+import asyncio
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+SCHEDULER_LEASE = float(os.environ.get("SCHEDULER_LEASE_SECONDS", "60"))
+SCHEDULER_RUNS_TTL_DAYS = int(os.environ.get("SCHEDULER_RUNS_TTL_DAYS", "30"))
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER_ENABLED", "1") != "0"
+LOCK_ID = "scheduler"
+
+
+def _utc() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class Diariamente:
+    """Todo dia em hora:minuto (horário local)"""
+
+    def __init__(self, hora: int, minuto: int = 0):
+        self.hora, self.minuto = hora, minuto
+
+    async def proxima(self, agora: datetime, primeira: bool = False) -> datetime:
+        alvo = agora.replace(hour=self.hora, minute=self.minuto, second=0, microsecond=0)
+        return alvo if alvo > agora else alvo + timedelta(days=1)
+
+    def __str__(self):
+        return f"diariamente {self.hora:02d}:{self.minuto:02d}"
+
+
+class ACada:
+    """A cada N segundos; a primeira execução é imediata"""
+
+    def __init__(self, segundos: float):
+        self.segundos = segundos
+
+    async def proxima(self, agora: datetime, primeira: bool = False) -> datetime:
+        return agora if primeira else agora + timedelta(seconds=self.segundos)
+
+    def __str__(self):
+        return f"a cada {int(self.segundos)}s"
+
+
+@dataclass
+class Tarefa:
+    nome: str
+    executar: Callable[[], Awaitable[Any]]
+    quando: Any  # Diariamente / ACada
+    local: bool = False  # True: roda em todas as réplicas
+    sem_agendador: bool = False  # True: com SCHEDULER_ENABLED=0 roda localmente
+    proxima: Optional[datetime] = None
+    rodando: Optional[asyncio.Task] = field(default=None, repr=False)
+
+
+class Scheduler:
+    def __init__(self, db):
+        self.db = db
+        self.instancia = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.tarefas: Dict[str, Tarefa] = {}
+        self.lider = False
+        self._laco_tarefa: Optional[asyncio.Task] = None
+
+    def registrar(self, nome: str, executar: Callable[[], Awaitable[Any]], quando, local: bool = False,
+                  sem_agendador: bool = False):
+        self.tarefas[nome] = Tarefa(nome, executar, quando, local, sem_agendador)
+
+    # 👑 Liderança -----------------------------------------------------------
+
+    async def _renovar_lideranca(self) -> bool:
+        agora = _utc()
+        try:
+            await self.db.scheduler_locks.find_one_and_update(
+                {"_id": LOCK_ID, "$or": [{"owner": self.instancia}, {"lease_until": {"$lt": agora}}]},
+                {"$set": {"owner": self.instancia, "lease_until": agora + timedelta(seconds=SCHEDULER_LEASE), "renovado_em": agora}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            return True
+        except DuplicateKeyError:
+            # Outra réplica detém um lease válido
+            return False
+
+    async def _assumir(self, agora: datetime):
+        """Novo líder: retoma a agenda gravada (o que venceu roda já)"""
+        gravadas = {doc["_id"]: doc async for doc in self.db.scheduler_jobs.find({}, {"proxima_local": 1})}
+        for tarefa in self.tarefas.values():
+            if tarefa.local:
+                continue
+            proxima = (gravadas.get(tarefa.nome) or {}).get("proxima_local")
+            tarefa.proxima = datetime.fromisoformat(proxima) if proxima else await tarefa.quando.proxima(agora, primeira=True)
+        print(f"⏰ Agendador: {self.instancia} assumiu as tarefas globais")
+
+    # ▶️ Execução ------------------------------------------------------------
+
+    async def _executar(self, tarefa: Tarefa):
+        inicio, relogio = _utc(), time.perf_counter()
+        status, resultado, erro = "ok", None, None
+        try:
+            resultado = await tarefa.executar()
+        except asyncio.CancelledError:
+            status, erro = "cancelled", "Agendador encerrado durante a execução"
+            raise
+        except Exception as e:
+            status, erro = "failed", str(e)
+            print(f"⚠️ Tarefa agendada {tarefa.nome} falhou: {e}")
+        finally:
+            duracao_ms = round((time.perf_counter() - relogio) * 1000, 1)
+            await self._registrar_execucao(tarefa, inicio, duracao_ms, status, resultado, erro)
+
+    async def _registrar_execucao(self, tarefa: Tarefa, inicio: datetime, duracao_ms: float, status: str, resultado, erro):
+        fim = _utc()
+        try:
+            await self.db.scheduler_runs.insert_one({
+                "id": str(uuid.uuid4()),
+                "tarefa": tarefa.nome,
+                "instancia": self.instancia,
+                "inicio": inicio,
+                "fim": fim,
+                "duracao_ms": duracao_ms,
+                "status": status,
+                "resultado": resultado if isinstance(resultado, (dict, int, float, str)) else None,
+                "erro": erro,
+                "expires_at": fim + timedelta(days=SCHEDULER_RUNS_TTL_DAYS),
+            })
+            await self.db.scheduler_jobs.update_one(
+                {"_id": tarefa.nome},
+                {
+                    "$set": {"ultima_execucao": inicio, "ultimo_status": status, "ultima_duracao_ms": duracao_ms, "ultimo_erro": erro},
+                    "$inc": {"execucoes": 1, "falhas": 0 if status == "ok" else 1, "duracao_total_ms": duracao_ms},
+                    "$max": {"maior_duracao_ms": duracao_ms},
+                },
+                upsert=True,
+            )
+        except Exception as e:
+            print(f"⚠️ Erro ao registrar execução de {tarefa.nome}: {e}")
+
+    async def _agendar(self, tarefa: Tarefa, agora: datetime):
+        tarefa.proxima = await tarefa.quando.proxima(agora)
+        if not tarefa.local and SCHEDULER_ENABLED:
+            await self.db.scheduler_jobs.update_one(
+                {"_id": tarefa.nome},
+                {"$set": {"proxima_local": tarefa.proxima.isoformat(), "quando": str(tarefa.quando)}},
+                upsert=True,
+            )
+
+    def _roda_aqui(self, tarefa: Tarefa) -> bool:
+        if not SCHEDULER_ENABLED:
+            return tarefa.sem_agendador
+        return tarefa.local or self.lider
+
+    async def _ciclo(self) -> float:
+        """Uma volta do laço; devolve quantos segundos dormir"""
+        agora = datetime.now()
+        if SCHEDULER_ENABLED:
+            lider = await self._renovar_lideranca()
+            if lider and not self.lider:
+                await self._assumir(agora)
+            self.lider = lider
+
+        espera = SCHEDULER_LEASE / 3
+        for tarefa in self.tarefas.values():
+            if not self._roda_aqui(tarefa):
+                continue
+            if tarefa.proxima is None:
+                tarefa.proxima = await tarefa.quando.proxima(agora, primeira=True)
+            if tarefa.proxima <= agora:
+                if tarefa.rodando is None or tarefa.rodando.done():
+                    tarefa.rodando = asyncio.create_task(self._executar(tarefa))
+                await self._agendar(tarefa, agora)
+            espera = min(espera, (tarefa.proxima - agora).total_seconds())
+        return max(espera, 1)
+
+    async def _laco(self):
+        while True:
+            try:
+                espera = await self._ciclo()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Erro no agendador: {e}")
+                espera = SCHEDULER_LEASE / 3
+            await asyncio.sleep(espera)
+
+    def iniciar(self):
+        if self._laco_tarefa is not None:
+            return
+        if SCHEDULER_ENABLED or any(tarefa.sem_agendador for tarefa in self.tarefas.values()):
+            self._laco_tarefa = asyncio.create_task(self._laco())
+
+    async def parar(self):
+        tarefas = [t.rodando for t in self.tarefas.values() if t.rodando and not t.rodando.done()]
+        if self._laco_tarefa is not None:
+            tarefas.append(self._laco_tarefa)
+            self._laco_tarefa = None
+        for tarefa in tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+        if self.lider:
+            # Libera o lease para outra réplica assumir sem esperar a expiração
+            await self.db.scheduler_locks.delete_one({"_id": LOCK_ID, "owner": self.instancia})
+            self.lider = False
+
+    async def status(self, limite_execucoes: int = 50) -> dict:
+        lock = await self.db.scheduler_locks.find_one({"_id": LOCK_ID}, {"_id": 0})
+        gravadas = {doc["_id"]: doc async for doc in self.db.scheduler_jobs.find({})}
+        tarefas = []
+        for tarefa in self.tarefas.values():
+            doc = gravadas.get(tarefa.nome, {})
+            execucoes = doc.get("execucoes", 0)
+            tarefas.append({
+                "nome": tarefa.nome,
+                "quando": str(tarefa.quando),
+                "local": tarefa.local,
+                "proxima_execucao": doc.get("proxima_local") if not tarefa.local else (tarefa.proxima.isoformat() if tarefa.proxima else None),
+                "ultima_execucao": doc.get("ultima_execucao"),
+                "ultimo_status": doc.get("ultimo_status"),
+                "ultimo_erro": doc.get("ultimo_erro"),
+                "ultima_duracao_ms": doc.get("ultima_duracao_ms"),
+                "duracao_media_ms": round(doc.get("duracao_total_ms", 0) / execucoes, 1) if execucoes else None,
+                "maior_duracao_ms": doc.get("maior_duracao_ms"),
+                "execucoes": execucoes,
+                "falhas": doc.get("falhas", 0),
+            })
+        execucoes: List[dict] = await self.db.scheduler_runs.find({}, {"_id": 0, "expires_at": 0}).sort("inicio", -1).limit(limite_execucoes).to_list(None)
+        return {"instancia": self.instancia, "lider": lock, "sou_lider": self.lider, "tarefas": tarefas, "execucoes": execucoes}
@@ -0,0 +1,170 @@
+"""
+🔒 Escopo RBAC por usuário: quais turmas e alunos cada perfil enxerga
+
+Cada regra de visibilidade que antes era montada à mão em cada endpoint virou
+um "perfil" nomeado abaixo. O ScopeResolver resolve (turmas, turma_ids,
+aluno_ids) uma vez por usuário/perfil e guarda em cache com TTL curto;
+qualquer escrita em turmas chama invalidate().
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Union
+
+from ttl_cache import TTLCache
+
+SCOPE_CACHE_TTL = float(os.environ.get("SCOPE_CACHE_TTL", "30"))
+
+# Query de turmas do perfil: dict = restrito, None = sem restrição, False = sem acesso
+TurmaQuery = Union[dict, None, bool]
+
+
+def _curso_unidade(user, query: dict) -> dict:
+    if getattr(user, "curso_id", None):
+        query["curso_id"] = user.curso_id
+    if getattr(user, "unidade_id", None):
+        query["unidade_id"] = user.unidade_id
+    return query
+
+
+def perfil_relatorios(user) -> TurmaQuery:
+    """Relatórios: instrutor só turmas REGULARES, pedagogo só EXTENSÃO do curso/unidade"""
+    if user.tipo == "admin":
+        return None
+    if user.tipo == "instrutor":
+        return {"instrutor_id": user.id, "tipo_turma": "regular"}
+    if user.tipo == "pedagogo":
+        return _curso_unidade(user, {"tipo_turma": "extensao"})
+    if user.tipo == "monitor":
+        return _curso_unidade(user, {})
+    return False
+
+
+def perfil_gestao_alunos(user) -> TurmaQuery:
+    """Justificativas e gestão de alunos (user_can_manage_student)"""
+    if user.tipo == "admin":
+        return None
+    if user.tipo == "instrutor":
+        return {"instrutor_id": user.id}
+    if user.tipo == "pedagogo":
+        query = {}
+        if getattr(user, "unidade_id", None):
+            query["unidade_id"] = user.unidade_id
+        if getattr(user, "curso_id", None):
+            query["curso_id"] = user.curso_id
+        return query
+    if user.tipo == "monitor":
+        return {"monitor_id": user.id}
+    return False
+
+
+def perfil_lista_alunos(user) -> TurmaQuery:
+    """GET /students: instrutor vê as turmas ativas que leciona no seu curso/unidade,
+    pedagogo e monitor veem as turmas ativas da unidade"""
+    if user.tipo == "admin":
+        return None
+    if user.tipo == "instrutor":
+        if not getattr(user, "curso_id", None) or not getattr(user, "unidade_id", None):
+            return False
+        return {"curso_id": user.curso_id, "unidade_id": user.unidade_id, "instrutor_id": user.id, "ativo": True}
+    if user.tipo in ("pedagogo", "monitor"):
+        if not getattr(user, "unidade_id", None):
+            return False
+        return {"unidade_id": user.unidade_id, "ativo": True}
+    return False
+
+
+def perfil_atestados(user) -> TurmaQuery:
+    """Atestados: instrutor nas suas turmas, pedagogo na sua unidade"""
+    if user.tipo == "admin":
+        return None
+    if user.tipo == "instrutor":
+        return {"instrutor_id": user.id}
+    if user.tipo == "pedagogo":
+        return {"unidade_id": getattr(user, "unidade_id", None)}
+    return False
+
+
+def perfil_chamadas(user) -> TurmaQuery:
+    """Chamadas pendentes e dashboard: turmas ativas sob responsabilidade do usuário"""
+    if user.tipo == "admin":
+        return {"ativo": True}
+    if user.tipo == "instrutor":
+        return {"instrutor_id": user.id, "ativo": True}
+    if user.tipo in ("pedagogo", "monitor"):
+        return _curso_unidade(user, {"ativo": True})
+    return False
+
+
+PERFIS: Dict[str, Callable] = {
+    "relatorios": perfil_relatorios,
+    "gestao_alunos": perfil_gestao_alunos,
+    "lista_alunos": perfil_lista_alunos,
+    "atestados": perfil_atestados,
+    "chamadas": perfil_chamadas,
+}
+
+
+@dataclass(frozen=True)
+class Scope:
+    """Resultado imutável: consultas de permissão viram buscas em conjunto"""
+    unrestricted: bool
+    turmas: tuple = ()
+    turma_ids: frozenset = frozenset()
+    aluno_ids: frozenset = frozenset()
+    tipo_turma: Optional[str] = None
+
+    def allows_turma(self, turma_id: str) -> bool:
+        return self.unrestricted or turma_id in self.turma_ids
+
+    def allows_aluno(self, aluno_id: str) -> bool:
+        return self.unrestricted or aluno_id in self.aluno_ids
+
+    def turma_filter(self) -> Optional[dict]:
+        """Filtro {"$in": [...]} para turma_id; None quando não há restrição"""
+        return None if self.unrestricted else {"$in": list(self.turma_ids)}
+
+
+class ScopeResolver:
+    """Resolve e guarda em cache o escopo de cada (usuário, perfil)"""
+
+    def __init__(self, db, ttl: float = SCOPE_CACHE_TTL, maxsize: int = 2048):
+        self.db = db
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._geracao = 0
+
+    @staticmethod
+    def _key(user, perfil: str):
+        return (perfil, user.id, user.tipo, getattr(user, "unidade_id", None), getattr(user, "curso_id", None))
+
+    async def resolve(self, user, perfil: str = "relatorios") -> Scope:
+        key = self._key(user, perfil)
+        scope = self._cache.get(key)
+        if scope is not None:
+            return scope
+
+        geracao = self._geracao
+        query = PERFIS[perfil](user)
+        if query is None:
+            scope = Scope(unrestricted=True)
+        elif query is False:
+            scope = Scope(unrestricted=False)
+        else:
+            turmas = await self.db.turmas.find(query, {"_id": 0}).to_list(None)
+            scope = Scope(
+                unrestricted=False,
+                turmas=tuple(turmas),
+                turma_ids=frozenset(t["id"] for t in turmas),
+                aluno_ids=frozenset(a for t in turmas for a in t.get("alunos_ids", []) or []),
+                tipo_turma=query.get("tipo_turma"),
+            )
+
+        # Não guarda resultado calculado antes de uma invalidação concorrente
+        if geracao == self._geracao:
+            self._cache.set(key, scope)
+        return scope
+
+    def invalidate(self):
+        """Chamado após qualquer escrita em turmas"""
+        self._geracao += 1
+        self._cache.clear()
@@ -1,5 +1,6 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Query, Form
-from fastapi.responses import Response, StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
@@ -8,22 +9,75 @@ import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import Any, Callable, Dict, List, Optional
 from enum import Enum
 import uuid
 from datetime import datetime, timezone, timedelta, date
 import jwt
-from passlib.hash import bcrypt
 import base64
 import csv
-import re
+import json
 from io import StringIO, BytesIO
 from collections import defaultdict
 import asyncio
 from urllib.parse import quote_plus
-from dateutil import parser as dateutil_parser
-from pymongo.errors import DuplicateKeyError
+from pymongo import InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from bson import ObjectId
+from attendance_analytics import JanelaFrequencia
+from attendance_matrix import AttendanceMatrixCache
+from schedule import ScheduleCache, contar_aulas, grade
+from scheduler import ACada, Diariamente, Scheduler
+from scope_resolver import ScopeResolver
+from ttl_cache import TTLCache
+from frequency_report import FREQUENCY_CSV_HEADER, frequency_csv_row, frequency_pipeline
+from import_jobs import ImportJobRunner, TipoImportacao, id_deterministico
+from import_pipeline import CsvDictStream, ErrosLimitados, iter_upload_rows
+from import_profiles import compilar_mapa, detectar_perfil, validar_mapeamento, valor_campo
+from import_validation import validar_lote
+from indexes import index_report, reconcile_indexes
+from report_jobs import REPORT_JOB_CLEANUP, LimiteRelatorios, ReportJobStore, ReportWorkerPool
+from notifications import NOTIFY_TICKET_TTL_SECONDS, LimiteConexoes, PendingNotifier, StreamTickets
+from pending_calls import (
+    PENDING_LOOKBACK_DAYS,
+    PENDING_LOOKBACK_MAX,
+    buscar_por_ids,
+    chamadas_realizadas,
+    datas_recentes,
+    rosters,
+)
+from risk_scoring import (
+    FAIXA_CSV_COMPLETO_PADRAO,
+    FAIXAS_CSV_COMPLETO,
+    FALTAS_CONSECUTIVAS_ALERTA,
+    LIMITE_BAIXA_FREQUENCIA,
+    RISK_SNAPSHOT_HOUR,
+    RiskSnapshotter,
+    classificar,
+    em_risco,
+    metricas_risco,
+    ordenar_por_risco,
+)
+from dashboard_stats import (
+    DASHBOARD_CACHE_TTL,
+    buscar_nome,
+    contar_status_alunos,
+    somar_rollup_periodos,
+    taxa_presenca,
+)
+from password_hashing import PasswordHashingBusy, hash_password, password_hasher, verify_password
+from attendance_rollups import (
+    apply_attendance_to_daily_rollup,
+    apply_attendance_to_summary,
+    clear_attendance_rollups,
+    count_sessions_by_turma,
+    iter_attendance_marks,
+    load_summary_counts,
+    rebuild_student_attendance_summary,
+    rebuild_turma_daily_rollup,
+    reconcile_daily_rollup,
+    remove_turma_rollups,
+)
 
 # Carregamento de variáveis de ambiente
 ROOT_DIR = Path(__file__).parent
@@ -121,6 +175,18 @@ db = client[DB_NAME]
 # 📁 GridFS para armazenamento de arquivos (atestados/justificativas)
 fs_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="justifications")
 
+# 🔒 Escopo RBAC (turmas/alunos visíveis por usuário) com cache curto
+scope_resolver = ScopeResolver(db)
+
+# 🧮 Matrizes de presença (alunos × chamadas) por turma, invalidadas a cada chamada gravada
+attendance_matrices = AttendanceMatrixCache(db)
+
+# 📆 Calendário de aulas por turma (dias da semana, período, feriados)
+schedule_cache = ScheduleCache(db)
+
+# 📊 Payload do /dashboard/stats por escopo, por poucos segundos
+dashboard_cache = TTLCache(maxsize=1024, ttl=DASHBOARD_CACHE_TTL)
+
 # -------------------------
 # Teste de conexão MongoDB
 # -------------------------
@@ -137,6 +203,21 @@ async def test_connection():
 @app.on_event("startup")
 async def startup_event():
     await test_connection()
+    try:
+        resultado = await reconcile_indexes(db)
+        print(f"🗂️ Índices: {len(resultado['criados'])} criados, {len(resultado['existentes'])} existentes")
+        for problema in resultado["conflitos"] + resultado["erros"]:
+            print(f"⚠️ Índice: {problema}")
+    except Exception as e:
+        print(f"⚠️ Erro ao reconciliar índices: {e}")
+    # 📦 Retoma importações interrompidas (lease expirado) e vigia as novas
+    import_jobs.iniciar()
+    # 🏭 Workers de relatório + limpeza de arquivos expirados e jobs órfãos
+    report_pool.iniciar()
+    # ⏰ Tarefas agendadas (snapshot de risco, rollups, limpeza, caches) com eleição de líder
+    scheduler.iniciar()
+    # 🔔 Push de chamadas pendentes (relógio das aulas + change stream)
+    pending_notifier.iniciar()
     # 🎯 PRODUÇÃO: Inicialização de dados de exemplo removida
     print("✅ Sistema iniciado SEM dados de exemplo")
 
@@ -173,6 +254,16 @@ JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production'
 JWT_ALGORITHM = 'HS256'
 security = HTTPBearer()
 
+# 🧠 Cache do usuário autenticado (email do token -> UserResponse), sem o hash da senha
+PRINCIPAL_CACHE_TTL = float(os.environ.get("PRINCIPAL_CACHE_TTL", "60"))
+principal_cache = TTLCache(maxsize=4096, ttl=PRINCIPAL_CACHE_TTL)
+principal_emails: Dict[str, str] = {}  # id -> email, para invalidar por user_id
+
+@app.exception_handler(PasswordHashingBusy)
+async def password_hashing_busy_handler(request, exc: PasswordHashingBusy):
+    """Pico de logins: recusa rápido em vez de deixar a fila de bcrypt crescer"""
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "2"})
+
 # Inclui o router no app (já criados acima)
 app.include_router(api_router)
 
@@ -295,6 +386,19 @@ class CursoUpdate(BaseModel):
     pre_requisitos: Optional[str] = None
     dias_aula: Optional[List[str]] = None  # 📅 Dias de aula
 
+# 📆 Feriados: sem unidade_id valem para todas as unidades (schedule.py)
+class Feriado(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    data: date
+    nome: str
+    unidade_id: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class FeriadoCreate(BaseModel):
+    data: date
+    nome: str
+    unidade_id: Optional[str] = None
+
 class Aluno(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     nome: str  # OBRIGATÓRIO - Nome completo
@@ -335,6 +439,26 @@ class AlunoUpdate(BaseModel):
     observacoes: Optional[str] = None
     status: Optional[str] = None
 
+class ImportProfile(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    nome: str
+    parceiro: Optional[str] = None
+    mapeamento: Dict[str, List[str]]  # campo do aluno -> cabeçalhos da planilha
+    ativo: bool = True
+    created_by: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class ImportProfileCreate(BaseModel):
+    nome: str
+    parceiro: Optional[str] = None
+    mapeamento: Dict[str, List[str]]
+
+class ImportProfileUpdate(BaseModel):
+    nome: Optional[str] = None
+    parceiro: Optional[str] = None
+    mapeamento: Optional[Dict[str, List[str]]] = None
+
 class Turma(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     nome: str
@@ -556,51 +680,63 @@ def today_iso_date(tz=None):
     """Retorna data ISO YYYY-MM-DD (use timezone UTC ou local se desejar)"""
     return datetime.now(timezone.utc).date().isoformat()
 
-# Bulk Upload Helper Functions
-def normalize_cpf(raw: str) -> str:
-    """Remove all non-digit characters from CPF"""
-    if raw is None:
-        return ""
-    s = re.sub(r"\D", "", str(raw))
-    return s
-
-def validate_cpf(cpf: str) -> bool:
-    """Validate Brazilian CPF number"""
-    cpf = normalize_cpf(cpf)
-    if len(cpf) != 11:
-        return False
-    # evita sequências iguais
-    if cpf == cpf[0] * 11:
-        return False
-
-    def calc_digit(cpf_slice: str) -> int:
-        size = len(cpf_slice) + 1
-        total = 0
-        for i, ch in enumerate(cpf_slice):
-            total += int(ch) * (size - i)
-        r = total % 11
-        return 0 if r < 2 else 11 - r
-
-    d1 = calc_digit(cpf[:9])
-    d2 = calc_digit(cpf[:10])
-    return d1 == int(cpf[9]) and d2 == int(cpf[10])
-
-def parse_date_str(s: str) -> date:
-    """Parse date string in various formats"""
-    if s is None:
-        raise ValueError("Data vazia")
-    s = str(s).strip()
-    # tenta formatos comuns
-    for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%Y/%m/%d"):
-        try:
-            return datetime.strptime(s, fmt).date()
-        except Exception:
-            pass
-    # fallback mais flexível
+# 📊 VISÕES MATERIALIZADAS DE FREQUÊNCIA (ver attendance_rollups.py)
+async def update_attendance_rollups(chamada: dict):
+    """Atualiza os resumos após gravar uma chamada. Uma falha aqui não desfaz a chamada:
+    os resumos podem ser refeitos com POST /migrate/attendance-summary e /migrate/turma-daily-rollup"""
+    attendance_matrices.invalidate(chamada.get("turma_id"))
+    pending_notifier.avisar(chamada.get("turma_id"))
     try:
-        return dateutil_parser.parse(s, dayfirst=True).date()
+        await apply_attendance_to_summary(db, chamada)
     except Exception as e:
-        raise ValueError("Formato de data inválido. Utilize YYYY-MM-DD ou DD/MM/YYYY") from e
+        print(f"⚠️ Erro ao atualizar resumo de frequência (chamada {chamada.get('id')}): {e}")
+    try:
+        await apply_attendance_to_daily_rollup(db, chamada)
+    except Exception as e:
+        print(f"⚠️ Erro ao atualizar rollup diário (chamada {chamada.get('id')}): {e}")
+
+# 🚀 PRÉ-CARREGAMENTO EM LOTE (evita N+1 consultas em relatórios)
+CSV_PREFETCH_CHUNK = 500  # chamadas por lote de pré-carregamento
+REPORT_BATCH_SIZE = int(os.environ.get("REPORT_BATCH_SIZE", "500"))  # batch_size padrão dos cursores de relatório
+BULK_UPLOAD_CHUNK = 500  # operações por bulk_write no upload em massa de alunos
+
+async def prefetch_by_ids(collection, ids, cache: dict, projection: Optional[dict] = None) -> dict:
+    """Busca com um único $in os documentos (chave "id") que ainda não estão no cache.
+    Ids inexistentes ficam como None para não serem consultados de novo."""
+    missing = list({i for i in ids if i and i not in cache})
+    if not missing:
+        return cache
+    async for doc in collection.find({"id": {"$in": missing}}, projection):
+        cache.setdefault(doc["id"], doc)
+    for item_id in missing:
+        cache.setdefault(item_id, None)
+    return cache
+
+async def stream_json_array(cursor, transform=None):
+    """Serializa um cursor como array JSON, documento a documento"""
+    yield "["
+    first = True
+    async for doc in cursor:
+        if transform:
+            doc = transform(doc)
+        yield ("" if first else ",") + json.dumps(jsonable_encoder(doc), ensure_ascii=False)
+        first = False
+    yield "]"
+
+async def iter_chunks(source, size: int):
+    """Agrupa uma lista ou um cursor assíncrono em lotes de tamanho fixo"""
+    if hasattr(source, "__aiter__"):
+        lote = []
+        async for item in source:
+            lote.append(item)
+            if len(lote) >= size:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
+    else:
+        for start in range(0, len(source), size):
+            yield source[start:start + size]
 
 # JWT Token Functions
 def create_access_token(data: dict):
@@ -618,14 +754,35 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if user_email is None:
             raise HTTPException(status_code=401, detail="Token inválido")
         
-        user = await db.usuarios.find_one({"email": user_email})
-        if user is None:
+        principal = await load_principal(user_email)
+        if principal is None:
             raise HTTPException(status_code=401, detail="Usuário não encontrado")
         
-        return UserResponse(**user)
+        # Cópia: endpoints que alteram o objeto não contaminam o cache
+        return principal.model_copy()
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Token inválido")
 
+async def load_principal(user_email: str) -> Optional[UserResponse]:
+    """Usuário do email via principal_cache (None se não existe); é o objeto do cache, copie antes de alterar"""
+    principal = principal_cache.get(user_email)
+    if principal is None:
+        user = await db.usuarios.find_one({"email": user_email}, {"_id": 0, "senha": 0})
+        if user is None:
+            return None
+        
+        principal = UserResponse(**user)
+        principal_cache.set(user_email, principal)
+        principal_emails[principal.id] = user_email
+    return principal
+
+def invalidate_principal(user_id: Optional[str] = None, email: Optional[str] = None):
+    """Descarta o usuário do cache após qualquer alteração no seu cadastro"""
+    if user_id:
+        email = principal_emails.pop(user_id, None) or email
+    if email:
+        principal_cache.pop(email)
+
 def check_admin_permission(current_user: UserResponse):
     if current_user.tipo != "admin":
         raise HTTPException(status_code=403, detail="Apenas administradores podem realizar esta ação")
@@ -639,47 +796,14 @@ async def user_can_manage_student(current_user: UserResponse, student_id: str) -
     - Pedagogo: pode gerenciar alunos de sua unidade/curso
     - Monitor: pode gerenciar alunos das turmas que monitora
     """
-    if current_user.tipo == "admin":
-        return True
-    
-    if current_user.tipo == "instrutor":
-        # Verificar se aluno está em alguma turma do instrutor
-        turmas_instrutor = await db.turmas.find({"instrutor_id": current_user.id}).to_list(1000)
-        for turma in turmas_instrutor:
-            if student_id in turma.get("alunos_ids", []):
-                return True
-        return False
-    
-    if current_user.tipo == "pedagogo":
-        # Verificar se aluno pertence à unidade/curso do pedagogo
-        # Primeiro buscar turmas da unidade/curso do pedagogo
-        query = {}
-        if getattr(current_user, 'unidade_id', None):
-            query["unidade_id"] = getattr(current_user, 'unidade_id', None)
-        if getattr(current_user, 'curso_id', None):
-            query["curso_id"] = getattr(current_user, 'curso_id', None)
-            
-        turmas_pedagogo = await db.turmas.find(query).to_list(1000)
-        for turma in turmas_pedagogo:
-            if student_id in turma.get("alunos_ids", []):
-                return True
-        return False
-    
-    if current_user.tipo == "monitor":
-        # Verificar se aluno está em turmas que o monitor acompanha
-        turmas_monitor = await db.turmas.find({"monitor_id": current_user.id}).to_list(1000)
-        for turma in turmas_monitor:
-            if student_id in turma.get("alunos_ids", []):
-                return True
-        return False
-    
-    return False
+    scope = await scope_resolver.resolve(current_user, "gestao_alunos")
+    return scope.allows_aluno(student_id)
 
 # AUTH ROUTES
 @api_router.post("/auth/login")
 async def login(user_login: UserLogin):
     user = await db.usuarios.find_one({"email": user_login.email})
-    if not user or not bcrypt.verify(user_login.senha, user["senha"]):
+    if not user or not await verify_password(user_login.senha, user["senha"]):
         raise HTTPException(status_code=401, detail="Email ou senha incorretos")
     
     if not user["ativo"]:
@@ -713,7 +837,7 @@ async def first_access_request(user_data: FirstAccessRequest):
     
     # Generate temporary password
     temp_password = str(uuid.uuid4())[:8]
-    hashed_password = bcrypt.hash(temp_password)
+    hashed_password = await hash_password(temp_password)
     
     print(f"✅ Criando usuário pendente: {user_data.nome}")
     
@@ -738,14 +862,15 @@ async def get_me(current_user: UserResponse = Depends(get_current_user)):
 @api_router.post("/auth/change-password")
 async def change_password(password_reset: PasswordReset, current_user: UserResponse = Depends(get_current_user)):
     user = await db.usuarios.find_one({"id": current_user.id})
-    if not bcrypt.verify(password_reset.senha_atual, user["senha"]):
+    if not await verify_password(password_reset.senha_atual, user["senha"]):
         raise HTTPException(status_code=400, detail="Senha atual incorreta")
     
-    hashed_password = bcrypt.hash(password_reset.nova_senha)
+    hashed_password = await hash_password(password_reset.nova_senha)
     await db.usuarios.update_one(
         {"id": current_user.id},
         {"$set": {"senha": hashed_password, "primeiro_acesso": False}}
     )
+    invalidate_principal(current_user.id, current_user.email)
     
     return {"message": "Senha alterada com sucesso"}
 
@@ -779,7 +904,7 @@ async def create_user(user_create: UserCreate, current_user: UserResponse = Depe
     
     # Generate temporary password and confirmation token
     temp_password = str(uuid.uuid4())[:8]
-    hashed_password = bcrypt.hash(temp_password)
+    hashed_password = await hash_password(temp_password)
     confirmation_token = str(uuid.uuid4())
     
     user_dict = user_create.dict()
@@ -881,6 +1006,7 @@ async def update_user(user_id: str, user_update: UserUpdate, current_user: UserR
         raise HTTPException(status_code=400, detail="Nenhum dado para atualizar")
     
     result = await db.usuarios.update_one({"id": user_id}, {"$set": update_data})
+    invalidate_principal(user_id)
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     
@@ -904,13 +1030,14 @@ async def reset_password_request(email_data: dict):
     if user:
         # Generate new temporary password
         temp_password = str(uuid.uuid4())[:8]
-        hashed_password = bcrypt.hash(temp_password)
+        hashed_password = await hash_password(temp_password)
         
         # Update user password
         await db.usuarios.update_one(
             {"email": email},
             {"$set": {"senha": hashed_password, "primeiro_acesso": True}}
         )
+        invalidate_principal(user["id"], email)
         
         # TODO: Enviar por email
         # send_password_email(email, temp_password)
@@ -935,13 +1062,14 @@ async def admin_reset_user_password(user_id: str, current_user: UserResponse = D
     
     # Generate new temporary password
     temp_password = str(uuid.uuid4())[:8]
-    hashed_password = bcrypt.hash(temp_password)
+    hashed_password = await hash_password(temp_password)
     
     # Update user password
     result = await db.usuarios.update_one(
         {"id": user_id},
         {"$set": {"senha": hashed_password, "primeiro_acesso": True}}
     )
+    invalidate_principal(user_id, user["email"])
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Erro ao atualizar senha")
@@ -962,12 +1090,13 @@ async def approve_user(user_id: str, current_user: UserResponse = Depends(get_cu
     
     # Generate a new temporary password for the approved user
     temp_password = str(uuid.uuid4())[:8]
-    hashed_password = bcrypt.hash(temp_password)
+    hashed_password = await hash_password(temp_password)
     
     result = await db.usuarios.update_one(
         {"id": user_id}, 
         {"$set": {"status": "ativo", "senha": hashed_password}}
     )
+    invalidate_principal(user_id)
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
@@ -979,11 +1108,18 @@ async def delete_user(user_id: str, current_user: UserResponse = Depends(get_cur
     check_admin_permission(current_user)
     
     result = await db.usuarios.update_one({"id": user_id}, {"$set": {"ativo": False}})
+    invalidate_principal(user_id)
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     
     return {"message": "Usuário desativado com sucesso"}
 
+@api_router.get("/auth/hash-metrics")
+async def get_password_hash_metrics(current_user: UserResponse = Depends(get_current_user)):
+    """📈 Métricas do pool de bcrypt: fila, operações em andamento e latências"""
+    check_admin_permission(current_user)
+    return password_hasher.metrics()
+
 # UNIDADES ROUTES
 @api_router.post("/units", response_model=Unidade)
 async def create_unidade(unidade_create: UnidadeCreate, current_user: UserResponse = Depends(get_current_user)):
@@ -1087,6 +1223,48 @@ async def delete_curso(curso_id: str, current_user: UserResponse = Depends(get_c
     
     return {"message": "Curso desativado com sucesso"}
 
+# FERIADOS ROUTES
+@api_router.get("/holidays", response_model=List[Feriado])
+async def get_feriados(
+    unidade_id: Optional[str] = None,
+    ano: Optional[int] = Query(None, ge=2000, le=2100),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Feriados gerais e, com unidade_id, também os da unidade"""
+    query = {}
+    if unidade_id:
+        query["unidade_id"] = {"$in": [None, unidade_id]}
+    if ano:
+        query["data"] = {"$gte": f"{ano}-01-01", "$lte": f"{ano}-12-31"}
+    feriados = await db.feriados.find(query, {"_id": 0}).sort("data", 1).to_list(None)
+    return [Feriado(**feriado) for feriado in feriados]
+
+@api_router.post("/holidays", response_model=Feriado)
+async def create_feriado(feriado_create: FeriadoCreate, current_user: UserResponse = Depends(get_current_user)):
+    check_admin_permission(current_user)
+    
+    if feriado_create.unidade_id and not await db.unidades.find_one({"id": feriado_create.unidade_id}, {"_id": 1}):
+        raise HTTPException(status_code=400, detail="Unidade não encontrada")
+    
+    feriado_obj = Feriado(**feriado_create.dict())
+    try:
+        await db.feriados.insert_one(prepare_for_mongo(feriado_obj.dict()))
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Feriado já cadastrado para esta data")
+    schedule_cache.invalidate()
+    return feriado_obj
+
+@api_router.delete("/holidays/{feriado_id}")
+async def delete_feriado(feriado_id: str, current_user: UserResponse = Depends(get_current_user)):
+    check_admin_permission(current_user)
+    
+    result = await db.feriados.delete_one({"id": feriado_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Feriado não encontrado")
+    schedule_cache.invalidate()
+    
+    return {"message": "Feriado removido com sucesso"}
+
 # ALUNOS ROUTES
 @api_router.post("/students", response_model=Aluno)
 async def create_aluno(aluno_create: AlunoCreate, current_user: UserResponse = Depends(get_current_user)):
@@ -1183,91 +1361,17 @@ async def get_alunos(
         query = {}
         if status:
             query["status"] = status
-    elif current_user.tipo == "instrutor":
-        # 👨‍🏫 INSTRUTOR: VÊ APENAS ALUNOS DAS TURMAS QUE ELE LECIONA
-        # NOVA LÓGICA: Similar ao pedagogo, mas filtrado por curso específico do instrutor
-        
-        if not getattr(current_user, 'curso_id', None) or not getattr(current_user, 'unidade_id', None):
-            print("❌ Instrutor sem curso ou unidade definida")
-            return []
-            
-        # Buscar todas as turmas do curso específico do instrutor na sua unidade
-        turmas_instrutor = await db.turmas.find({
-            "curso_id": getattr(current_user, 'curso_id', None),
-            "unidade_id": getattr(current_user, 'unidade_id', None),
-            "instrutor_id": current_user.id,  # Apenas turmas que ele leciona
-            "ativo": True
-        }).to_list(1000)
-        
-        print(f"🔍 Instrutor {current_user.email} leciona {len(turmas_instrutor)} turmas")
-        
-        # Coletar IDs de todos os alunos das turmas do instrutor
-        aluno_ids = set()
-        for turma in turmas_instrutor:
-            turma_alunos = turma.get("alunos_ids", [])
-            aluno_ids.update(turma_alunos)
-            print(f"   Turma '{turma['nome']}': {len(turma_alunos)} alunos")
-        
-        if aluno_ids:
-            query = {"id": {"$in": list(aluno_ids)}, "ativo": True}
-            print(f"👨‍🏫 Instrutor vendo {len(aluno_ids)} alunos das suas turmas")
-        else:
-            print("👨‍🏫 Instrutor: nenhum aluno nas turmas lecionadas")
-            return []
-            
-    elif current_user.tipo == "pedagogo":
-        # 📊 Pedagogo: vê todos os cursos da unidade
-        if not getattr(current_user, 'unidade_id', None):
-            print("❌ Pedagogo sem unidade definida")
+    elif current_user.tipo in ["instrutor", "pedagogo", "monitor"]:
+        # 👨‍🏫 INSTRUTOR: alunos das turmas ativas que leciona no seu curso/unidade
+        # 📊 PEDAGOGO / 👩‍💻 MONITOR: alunos das turmas ativas da unidade
+        scope = await scope_resolver.resolve(current_user, "lista_alunos")
+        if not scope.aluno_ids:
+            print(f"❌ {current_user.tipo} {current_user.email}: nenhum aluno visível (sem curso/unidade ou turmas vazias)")
             return []
-            
-        # Buscar todas as turmas da unidade
-        turmas_unidade = await db.turmas.find({
-            "unidade_id": getattr(current_user, 'unidade_id', None),
-            "ativo": True
-        }).to_list(1000)
         
-        # Coletar IDs de todos os alunos da unidade
-        aluno_ids = set()
-        for turma in turmas_unidade:
-            aluno_ids.update(turma.get("alunos_ids", []))
-        
-        if aluno_ids:
-            query = {"id": {"$in": list(aluno_ids)}, "ativo": True}
-            print(f"📊 Pedagogo vendo {len(aluno_ids)} alunos da unidade {getattr(current_user, 'unidade_id', None)}")
-        else:
-            print("📊 Pedagogo: nenhum aluno nas turmas da unidade")
-            return []
-            
-    elif current_user.tipo == "monitor":
-        # 👩‍💻 MONITOR: VÊ TODOS OS ALUNOS DA UNIDADE (igual ao pedagogo)
-        if not getattr(current_user, 'unidade_id', None):
-            print("❌ Monitor sem unidade definida")
-            return []
+        query = {"id": {"$in": list(scope.aluno_ids)}, "ativo": True}
+        print(f"🔍 {current_user.tipo} {current_user.email} vendo {len(scope.aluno_ids)} alunos de {len(scope.turma_ids)} turmas")
             
-        # Buscar todas as turmas da unidade (igual lógica do pedagogo)
-        turmas_unidade = await db.turmas.find({
-            "unidade_id": getattr(current_user, 'unidade_id', None),
-            "ativo": True
-        }).to_list(1000)
-        
-        print(f"🔍 Monitor {current_user.email} da unidade {getattr(current_user, 'unidade_id', None)}")
-        print(f"   Turmas na unidade: {len(turmas_unidade)}")
-        
-        # Coletar IDs de todos os alunos da unidade
-        aluno_ids = set()
-        for turma in turmas_unidade:
-            turma_alunos = turma.get("alunos_ids", [])
-            aluno_ids.update(turma_alunos)
-            nome_turma = turma.get("nome", "N/A")
-            print(f"   Turma '{nome_turma}': {len(turma_alunos)} alunos")
-        
-        if aluno_ids:
-            query = {"id": {"$in": list(aluno_ids)}, "ativo": True}
-            print(f"👩‍💻 Monitor vendo {len(aluno_ids)} alunos da unidade")
-        else:
-            print("👩‍💻 Monitor: nenhum aluno nas turmas da unidade")
-            return []
     else:
         # Outros tipos de usuário não podem ver alunos
         print(f"❌ Tipo de usuário {current_user.tipo} não autorizado")
@@ -1510,8 +1614,11 @@ async def reset_all_database(current_user: UserResponse = Depends(get_current_us
         # APAGAR TUDO
         result_alunos = await db.alunos.delete_many({})
         result_turmas = await db.turmas.delete_many({})
+        scope_resolver.invalidate()
         # 🎯 CORREÇÃO CRÍTICA: Usar collection 'attendances' (não 'chamadas')
         result_chamadas = await db.attendances.delete_many({})
+        await clear_attendance_rollups(db)
+        attendance_matrices.invalidate()
         
         print(f"✅ RESET CONCLUÍDO:")
         print(f"   Alunos removidos: {result_alunos.deleted_count}")
@@ -1621,43 +1728,19 @@ async def debug_students_for_user(user_id: str, current_user: UserResponse = Dep
         ]
     }
 
-@api_router.post("/students/bulk-upload")
-async def bulk_upload_students(
-    file: UploadFile = File(...),
-    turma_id: Optional[str] = Query(None, description="ID da turma para associar alunos"),
-    curso_id: Optional[str] = Query(None, description="ID do curso (opcional para instrutor)"),
-    update_existing: bool = Query(False, description="Se true, atualiza aluno existente por CPF"),
-    current_user: UserResponse = Depends(get_current_user),
-):
-    """
-    🚀 UPLOAD EM MASSA DE ALUNOS - SISTEMA AVANÇADO
-    
-    📋 Formatos aceitos: CSV (.csv) e Excel (.xls/.xlsx)
-    📊 Campos obrigatórios: nome_completo, cpf, data_nascimento
-    📊 Campos opcionais: email, telefone, rg, genero, endereco
-    
-    ✅ Validações implementadas:
-    - CPF brasileiro com algoritmo de validação
-    - Datas em múltiplos formatos (DD/MM/YYYY, YYYY-MM-DD, etc.)
-    - Duplicados por CPF (atualizar ou pular)
-    - Permissões por tipo de usuário
-    
-    👨‍🏫 Instrutor: apenas seu curso específico
-    📊 Pedagogo: qualquer curso da sua unidade  
-    👩‍💻 Monitor: NÃO pode fazer upload
-    👑 Admin: sem restrições
-    
-    🎯 Associação automática à turma se turma_id fornecido
-    📊 Retorna resumo detalhado: inseridos/atualizados/pulados/erros
-    """
-    
+def novo_aluno_id(line: Any) -> str:
+    """Id de aluno criado na requisição síncrona (os jobs usam id_deterministico)"""
+    return str(uuid.uuid4())
+
+async def validar_upload_bulk(file: UploadFile, curso_id: Optional[str], current_user: UserResponse) -> Optional[str]:
+    """Permissões e arquivo do upload em massa; devolve o curso_id efetivo"""
     # 🔒 VERIFICAÇÃO DE PERMISSÕES
     if current_user.tipo == "monitor":
         raise HTTPException(
             status_code=403,
             detail="Monitores não podem fazer upload de alunos. Apenas visualizar."
         )
-    
+
     # 🎯 Para instrutor sem curso_id explícito, usar o curso do usuário
     if current_user.tipo == "instrutor" and not curso_id:
         curso_id = getattr(current_user, "curso_id", None)
@@ -1666,131 +1749,130 @@ async def bulk_upload_students(
                 status_code=400,
                 detail="Instrutor deve ter curso associado ou fornecer curso_id"
             )
-    
+
     # 📁 VALIDAÇÃO DO ARQUIVO
     if not file.filename:
         raise HTTPException(status_code=400, detail="Nome do arquivo é obrigatório")
-    
-    filename = file.filename.lower()
-    content = await file.read()
-    
-    if not content:
+
+    if not await file.read(1):
         raise HTTPException(status_code=400, detail="Arquivo está vazio")
-    
-    # 📊 PARSING DO ARQUIVO (CSV ou Excel)
-    rows: List[Dict[str, Any]] = []
-    
-    try:
-        if filename.endswith(".csv") or not any(filename.endswith(ext) for ext in (".xls", ".xlsx")):
-            # 📄 PARSE CSV
-            try:
-                # Tentar UTF-8 primeiro
-                text = content.decode("utf-8", errors="replace")
-            except UnicodeDecodeError:
-                try:
-                    # Fallback Windows-1252 (Excel brasileiro)
-                    text = content.decode("windows-1252", errors="replace")
-                except UnicodeDecodeError:
-                    # Último recurso
-                    text = content.decode("iso-8859-1", errors="replace")
-            
-            # Detectar separador automaticamente
-            delimiter = ',' if ',' in text.split('\n')[0] else ';'
-            
-            reader = csv.DictReader(StringIO(text), delimiter=delimiter)
-            for i, r in enumerate(reader, start=2):
-                # Limpar dados e adicionar número da linha
-                clean_row = {"_line": i}
-                for k, v in r.items():
-                    if k and v:
-                        # Remover BOM e caracteres especiais
-                        key_clean = str(k).strip().lstrip('\ufeff').lstrip('�')
-                        value_clean = str(v).strip().lstrip('\ufeff').lstrip('�')
-                        clean_row[key_clean] = value_clean
-                rows.append(clean_row)
-                
-        else:
-            # 📊 PARSE EXCEL (necessita pandas)
-            try:
-                import pandas as pd
-            except ImportError:
-                raise HTTPException(
-                    status_code=400, 
-                    detail="Para upload de Excel é necessário instalar pandas e openpyxl no backend"
-                )
-            
-            try:
-                df = pd.read_excel(BytesIO(content), dtype=str)
-                df = df.fillna("")  # Substituir NaN por string vazia
-                
-                for idx, r in df.iterrows():
-                    clean_row = {"_line": idx + 2}  # +2 porque header é linha 1
-                    for k, v in r.items():
-                        if not pd.isna(v) and str(v).strip():
-                            clean_row[str(k).strip()] = str(v).strip()
-                    rows.append(clean_row)
-                    
-            except Exception as e:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Erro ao processar Excel: {str(e)}"
-                )
-                
-    except Exception as e:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Erro ao ler arquivo: {str(e)}"
-        )
-    
-    if not rows:
-        raise HTTPException(
+    await file.seek(0)
+    return curso_id
+
+def erro_leitura_upload(e: Exception, filename: str) -> HTTPException:
+    """Falha do parser (CSV/Excel) na mensagem que o upload sempre devolveu"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, ImportError):
+        return HTTPException(
             status_code=400,
-            detail="Arquivo sem dados válidos ou cabeçalho incorreto"
+            detail="Para upload de Excel é necessário instalar pandas e openpyxl no backend"
         )
-    
-    # 🔍 FUNÇÃO PARA BUSCAR CAMPOS COM ALIASES
-    def get_field(r: Dict[str, Any], *aliases):
-        """Busca campo por vários aliases possíveis"""
-        for alias in aliases:
-            if alias in r and r[alias]:
-                return r[alias]
-            # Busca case-insensitive com normalização
-            alias_norm = alias.lower().replace(" ", "_").replace("-", "_")
-            for k in r.keys():
-                k_norm = k.lower().replace(" ", "_").replace("-", "_")
-                if k_norm == alias_norm and r[k]:
-                    return r[k]
-        return None
-    
-    # 📊 CONTADORES E RESULTADOS
+    if filename.endswith((".xls", ".xlsx")):
+        return HTTPException(status_code=400, detail=f"Erro ao processar Excel: {str(e)}")
+    return HTTPException(status_code=400, detail=f"Erro ao ler arquivo: {str(e)}")
+
+IMPORT_PROFILES_MAX = 200
+
+async def carregar_perfis_importacao(profile_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Perfil escolhido (404 se não existe) ou os ativos, do mais recente, para detecção"""
+    if profile_id:
+        perfil = await db.import_profiles.find_one({"id": profile_id, "ativo": True}, {"_id": 0})
+        if not perfil:
+            raise HTTPException(status_code=404, detail="Perfil de importação não encontrado")
+        return [perfil]
+    return await db.import_profiles.find({"ativo": True}, {"_id": 0}).sort("updated_at", -1).to_list(IMPORT_PROFILES_MAX)
+
+async def preparar_bulk_upload(
+    current_user: UserResponse,
+    turma_id: Optional[str],
+    curso_id: Optional[str],
+    update_existing: bool,
+    novo_id: Callable[[Any], str] = novo_aluno_id,
+    perfis: Optional[List[Dict[str, Any]]] = None,
+    profile_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Estado do upload em massa compartilhado entre os lotes"""
+    # 🎯 TURMA E PERMISSÃO: verificadas uma única vez
+    turma_destino = None
+    if turma_id:
+        try:
+            turma = await db.turmas.find_one({"id": turma_id})
+            if turma:
+                # Verificar permissões baseadas no tipo de usuário
+                can_add_to_turma = False
+
+                if current_user.tipo == "admin":
+                    can_add_to_turma = True
+                elif current_user.tipo == "instrutor":
+                    # Instrutor: apenas suas turmas
+                    if turma["instrutor_id"] == current_user.id:
+                        can_add_to_turma = True
+                elif current_user.tipo == "pedagogo":
+                    # Pedagogo: turmas da sua unidade
+                    if turma.get("unidade_id") == getattr(current_user, 'unidade_id', None):
+                        can_add_to_turma = True
+
+                if can_add_to_turma:
+                    turma_destino = turma_id
+                else:
+                    print(f"⚠️ Usuário {current_user.email} sem permissão para adicionar à turma {turma_id}")
+            else:
+                print(f"⚠️ Turma {turma_id} não encontrada")
+        except Exception as e:
+            print(f"❌ Erro ao verificar turma {turma_id}: {e}")
+
+    return {
+        "current_user": current_user,
+        "curso_id": curso_id,
+        "update_existing": update_existing,
+        "turma_destino": turma_destino,
+        # cpf -> id do aluno: cadastrados no banco (buscados por lote) e criados neste arquivo
+        "existentes": {},
+        "novo_id": novo_id,
+        # 🗺️ Perfil: `cabecalho` é preenchido pelo leitor do arquivo e `campos` compilado no 1º lote
+        "perfis": perfis or [],
+        "profile_id": profile_id,
+        "perfil": None,
+        "cabecalho": [],
+        "campos": None,
+    }
+
+async def processar_lote_bulk_upload(estado: Dict[str, Any], lote: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Valida e grava um lote do upload em massa (um $in de CPFs, um bulk_write e
+    um $addToSet na turma). Devolve os contadores e os erros do lote"""
+    current_user = estado["current_user"]
+    curso_id = estado["curso_id"]
+    update_existing = estado["update_existing"]
+    turma_destino = estado["turma_destino"]
+    existentes: Dict[str, Optional[str]] = estado["existentes"]
+    novo_id = estado["novo_id"]
+
+    # 🗺️ COLUNAS DE CADA CAMPO: compiladas uma vez por arquivo, no primeiro lote
+    if estado["campos"] is None:
+        colunas = estado["cabecalho"] or list(dict.fromkeys(k for r in lote for k in r))
+        perfil = estado["perfis"][0] if estado["profile_id"] else detectar_perfil(colunas, estado["perfis"])
+        estado["perfil"] = perfil
+        estado["campos"] = compilar_mapa(colunas, perfil)
+        if perfil:
+            print(f"🗺️ Perfil de importação: {perfil['nome']} ({perfil['id']})")
+    campos = estado["campos"]
+
     inserted = 0
     updated = 0
     skipped = 0
     errors: List[Dict[str, Any]] = []
-    
-    print(f"🚀 Iniciando bulk upload: {len(rows)} linhas para processar")
-    print(f"👤 Usuário: {current_user.nome} ({current_user.tipo})")
-    if curso_id:
-        print(f"📚 Curso ID: {curso_id}")
-    if turma_id:
-        print(f"🎯 Turma ID: {turma_id}")
-    
-    # 🔄 PROCESSAR CADA LINHA
-    for r in rows:
+
+    # 🔄 1ª PASSADA: EXTRAIR OS CAMPOS OBRIGATÓRIOS DE CADA LINHA DO LOTE
+    extraidas: List[Dict[str, Any]] = []
+    for r in lote:
         line = r.get("_line", "?")
         
         try:
-            # 📋 EXTRAIR CAMPOS COM ALIASES
-            nome = get_field(r, "nome_completo", "nome", "full_name", "student_name")
-            data_nasc_raw = get_field(r, "data_nascimento", "data nascimento", "birthdate", "dob", "data_nasc")
-            cpf_raw = get_field(r, "cpf", "CPF", "Cpf", "document")
-            
-            # Campos opcionais
-            email = get_field(r, "email", "e-mail", "Email")
-            telefone = get_field(r, "telefone", "phone", "celular", "tel")
-            rg = get_field(r, "rg", "RG", "identidade")
-            genero = get_field(r, "genero", "sexo", "gender")
-            endereco = get_field(r, "endereco", "endereço", "address")
+            # 📋 EXTRAIR CAMPOS PELAS COLUNAS DO PERFIL/ALIASES
+            nome = valor_campo(r, campos["nome"])
+            data_nasc_raw = valor_campo(r, campos["data_nascimento"])
+            cpf_raw = valor_campo(r, campos["cpf"])
             
             # ✅ VALIDAÇÕES BÁSICAS
             if not nome or not cpf_raw:
@@ -1801,9 +1883,31 @@ async def bulk_upload_students(
                 })
                 continue
             
-            # ✅ VALIDAÇÃO E NORMALIZAÇÃO CPF
-            cpf_norm = normalize_cpf(cpf_raw)
-            if not validate_cpf(cpf_norm):
+            extraidas.append({"r": r, "line": line, "nome": nome, "cpf_raw": cpf_raw, "data_nasc_raw": data_nasc_raw})
+            
+        except Exception as e:
+            # 🚨 ERRO INESPERADO
+            errors.append({
+                "line": line,
+                "error": f"Erro inesperado: {str(e)}",
+                "data": {"exception_type": type(e).__name__}
+            })
+            print(f"❌ Erro na linha {line}: {e}")
+            continue
+    
+    # ✅ CPF E DATA DE NASCIMENTO: validados em bloco para o lote inteiro (NumPy)
+    validacao = validar_lote(
+        [e["cpf_raw"] for e in extraidas],
+        [e["data_nasc_raw"] for e in extraidas],
+    )
+    
+    validas: List[Dict[str, Any]] = []
+    for pos, e in enumerate(extraidas):
+        r, line, cpf_raw, data_nasc_raw = e["r"], e["line"], e["cpf_raw"], e["data_nasc_raw"]
+        
+        try:
+            cpf_norm = validacao.cpf_normalizado[pos]
+            if not validacao.cpf_valido[pos]:
                 errors.append({
                     "line": line,
                     "error": f"CPF inválido: {cpf_raw}",
@@ -1811,67 +1915,87 @@ async def bulk_upload_students(
                 })
                 continue
             
-            # ✅ VALIDAÇÃO DATA DE NASCIMENTO
-            data_nasc = None
-            if data_nasc_raw:
-                try:
-                    data_nasc = parse_date_str(data_nasc_raw)
-                except Exception as e:
-                    errors.append({
-                        "line": line,
-                        "error": f"Data de nascimento inválida: {data_nasc_raw}",
-                        "data": {"data_original": data_nasc_raw, "erro": str(e)}
-                    })
-                    continue
+            if validacao.data_erro[pos] is not None:
+                errors.append({
+                    "line": line,
+                    "error": f"Data de nascimento inválida: {data_nasc_raw}",
+                    "data": {"data_original": data_nasc_raw, "erro": validacao.data_erro[pos]}
+                })
+                continue
             
-            # 🔍 VERIFICAR SE ALUNO JÁ EXISTE (por CPF)
-            existing = await db.alunos.find_one({"cpf": cpf_norm})
+            # Campos opcionais (só entram no documento se fornecidos)
+            opcionais = {}
+            if validacao.data_iso[pos]:
+                opcionais["data_nascimento"] = validacao.data_iso[pos]
+            for campo in ("email", "telefone", "rg", "genero", "endereco"):
+                valor = valor_campo(r, campos[campo])
+                if valor:
+                    opcionais[campo] = valor
+            if curso_id:
+                opcionais["curso_id"] = curso_id
+            
+            validas.append({"line": line, "nome": e["nome"].strip(), "cpf": cpf_norm, "opcionais": opcionais})
             
-            if existing:
+        except Exception as ex:
+            # 🚨 ERRO INESPERADO
+            errors.append({
+                "line": line,
+                "error": f"Erro inesperado: {str(ex)}",
+                "data": {"exception_type": type(ex).__name__}
+            })
+            print(f"❌ Erro na linha {line}: {ex}")
+            continue
+
+    # 🔍 ALUNOS JÁ CADASTRADOS: uma consulta $in para os CPFs novos do lote
+    cpfs = [cpf for cpf in dict.fromkeys(v["cpf"] for v in validas) if cpf not in existentes]
+    if cpfs:
+        async for aluno in db.alunos.find({"cpf": {"$in": cpfs}}, {"_id": 0, "id": 1, "cpf": 1}):
+            existentes.setdefault(aluno["cpf"], aluno.get("id"))
+
+    # 🔄 2ª PASSADA: planejar as escritas do lote e gravar com um bulk_write
+    # Uma operação por aluno (bulk_write desordenado não garante a ordem):
+    # CPF repetido no lote mescla sua atualização na operação pendente
+    pendentes: Dict[str, Dict[str, Any]] = {}  # aluno_id -> {"insert": doc} ou {"set": campos}
+    linhas_pendentes: Dict[str, List[tuple]] = {}  # aluno_id -> [(linha, "inserted"/"updated")]
+    roster: List[str] = []
+
+    for v in validas:
+        line = v["line"]
+        try:
+            id_da_linha = novo_id(line)
+            # Job retomado: o aluno que esta mesma linha criou antes da queda não é "existente"
+            if v["cpf"] in existentes and existentes[v["cpf"]] != id_da_linha:
+                aluno_id_to_use = existentes[v["cpf"]]
+                if aluno_id_to_use is None:
+                    raise KeyError("id")
+
                 if update_existing:
                     # 🔄 ATUALIZAR ALUNO EXISTENTE
                     update_doc = {
-                        "nome": nome.strip(),
-                        "cpf": cpf_norm,
+                        "nome": v["nome"],
+                        "cpf": v["cpf"],
                         "updated_by": current_user.id,
                         "updated_at": datetime.now(timezone.utc).isoformat()
                     }
-                    
-                    # Adicionar campos opcionais se fornecidos
-                    if data_nasc:
-                        update_doc["data_nascimento"] = data_nasc.isoformat()
-                    if email:
-                        update_doc["email"] = email
-                    if telefone:
-                        update_doc["telefone"] = telefone
-                    if rg:
-                        update_doc["rg"] = rg
-                    if genero:
-                        update_doc["genero"] = genero
-                    if endereco:
-                        update_doc["endereco"] = endereco
-                    if curso_id:
-                        update_doc["curso_id"] = curso_id
-                    
-                    await db.alunos.update_one(
-                        {"id": existing["id"]}, 
-                        {"$set": update_doc}
-                    )
+                    update_doc.update(v["opcionais"])
+
+                    op = pendentes.get(aluno_id_to_use)
+                    if op is None:
+                        pendentes[aluno_id_to_use] = {"set": update_doc}
+                    else:
+                        op["insert" if "insert" in op else "set"].update(update_doc)
+                    linhas_pendentes.setdefault(aluno_id_to_use, []).append((line, "updated"))
                     updated += 1
-                    aluno_id_to_use = existing["id"]
-                    
                 else:
                     # 📊 PULAR ALUNO EXISTENTE
                     skipped += 1
-                    aluno_id_to_use = existing["id"]
-                    
             else:
                 # ➕ CRIAR NOVO ALUNO
-                new_id = str(uuid.uuid4())
+                aluno_id_to_use = id_da_linha
                 doc = {
-                    "id": new_id,
-                    "nome": nome.strip(),
-                    "cpf": cpf_norm,
+                    "id": aluno_id_to_use,
+                    "nome": v["nome"],
+                    "cpf": v["cpf"],
                     "status": "ativo",
                     "ativo": True,
                     "created_by": current_user.id,
@@ -1879,65 +2003,20 @@ async def bulk_upload_students(
                     "created_by_type": current_user.tipo,
                     "created_at": datetime.now(timezone.utc).isoformat()
                 }
-                
-                # Adicionar campos opcionais
-                if data_nasc:
-                    doc["data_nascimento"] = data_nasc.isoformat()
-                if email:
-                    doc["email"] = email
-                if telefone:
-                    doc["telefone"] = telefone
-                if rg:
-                    doc["rg"] = rg
-                if genero:
-                    doc["genero"] = genero
-                if endereco:
-                    doc["endereco"] = endereco
-                if curso_id:
-                    doc["curso_id"] = curso_id
-                
+                doc.update(v["opcionais"])
+
                 # Adicionar unidade do usuário se disponível
-                if hasattr(current_user, 'unidade_id') and getattr(current_user, 'unidade_id', None):
+                if getattr(current_user, 'unidade_id', None):
                     doc["unidade_id"] = getattr(current_user, 'unidade_id', None)
-                
-                await db.alunos.insert_one(doc)
+
+                pendentes[aluno_id_to_use] = {"insert": doc, "refazer": v["cpf"] in existentes}
+                linhas_pendentes[aluno_id_to_use] = [(line, "inserted")]
+                existentes[v["cpf"]] = aluno_id_to_use
                 inserted += 1
-                aluno_id_to_use = new_id
-                
-            # 🎯 ASSOCIAR À TURMA SE FORNECIDA
-            if turma_id and aluno_id_to_use:
-                try:
-                    # Verificar se turma existe e usuário tem permissão
-                    turma = await db.turmas.find_one({"id": turma_id})
-                    if turma:
-                        # Verificar permissões baseadas no tipo de usuário
-                        can_add_to_turma = False
-                        
-                        if current_user.tipo == "admin":
-                            can_add_to_turma = True
-                        elif current_user.tipo == "instrutor":
-                            # Instrutor: apenas suas turmas
-                            if turma["instrutor_id"] == current_user.id:
-                                can_add_to_turma = True
-                        elif current_user.tipo == "pedagogo":
-                            # Pedagogo: turmas da sua unidade
-                            if turma.get("unidade_id") == getattr(current_user, 'unidade_id', None):
-                                can_add_to_turma = True
-                        
-                        if can_add_to_turma:
-                            # Adicionar aluno à turma (evita duplicatas)
-                            await db.turmas.update_one(
-                                {"id": turma_id},
-                                {"$addToSet": {"alunos_ids": aluno_id_to_use}}
-                            )
-                        else:
-                            print(f"⚠️ Usuário {current_user.email} sem permissão para adicionar à turma {turma_id}")
-                    else:
-                        print(f"⚠️ Turma {turma_id} não encontrada")
-                        
-                except Exception as e:
-                    print(f"❌ Erro ao associar aluno {aluno_id_to_use} à turma {turma_id}: {e}")
-            
+
+            if turma_destino:
+                roster.append(aluno_id_to_use)
+
         except Exception as e:
             # 🚨 ERRO INESPERADO
             errors.append({
@@ -1947,126 +2026,256 @@ async def bulk_upload_students(
             })
             print(f"❌ Erro na linha {line}: {e}")
             continue
-    
-    # 📊 RESUMO FINAL
-    summary = {
-        "total_processed": len(rows),
-        "inserted": inserted,
-        "updated": updated,
-        "skipped": skipped,
-        "errors_count": len(errors),
-        "errors": errors[:50],  # Limitar para não sobrecarregar resposta
-        "success_rate": f"{((inserted + updated + skipped) / len(rows) * 100):.1f}%" if rows else "0%"
-    }
-    
-    print(f"✅ Bulk upload concluído:")
-    print(f"   📊 Total processado: {len(rows)}")
-    print(f"   ➕ Inseridos: {inserted}")
-    print(f"   🔄 Atualizados: {updated}")
-    print(f"   ⏭️ Pulados: {skipped}")
-    print(f"   ❌ Erros: {len(errors)}")
-    print(f"   📈 Taxa de sucesso: {summary['success_rate']}")
-    
-    return {
-        "success": True,
-        "message": f"Upload concluído: {inserted} inseridos, {updated} atualizados, {skipped} pulados, {len(errors)} erros",
-        "summary": summary
-    }
 
-@api_router.post("/students/import-csv")
-async def import_students_csv(
-    file: UploadFile = File(...), 
-    current_user: UserResponse = Depends(get_current_user)
+    if pendentes:
+        chaves = list(pendentes.keys())
+        ops = []
+        for aluno_id, op in pendentes.items():
+            if "insert" not in op:
+                ops.append(UpdateOne({"id": aluno_id}, {"$set": op["set"]}))
+            elif op.get("refazer"):
+                ops.append(ReplaceOne({"id": aluno_id}, op["insert"], upsert=True))
+            else:
+                ops.append(InsertOne(op["insert"]))
+        try:
+            await db.alunos.bulk_write(ops, ordered=False)
+        except BulkWriteError as bwe:
+            # 🚨 Falhas de escrita voltam para o relatório na linha de origem
+            falhas = set()
+            for erro in bwe.details.get("writeErrors", []):
+                aluno_id = chaves[erro["index"]]
+                falhas.add(aluno_id)
+                for line, tipo in linhas_pendentes.get(aluno_id, []):
+                    if tipo == "inserted":
+                        inserted -= 1
+                    else:
+                        updated -= 1
+                    errors.append({
+                        "line": line,
+                        "error": f"Erro inesperado: {erro.get('errmsg', '')}",
+                        "data": {"exception_type": "DuplicateKeyError" if erro.get("code") == 11000 else "WriteError"}
+                    })
+                    print(f"❌ Erro na linha {line}: {erro.get('errmsg', '')}")
+            roster = [aluno_id for aluno_id in roster if aluno_id not in falhas]
+
+    # 🎯 ASSOCIAR À TURMA: um $addToSet com $each por lote (evita duplicatas)
+    if turma_destino and roster:
+        try:
+            await db.turmas.update_one(
+                {"id": turma_destino},
+                {"$addToSet": {"alunos_ids": {"$each": list(dict.fromkeys(roster))}}}
+            )
+            scope_resolver.invalidate()
+        except Exception as e:
+            print(f"❌ Erro ao associar alunos à turma {turma_destino}: {e}")
+
+    return {"inserted": inserted, "updated": updated, "skipped": skipped, "errors": errors}
+
+@api_router.post("/students/bulk-upload")
+async def bulk_upload_students(
+    file: UploadFile = File(...),
+    turma_id: Optional[str] = Query(None, description="ID da turma para associar alunos"),
+    curso_id: Optional[str] = Query(None, description="ID do curso (opcional para instrutor)"),
+    update_existing: bool = Query(False, description="Se true, atualiza aluno existente por CPF"),
+    profile_id: Optional[str] = Query(None, description="Perfil de colunas (sem ele, detectado pelo cabeçalho)"),
+    current_user: UserResponse = Depends(get_current_user),
 ):
-    """📑 IMPORTAÇÃO CSV - LÓGICA REFINADA 29/09/2025
+    """
+    🚀 UPLOAD EM MASSA DE ALUNOS - SISTEMA AVANÇADO
     
-    CSV deve conter: nome,cpf,data_nascimento,curso,turma,email,telefone
+    📋 Formatos aceitos: CSV (.csv) e Excel (.xls/.xlsx)
+    📊 Campos obrigatórios: nome_completo, cpf, data_nascimento
+    📊 Campos opcionais: email, telefone, rg, genero, endereco
     
-    👨‍🏫 Instrutor: Só aceita curso/unidade dele
-    📊 Pedagogo: Só aceita cursos da unidade dele  
-    👩‍💻 Monitor: NÃO pode importar
-    👑 Admin: Aceita qualquer curso/unidade
+    ✅ Validações implementadas:
+    - CPF brasileiro com algoritmo de validação
+    - Datas em múltiplos formatos (DD/MM/YYYY, YYYY-MM-DD, etc.)
+    - Duplicados por CPF (atualizar ou pular)
+    - Permissões por tipo de usuário
+    
+    👨‍🏫 Instrutor: apenas seu curso específico
+    📊 Pedagogo: qualquer curso da sua unidade  
+    👩‍💻 Monitor: NÃO pode fazer upload
+    👑 Admin: sem restrições
+    
+    🗺️ Colunas: perfil de importação (profile_id ou detectado pelo cabeçalho) + aliases padrão
+    🎯 Associação automática à turma se turma_id fornecido
+    📊 Retorna resumo detalhado: inseridos/atualizados/pulados/erros
+    📦 Arquivos grandes: POST /students/import-jobs (segundo plano, sem timeout)
     """
+    curso_id = await validar_upload_bulk(file, curso_id, current_user)
+    perfis = await carregar_perfis_importacao(profile_id)
+    filename = file.filename.lower()
+
+    estado = await preparar_bulk_upload(
+        current_user, turma_id, curso_id, update_existing, perfis=perfis, profile_id=profile_id
+    )
+
+    # 📊 PARSING EM STREAMING (CSV ou Excel): lotes de tamanho fixo, memória constante
+    lotes = iter_chunks(iter_upload_rows(file, filename, estado["cabecalho"]), BULK_UPLOAD_CHUNK)
+
+    async def proximo_lote() -> List[Dict[str, Any]]:
+        try:
+            return await lotes.__anext__()
+        except StopAsyncIteration:
+            return []
+        except Exception as e:
+            raise erro_leitura_upload(e, filename)
+
+    lote = await proximo_lote()
+    if not lote:
+        raise HTTPException(
+            status_code=400,
+            detail="Arquivo sem dados válidos ou cabeçalho incorreto"
+        )
+
+    # 📊 CONTADORES E RESULTADOS
+    total_rows = 0
+    inserted = 0
+    updated = 0
+    skipped = 0
+    errors = ErrosLimitados(limite=50)  # Limitar para não sobrecarregar resposta
+
+    print(f"🚀 Iniciando bulk upload em lotes de {BULK_UPLOAD_CHUNK} linhas")
+    print(f"👤 Usuário: {current_user.nome} ({current_user.tipo})")
+    if curso_id:
+        print(f"📚 Curso ID: {curso_id}")
+    if turma_id:
+        print(f"🎯 Turma ID: {turma_id}")
+
+    while lote:
+        total_rows += len(lote)
+        resultado = await processar_lote_bulk_upload(estado, lote)
+        inserted += resultado["inserted"]
+        updated += resultado["updated"]
+        skipped += resultado["skipped"]
+        for erro in resultado["errors"]:
+            errors.append(erro)
+        lote = await proximo_lote()
+
+    # 📊 RESUMO FINAL
+    summary = {
+        "total_processed": total_rows,
+        "inserted": inserted,
+        "updated": updated,
+        "skipped": skipped,
+        "errors_count": len(errors),
+        "errors": errors.primeiros(),  # Primeiros 50 erros (por linha)
+        "success_rate": f"{((inserted + updated + skipped) / total_rows * 100):.1f}%" if total_rows else "0%"
+    }
+    
+    print(f"✅ Bulk upload concluído:")
+    print(f"   📊 Total processado: {total_rows}")
+    print(f"   ➕ Inseridos: {inserted}")
+    print(f"   🔄 Atualizados: {updated}")
+    print(f"   ⏭️ Pulados: {skipped}")
+    print(f"   ❌ Erros: {len(errors)}")
+    print(f"   📈 Taxa de sucesso: {summary['success_rate']}")
     
+    return {
+        "success": True,
+        "message": f"Upload concluído: {inserted} inseridos, {updated} atualizados, {skipped} pulados, {len(errors)} erros",
+        "summary": summary,
+        "import_profile": {"id": estado["perfil"]["id"], "nome": estado["perfil"]["nome"]} if estado["perfil"] else None
+    }
+
+IMPORT_CSV_CAMPOS = ['nome', 'cpf', 'data_nascimento', 'curso']
+
+def validar_upload_import_csv(file: UploadFile, current_user: UserResponse):
     # 🔒 MONITOR: Não pode importar alunos
     if current_user.tipo == "monitor":
         raise HTTPException(
-            status_code=403, 
+            status_code=403,
             detail="Monitores não podem importar alunos CSV"
         )
-    
+
     # Verificar se arquivo é CSV
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Arquivo deve ser CSV")
-    
-    # Ler conteúdo do arquivo
-    contents = await file.read()
-    
-    # 🔧 CORREÇÃO: Detectar encoding e separador automaticamente
+
+async def abrir_import_csv(upload) -> CsvDictStream:
+    """Lê o cabeçalho do CSV e confere os campos obrigatórios"""
+    # 🔧 Leitura em streaming: encoding detectado (UTF-8 -> Windows-1252 -> ISO-8859-1)
+    # e separador (vírgula ou ponto e vírgula) pela primeira linha
+    csv_reader = CsvDictStream(upload, encoding="auto")
     try:
-        # Tentar UTF-8 primeiro
-        csv_content = contents.decode('utf-8')
-    except UnicodeDecodeError:
-        try:
-            # Fallback para Windows-1252 (comum em arquivos Excel brasileiros)
-            csv_content = contents.decode('windows-1252')
-        except UnicodeDecodeError:
-            # Último recurso: ISO-8859-1
-            csv_content = contents.decode('iso-8859-1')
-    
-    # 🔧 CORREÇÃO: Detectar separador (vírgula ou ponto e vírgula)
-    delimiter = ',' if ',' in csv_content.split('\n')[0] else ';'
-    print(f"🔍 CSV Delimiter detectado: '{delimiter}'")
-    
-    csv_reader = csv.DictReader(StringIO(csv_content), delimiter=delimiter)
-    
+        await csv_reader.start()
+    except csv.Error as e:
+        raise HTTPException(status_code=400, detail=f"Erro ao ler CSV: {str(e)}")
+    print(f"🔍 CSV Delimiter detectado: '{csv_reader.delimiter}'")
+
     # Validar campos obrigatórios no CSV
-    required_fields = ['nome', 'cpf', 'data_nascimento', 'curso']
-    if not all(field in csv_reader.fieldnames for field in required_fields):
+    required_fields = IMPORT_CSV_CAMPOS
+    if not all(field in (csv_reader.fieldnames or []) for field in required_fields):
         raise HTTPException(
-            status_code=400, 
+            status_code=400,
             detail=f"CSV deve conter campos: {', '.join(required_fields)}"
         )
-    
-    # Processar linhas do CSV
-    results = {
-        'success': [],
-        'errors': [],
-        'duplicates': [],
-        'unauthorized': [],
-        'warnings': []  # Para alunos sem turma definida
-    }
-    
+    return csv_reader
+
+async def preparar_import_csv(
+    current_user: UserResponse,
+    primeira_linha: int = 2,
+    novo_id: Callable[[Any], str] = novo_aluno_id,
+) -> Dict[str, Any]:
+    """Cursos e turmas para validação, carregados uma vez para o arquivo inteiro"""
     # Buscar cursos e turmas para validação
     cursos = await db.cursos.find({}).to_list(1000)
     cursos_dict = {curso['nome']: curso for curso in cursos}
-    
+
     # Buscar turmas do usuário para validação de permissões
     turmas = await db.turmas.find({}).to_list(1000)
     turmas_dict = {}
     for turma in turmas:
         key = f"{turma.get('curso_id', '')}_{turma['nome']}"
         turmas_dict[key] = turma
-    
-    for row_num, row in enumerate(csv_reader, start=2):  # Linha 2+ (header = linha 1)
+
+    return {
+        "current_user": current_user,
+        "cursos_dict": cursos_dict,
+        "turmas_dict": turmas_dict,
+        # CPFs já cadastrados (cpf -> id): consultados com $in a cada lote de linhas
+        "cadastrados": {},
+        "row_num": primeira_linha - 1,  # Linha 2+ (header = linha 1)
+        "novo_id": novo_id,
+    }
+
+async def processar_lote_import_csv(estado: Dict[str, Any], lote: List[Dict[str, Any]]) -> List[tuple]:
+    """Processa um lote do CSV; devolve (categoria, linha, mensagem) na ordem das linhas"""
+    current_user = estado["current_user"]
+    cursos_dict = estado["cursos_dict"]
+    turmas_dict = estado["turmas_dict"]
+    cadastrados: Dict[str, Optional[str]] = estado["cadastrados"]
+    eventos: List[tuple] = []
+
+    def registrar(categoria: str, mensagem: str):
+        eventos.append((categoria, row_num, mensagem))
+
+    cpfs_lote = [(row.get('cpf') or '').strip().lstrip('\ufeff').lstrip('�').strip() for row in lote]
+    async for aluno in db.alunos.find({"cpf": {"$in": [cpf for cpf in cpfs_lote if cpf]}}, {"_id": 0, "cpf": 1, "id": 1}):
+        cadastrados.setdefault(aluno["cpf"], aluno.get("id"))
+
+    for row in lote:
+        estado["row_num"] += 1
+        row_num = estado["row_num"]
         try:
             # 🔧 LIMPEZA: Remover caracteres especiais (BOM, �, etc)
             nome_limpo = row['nome'].strip().lstrip('\ufeff').lstrip('�').strip()
             cpf_limpo = row['cpf'].strip().lstrip('\ufeff').lstrip('�').strip()
             data_nascimento_limpa = row['data_nascimento'].strip().lstrip('\ufeff').lstrip('�').strip()
             curso_limpo = row['curso'].strip().lstrip('\ufeff').lstrip('�').strip()
-            
+        
             print(f"🔍 Processando linha {row_num}:")
             print(f"   Nome: '{nome_limpo}'")
             print(f"   CPF: '{cpf_limpo}'")
             print(f"   Data: '{data_nascimento_limpa}'")
             print(f"   Curso: '{curso_limpo}'")
-            
+        
             # Validar campos obrigatórios
             if not nome_limpo or not cpf_limpo or not data_nascimento_limpa:
-                results['errors'].append(f"Linha {row_num}: Campos obrigatórios em branco")
+                registrar('errors', f"Linha {row_num}: Campos obrigatórios em branco")
                 continue
-            
+        
             # 🔧 CORREÇÃO: Converter data de dd/mm/yyyy para yyyy-mm-dd
             try:
                 if '/' in data_nascimento_limpa:
@@ -2077,52 +2286,53 @@ async def import_students_csv(
                     # Já está em formato ISO
                     data_nascimento_iso = data_nascimento_limpa
             except ValueError:
-                results['errors'].append(f"Linha {row_num}: Data de nascimento inválida: {data_nascimento_limpa}")
+                registrar('errors', f"Linha {row_num}: Data de nascimento inválida: {data_nascimento_limpa}")
                 continue
-            
+        
             # Validar se curso existe
             if curso_limpo not in cursos_dict:
                 # 💡 MELHORIA: Sugerir cursos disponíveis
                 cursos_disponiveis = list(cursos_dict.keys())[:5]  # Máximo 5 sugestões
                 sugestoes = ", ".join(f"'{c}'" for c in cursos_disponiveis)
-                results['errors'].append(
+                registrar('errors', 
                     f"Linha {row_num}: Curso '{curso_limpo}' não encontrado. " +
                     f"Cursos disponíveis: {sugestoes}{'...' if len(cursos_dict) > 5 else ''}"
                 )
                 continue
-            
+        
             curso = cursos_dict[curso_limpo]
-            
+        
             # 🔒 VALIDAÇÃO POR TIPO DE USUÁRIO
             if current_user.tipo == "instrutor":
                 # Instrutor: só aceita seu curso
                 if curso['id'] != getattr(current_user, 'curso_id', None):
-                    results['unauthorized'].append(
+                    registrar('unauthorized', 
                         f"Linha {row_num}: Instrutor não pode importar alunos para curso '{curso['nome']}'"
                     )
                     continue
-                    
+                
             elif current_user.tipo == "pedagogo":
                 # Pedagogo: só aceita cursos da sua unidade
                 if curso.get('unidade_id') != getattr(current_user, 'unidade_id', None):
-                    results['unauthorized'].append(
+                    registrar('unauthorized', 
                         f"Linha {row_num}: Pedagogo não pode importar alunos para curso fora da sua unidade"
                     )
                     continue
-            
+        
             # Admin: aceita qualquer curso (sem restrições)
-            
-            # Verificar duplicado (CPF já existe)
-            existing_aluno = await db.alunos.find_one({"cpf": cpf_limpo})
-            if existing_aluno:
-                results['duplicates'].append(f"Linha {row_num}: CPF {cpf_limpo} já cadastrado")
+        
+            # Verificar duplicado (CPF já existe no banco ou já importado neste arquivo);
+            # em job retomado, o aluno que esta mesma linha gravou antes da queda não conta
+            aluno_id = estado["novo_id"](row_num)
+            if cpf_limpo in cadastrados and cadastrados[cpf_limpo] != aluno_id:
+                registrar('duplicates', f"Linha {row_num}: CPF {cpf_limpo} já cadastrado")
                 continue
-            
+        
             # 🎯 LÓGICA DE TURMA
             turma_nome = row.get('turma', '').strip()
             turma_id = None
             status_turma = "nao_alocado"  # Default para alunos sem turma
-            
+        
             if turma_nome:
                 # Buscar turma específica do curso
                 turma_key = f"{curso['id']}_{turma_nome}"
@@ -2144,17 +2354,18 @@ async def import_students_csv(
                             'created_at': datetime.now(timezone.utc).isoformat()
                         }
                         await db.turmas.insert_one(nova_turma)
+                        scope_resolver.invalidate()
                         turma_id = nova_turma['id']
                         status_turma = "alocado"
-                        results['warnings'].append(f"Linha {row_num}: Turma '{turma_nome}' criada automaticamente")
+                        registrar('warnings', f"Linha {row_num}: Turma '{turma_nome}' criada automaticamente")
                     else:
-                        results['warnings'].append(f"Linha {row_num}: Turma '{turma_nome}' não existe - aluno será marcado como 'não alocado'")
+                        registrar('warnings', f"Linha {row_num}: Turma '{turma_nome}' não existe - aluno será marcado como 'não alocado'")
             else:
-                results['warnings'].append(f"Linha {row_num}: Sem turma definida - aluno será marcado como 'não alocado'")
-            
+                registrar('warnings', f"Linha {row_num}: Sem turma definida - aluno será marcado como 'não alocado'")
+        
             # Criar aluno com dados limpos
             aluno_data = {
-                'id': str(uuid.uuid4()),
+                'id': aluno_id,
                 'nome': nome_limpo,
                 'cpf': cpf_limpo,
                 'data_nascimento': data_nascimento_iso,
@@ -2170,26 +2381,64 @@ async def import_students_csv(
                 'created_by_type': current_user.tipo,  # Tipo do usuário que importou
                 'created_at': datetime.now(timezone.utc).isoformat()
             }
-            
+        
             print(f"🔍 CSV Import - Criando aluno: {nome_limpo}")
             print(f"   created_by: {aluno_data['created_by']}")
             print(f"   created_by_name: {aluno_data['created_by_name']}")
-            
+        
             # Inserir aluno no banco
-            await db.alunos.insert_one(aluno_data)
-            
+            if cpf_limpo in cadastrados:
+                await db.alunos.replace_one({"id": aluno_id}, aluno_data, upsert=True)
+            else:
+                await db.alunos.insert_one(aluno_data)
+            cadastrados[cpf_limpo] = aluno_id
+        
             # Se turma existe, adicionar aluno à lista de alunos da turma
             if turma_id:
                 await db.turmas.update_one(
                     {"id": turma_id},
                     {"$addToSet": {"alunos_ids": aluno_data['id']}}
                 )
-            
-            results['success'].append(f"Linha {row_num}: {nome_limpo} cadastrado com sucesso")
-            
+                scope_resolver.invalidate()
+        
+            registrar('success', f"Linha {row_num}: {nome_limpo} cadastrado com sucesso")
+        
         except Exception as e:
-            results['errors'].append(f"Linha {row_num}: Erro interno - {str(e)}")
-    
+            registrar('errors', f"Linha {row_num}: Erro interno - {str(e)}")
+
+    return eventos
+
+@api_router.post("/students/import-csv")
+async def import_students_csv(
+    file: UploadFile = File(...),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """📑 IMPORTAÇÃO CSV - LÓGICA REFINADA 29/09/2025
+
+    CSV deve conter: nome,cpf,data_nascimento,curso,turma,email,telefone
+
+    👨‍🏫 Instrutor: Só aceita curso/unidade dele
+    📊 Pedagogo: Só aceita cursos da unidade dele
+    👩‍💻 Monitor: NÃO pode importar
+    👑 Admin: Aceita qualquer curso/unidade
+    """
+    validar_upload_import_csv(file, current_user)
+    csv_reader = await abrir_import_csv(file)
+
+    # Processar linhas do CSV
+    results = {
+        'success': [],
+        'errors': [],
+        'duplicates': [],
+        'unauthorized': [],
+        'warnings': []  # Para alunos sem turma definida
+    }
+
+    estado = await preparar_import_csv(current_user)
+    async for lote in iter_chunks(csv_reader, BULK_UPLOAD_CHUNK):
+        for categoria, _, mensagem in await processar_lote_import_csv(estado, lote):
+            results[categoria].append(mensagem)
+
     return {
         "message": f"Importação concluída: {len(results['success'])} sucessos, {len(results['errors']) + len(results['duplicates']) + len(results['unauthorized'])} falhas",
         "details": results,
@@ -2203,6 +2452,169 @@ async def import_students_csv(
         }
     }
 
+# 📦 IMPORTAÇÃO EM SEGUNDO PLANO (jobs com checkpoint no Mongo, ver import_jobs.py)
+import_jobs = ImportJobRunner(db)
+
+async def usuario_do_job(job: Dict[str, Any]) -> UserResponse:
+    """Dono do job recarregado do banco: permissões valem também na retomada"""
+    user = await db.usuarios.find_one({"id": job["user_id"]}, {"_id": 0, "senha": 0})
+    if user is None or not user.get("ativo", True):
+        raise HTTPException(status_code=403, detail="Usuário do job não encontrado ou inativo")
+    return UserResponse(**user)
+
+async def _preparar_job_bulk_upload(job: Dict[str, Any]) -> Dict[str, Any]:
+    params = job["params"]
+    return await preparar_bulk_upload(
+        await usuario_do_job(job),
+        params.get("turma_id"),
+        params.get("curso_id"),
+        params.get("update_existing", False),
+        novo_id=lambda line: id_deterministico(job["id"], line),
+        perfis=await carregar_perfis_importacao(params.get("profile_id")),
+        profile_id=params.get("profile_id"),
+    )
+
+async def _linhas_job_bulk_upload(arquivo, job: Dict[str, Any], estado: Optional[Dict[str, Any]] = None):
+    filename = job["filename"].lower()
+    cabecalho = estado["cabecalho"] if estado else None
+
+    async def linhas():
+        try:
+            async for row in iter_upload_rows(arquivo, filename, cabecalho):
+                yield row
+        except Exception as e:
+            raise erro_leitura_upload(e, filename)
+
+    return linhas()
+
+async def _lote_job_bulk_upload(estado: Dict[str, Any], lote: List[Dict[str, Any]]):
+    resultado = await processar_lote_bulk_upload(estado, lote)
+    erros = resultado.pop("errors")
+    return resultado, erros
+
+async def _preparar_job_import_csv(job: Dict[str, Any]) -> Dict[str, Any]:
+    return await preparar_import_csv(
+        await usuario_do_job(job),
+        primeira_linha=2 + job["processed_rows"],
+        novo_id=lambda line: id_deterministico(job["id"], line),
+    )
+
+async def _linhas_job_import_csv(arquivo, job: Dict[str, Any], estado: Optional[Dict[str, Any]] = None):
+    return await abrir_import_csv(arquivo)
+
+async def _lote_job_import_csv(estado: Dict[str, Any], lote: List[Dict[str, Any]]):
+    contadores = {"successful": 0, "errors": 0, "duplicates": 0, "unauthorized": 0, "warnings": 0}
+    erros = []
+    for categoria, linha, mensagem in await processar_lote_import_csv(estado, lote):
+        contadores["successful" if categoria == "success" else categoria] += 1
+        if categoria != "success":
+            erros.append({"line": linha, "categoria": categoria, "error": mensagem})
+    return contadores, erros
+
+import_jobs.registrar("bulk-upload", TipoImportacao(_preparar_job_bulk_upload, _linhas_job_bulk_upload, _lote_job_bulk_upload))
+import_jobs.registrar("import-csv", TipoImportacao(_preparar_job_import_csv, _linhas_job_import_csv, _lote_job_import_csv))
+
+def _check_import_job_access(job: Optional[Dict[str, Any]], current_user: UserResponse):
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["user_id"] != current_user.id and current_user.tipo != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+
+@api_router.post("/students/import-jobs")
+async def create_import_job(
+    file: UploadFile = File(...),
+    tipo: str = Query("bulk-upload", description="bulk-upload (CSV/Excel) ou import-csv (CSV com curso/turma)"),
+    turma_id: Optional[str] = Query(None, description="ID da turma para associar alunos (bulk-upload)"),
+    curso_id: Optional[str] = Query(None, description="ID do curso (bulk-upload, opcional para instrutor)"),
+    update_existing: bool = Query(False, description="Se true, atualiza aluno existente por CPF (bulk-upload)"),
+    profile_id: Optional[str] = Query(None, description="Perfil de colunas (bulk-upload)"),
+    current_user: UserResponse = Depends(get_current_user),
+):
+    """📦 Importação em segundo plano: responde na hora com job_id, sem timeout de proxy
+
+    Mesmas regras de /students/bulk-upload e /students/import-csv. Acompanhe com
+    GET /students/import-jobs/{job_id} e veja os erros em .../errors.
+    """
+    if tipo == "bulk-upload":
+        curso_id = await validar_upload_bulk(file, curso_id, current_user)
+        await carregar_perfis_importacao(profile_id)  # 404 agora, não no worker
+        params = {"turma_id": turma_id, "curso_id": curso_id, "update_existing": update_existing, "profile_id": profile_id}
+    elif tipo == "import-csv":
+        validar_upload_import_csv(file, current_user)
+        params = {}
+    else:
+        raise HTTPException(status_code=400, detail="Tipo de importação deve ser 'bulk-upload' ou 'import-csv'")
+
+    job = await import_jobs.criar(tipo, file, file.filename, current_user.id, params)
+    return {"job_id": job["id"], "status": job["status"], "message": "Importação iniciada"}
+
+@api_router.get("/students/import-jobs/{job_id}")
+async def get_import_job(job_id: str, current_user: UserResponse = Depends(get_current_user)):
+    """Status, progresso (%), linhas processadas e contadores do job"""
+    job = await import_jobs.obter(job_id)
+    _check_import_job_access(job, current_user)
+    return job
+
+@api_router.get("/students/import-jobs/{job_id}/errors")
+async def get_import_job_errors(
+    job_id: str,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: UserResponse = Depends(get_current_user),
+):
+    """Erros do job por ordem de linha, paginados"""
+    job = await db.import_jobs.find_one({"id": job_id}, {"_id": 0, "user_id": 1})
+    _check_import_job_access(job, current_user)
+    return await import_jobs.listar_erros(job_id, skip, limit)
+
+# 🗺️ PERFIS DE IMPORTAÇÃO (colunas por parceiro/modelo de planilha)
+def _check_import_profile_access(perfil: Optional[Dict[str, Any]], current_user: UserResponse):
+    if perfil is None:
+        raise HTTPException(status_code=404, detail="Perfil de importação não encontrado")
+    if current_user.tipo != "admin" and perfil.get("created_by") != current_user.id:
+        raise HTTPException(status_code=403, detail="Apenas o autor ou um administrador pode alterar este perfil")
+
+@api_router.get("/import-profiles", response_model=List[ImportProfile])
+async def get_import_profiles(current_user: UserResponse = Depends(get_current_user)):
+    """Perfis ativos, do mais recente para o mais antigo (ordem usada na detecção)"""
+    return await carregar_perfis_importacao()
+
+@api_router.post("/import-profiles", response_model=ImportProfile)
+async def create_import_profile(profile_create: ImportProfileCreate, current_user: UserResponse = Depends(get_current_user)):
+    if current_user.tipo == "monitor":
+        raise HTTPException(status_code=403, detail="Monitores não podem criar perfis de importação")
+    
+    erro = validar_mapeamento(profile_create.mapeamento)
+    if erro:
+        raise HTTPException(status_code=400, detail=erro)
+    
+    profile_obj = ImportProfile(**profile_create.dict(), created_by=current_user.id)
+    await db.import_profiles.insert_one(profile_obj.dict())
+    return profile_obj
+
+@api_router.put("/import-profiles/{profile_id}", response_model=ImportProfile)
+async def update_import_profile(profile_id: str, profile_update: ImportProfileUpdate, current_user: UserResponse = Depends(get_current_user)):
+    perfil = await db.import_profiles.find_one({"id": profile_id, "ativo": True}, {"_id": 0})
+    _check_import_profile_access(perfil, current_user)
+    
+    update_data = {k: v for k, v in profile_update.dict().items() if v is not None}
+    if "mapeamento" in update_data:
+        erro = validar_mapeamento(update_data["mapeamento"])
+        if erro:
+            raise HTTPException(status_code=400, detail=erro)
+    update_data["updated_at"] = datetime.now(timezone.utc)
+    
+    await db.import_profiles.update_one({"id": profile_id}, {"$set": update_data})
+    return ImportProfile(**{**perfil, **update_data})
+
+@api_router.delete("/import-profiles/{profile_id}")
+async def delete_import_profile(profile_id: str, current_user: UserResponse = Depends(get_current_user)):
+    perfil = await db.import_profiles.find_one({"id": profile_id, "ativo": True}, {"_id": 0})
+    _check_import_profile_access(perfil, current_user)
+    
+    await db.import_profiles.update_one({"id": profile_id}, {"$set": {"ativo": False, "updated_at": datetime.now(timezone.utc)}})
+    return {"message": "Perfil de importação desativado com sucesso"}
+
 # TURMAS ROUTES
 @api_router.post("/classes", response_model=Turma)
 async def create_turma(turma_create: TurmaCreate, current_user: UserResponse = Depends(get_current_user)):
@@ -2273,6 +2685,7 @@ async def create_turma(turma_create: TurmaCreate, current_user: UserResponse = D
     
     mongo_data = prepare_for_mongo(turma_obj.dict())
     await db.turmas.insert_one(mongo_data)
+    scope_resolver.invalidate()
     return turma_obj
 
 @api_router.get("/classes", response_model=List[Turma])
@@ -2386,6 +2799,7 @@ async def add_aluno_to_turma(turma_id: str, aluno_id: str, current_user: UserRes
             "$inc": {"vagas_ocupadas": 1}
         }
     )
+    scope_resolver.invalidate()
     
     return {"message": "Aluno adicionado à turma"}
 
@@ -2400,6 +2814,7 @@ async def remove_aluno_from_turma(turma_id: str, aluno_id: str, current_user: Us
             "$inc": {"vagas_ocupadas": -1}
         }
     )
+    scope_resolver.invalidate()
     
     return {"message": "Aluno removido da turma"}
 
@@ -2431,9 +2846,12 @@ async def delete_turma(turma_id: str, current_user: UserResponse = Depends(get_c
     if chamadas_count > 0:
         print(f"🗑️ Deletando {chamadas_count} chamada(s) relacionada(s)")
         await db.attendances.delete_many({"turma_id": turma_id})
+        await remove_turma_rollups(db, turma_id)
+        attendance_matrices.invalidate(turma_id)
     
     # 🗑️ DELETAR TURMA
     result = await db.turmas.delete_one({"id": turma_id})
+    scope_resolver.invalidate()
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=500, detail="Erro ao deletar turma")
@@ -2523,6 +2941,7 @@ async def update_turma(turma_id: str, turma_update: TurmaUpdate, current_user: U
         {"id": turma_id},
         {"$set": update_data}
     )
+    scope_resolver.invalidate()
     
     if result.modified_count == 0:
         # Verificar se realmente não houve mudanças ou se foi erro
@@ -2619,6 +3038,7 @@ async def create_chamada(chamada_create: ChamadaCreate, current_user: UserRespon
     mongo_data = prepare_for_mongo(chamada_obj.dict())
     # 🎯 CORREÇÃO CRÍTICA: Usar collection 'attendances' (não 'chamadas')
     await db.attendances.insert_one(mongo_data)
+    await update_attendance_rollups(mongo_data)
     
     return chamada_obj
 
@@ -2687,23 +3107,9 @@ async def upload_atestado(
     
     # Para não-admin: verificar permissões do aluno
     if current_user.tipo != "admin":
-        tem_permissao = False
-        
-        if current_user.tipo == "instrutor":
-            # Instrutor: só pode anexar atestado de alunos das suas turmas
-            turmas_instrutor = await db.turmas.find({
-                "instrutor_id": current_user.id,
-                "alunos_ids": aluno_id
-            }).to_list(10)
-            tem_permissao = len(turmas_instrutor) > 0
-            
-        elif current_user.tipo == "pedagogo":
-            # Pedagogo: só pode anexar atestado de alunos da sua unidade
-            turmas_unidade = await db.turmas.find({
-                "unidade_id": getattr(current_user, 'unidade_id', None),
-                "alunos_ids": aluno_id
-            }).to_list(10)
-            tem_permissao = len(turmas_unidade) > 0
+        # Instrutor: alunos das suas turmas / Pedagogo: alunos da sua unidade
+        scope = await scope_resolver.resolve(current_user, "atestados")
+        tem_permissao = scope.allows_aluno(aluno_id)
         
         if not tem_permissao:
             raise HTTPException(
@@ -2770,21 +3176,9 @@ async def listar_atestados_aluno(
     
     # Para não-admin: verificar permissões
     if current_user.tipo != "admin":
-        tem_permissao = False
-        
-        if current_user.tipo == "instrutor":
-            turmas_instrutor = await db.turmas.find({
-                "instrutor_id": current_user.id,
-                "alunos_ids": aluno_id
-            }).to_list(10)
-            tem_permissao = len(turmas_instrutor) > 0
-            
-        elif current_user.tipo == "pedagogo":
-            turmas_unidade = await db.turmas.find({
-                "unidade_id": getattr(current_user, 'unidade_id', None),
-                "alunos_ids": aluno_id
-            }).to_list(10)
-            tem_permissao = len(turmas_unidade) > 0
+        # Instrutor: alunos das suas turmas / Pedagogo: alunos da sua unidade
+        scope = await scope_resolver.resolve(current_user, "atestados")
+        tem_permissao = scope.allows_aluno(aluno_id)
         
         if not tem_permissao:
             raise HTTPException(status_code=403, detail="Sem permissão para visualizar atestados deste aluno")
@@ -2816,22 +3210,11 @@ async def download_atestado(
         raise HTTPException(status_code=403, detail="Permissão negada")
     
     if current_user.tipo != "admin":
-        tem_permissao = False
         aluno_id = atestado["aluno_id"]
         
-        if current_user.tipo == "instrutor":
-            turmas_instrutor = await db.turmas.find({
-                "instrutor_id": current_user.id,
-                "alunos_ids": aluno_id
-            }).to_list(10)
-            tem_permissao = len(turmas_instrutor) > 0
-            
-        elif current_user.tipo == "pedagogo":
-            turmas_unidade = await db.turmas.find({
-                "unidade_id": getattr(current_user, 'unidade_id', None),
-                "alunos_ids": aluno_id
-            }).to_list(10)
-            tem_permissao = len(turmas_unidade) > 0
+        # Instrutor: alunos das suas turmas / Pedagogo: alunos da sua unidade
+        scope = await scope_resolver.resolve(current_user, "atestados")
+        tem_permissao = scope.allows_aluno(aluno_id)
         
         if not tem_permissao:
             raise HTTPException(status_code=403, detail="Sem permissão para baixar este atestado")
@@ -2981,6 +3364,7 @@ async def create_desistente(desistente_create: DesistenteCreate, current_user: U
         {"alunos_ids": desistente_create.aluno_id},
         {"$pull": {"alunos_ids": desistente_create.aluno_id}}
     )
+    scope_resolver.invalidate()
     
     return desistente_obj
 
@@ -3298,59 +3682,111 @@ async def get_reason_codes():
 # 🔥 JOB STORAGE SYSTEM - ANTI-TIMEOUT DEFINITIVO
 import uuid
 import asyncio
-from fastapi import BackgroundTasks
 
-# In-memory job storage (use Redis/DB in production)
-csv_jobs = {}
+# Jobs em `report_jobs` (TTL) e arquivos no GridFS "reports": visíveis a todos os workers
+report_jobs = ReportJobStore(db)
+
+
+async def executar_job_relatorio(job: dict, current_user: UserResponse):
+    """Executado pelos workers do pool com os parâmetros gravados no job"""
+    params = job["params"]
+    await generate_csv_background(
+        job["id"],
+        params.get("turma_id"),
+        params.get("unidade_id"),
+        params.get("curso_id"),
+        date.fromisoformat(params["data_inicio"]) if params.get("data_inicio") else None,
+        date.fromisoformat(params["data_fim"]) if params.get("data_fim") else None,
+        CSVFormat(params.get("format", CSVFormat.simple.value)),
+        current_user,
+    )
 
-@api_router.post("/reports/csv-job")
-async def create_csv_job(
-    background_tasks: BackgroundTasks,
-    turma_id: Optional[str] = None,
-    unidade_id: Optional[str] = None,
-    curso_id: Optional[str] = None,
-    data_inicio: Optional[date] = None,
-    data_fim: Optional[date] = None,
-    format: CSVFormat = CSVFormat.simple,
-    current_user: UserResponse = Depends(get_current_user)
-):
-    """🚀 Create CSV generation job - NO MORE TIMEOUTS!"""
-    job_id = str(uuid.uuid4())
-    
-    # Store job with status
-    csv_jobs[job_id] = {
-        "status": "processing",
-        "created_at": datetime.now(),
-        "user_id": current_user.id,
-        "format": format,
-        "progress": 0,
-        "total_records": 0,
-        "csv_url": None,
-        "error": None
-    }
-    
-    # Start background job
-    background_tasks.add_task(
-        generate_csv_background,
-        job_id, turma_id, unidade_id, curso_id, data_inicio, data_fim, format, current_user
+
+# 🏭 Fila limitada + workers dedicados: exportações não competem com as chamadas
+report_pool = ReportWorkerPool(report_jobs, executar_job_relatorio)
+
+
+def resposta_job_relatorio(job: dict) -> dict:
+    """Job como o frontend espera: csv_url aponta para o download quando concluído"""
+    resposta = {chave: valor for chave, valor in job.items() if chave not in ("file_id", "owner")}
+    resposta["csv_url"] = (
+        f"/api/reports/csv-job/{job['id']}/download" if job["status"] == "completed" else None
     )
-    
-    return {"job_id": job_id, "status": "processing", "message": "CSV generation started"}
+    return resposta
 
-@api_router.get("/reports/csv-job/{job_id}")
-async def get_csv_job_status(job_id: str, current_user: UserResponse = Depends(get_current_user)):
-    """Check CSV job status"""
-    if job_id not in csv_jobs:
+
+async def obter_job_relatorio(job_id: str, current_user: UserResponse) -> dict:
+    job = await report_jobs.obter(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
-    
-    job = csv_jobs[job_id]
-    
+
     # Security: only user who created job can access
     if job["user_id"] != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
-    
     return job
 
+
+@api_router.post("/reports/csv-job")
+async def create_csv_job(
+    turma_id: Optional[str] = None,
+    unidade_id: Optional[str] = None,
+    curso_id: Optional[str] = None,
+    data_inicio: Optional[date] = None,
+    data_fim: Optional[date] = None,
+    format: CSVFormat = CSVFormat.simple,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """🚀 Create CSV generation job - NO MORE TIMEOUTS!"""
+    params = {
+        "turma_id": turma_id,
+        "unidade_id": unidade_id,
+        "curso_id": curso_id,
+        "data_inicio": data_inicio.isoformat() if data_inicio else None,
+        "data_fim": data_fim.isoformat() if data_fim else None,
+        "format": format.value,
+    }
+    try:
+        job = await report_pool.enviar(current_user.id, params, current_user)
+    except LimiteRelatorios as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    
+    return {"job_id": job["id"], "status": job["status"], "message": "CSV generation queued"}
+
+@api_router.get("/reports/csv-job/{job_id}")
+async def get_csv_job_status(job_id: str, current_user: UserResponse = Depends(get_current_user)):
+    """Check CSV job status"""
+    job = await obter_job_relatorio(job_id, current_user)
+    return resposta_job_relatorio(job)
+
+@api_router.delete("/reports/csv-job/{job_id}")
+async def cancel_csv_job(job_id: str, current_user: UserResponse = Depends(get_current_user)):
+    """🛑 Cancela um job na fila ou em andamento"""
+    job = await obter_job_relatorio(job_id, current_user)
+    if not await report_pool.cancelar(job_id):
+        raise HTTPException(status_code=409, detail=f"Job já finalizado (status: {job['status']})")
+    return {"job_id": job_id, "status": "cancelled"}
+
+@api_router.get("/reports/csv-job/{job_id}/download")
+async def download_csv_job(job_id: str, current_user: UserResponse = Depends(get_current_user)):
+    """📥 Download do CSV gerado, lido do GridFS bloco a bloco"""
+    job = await obter_job_relatorio(job_id, current_user)
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Job ainda não concluído (status: {job['status']})")
+
+    try:
+        grid_out = await report_jobs.abrir_arquivo(job)
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=f"Arquivo do relatório indisponível: {str(e)}")
+
+    headers = {"Content-Disposition": f'attachment; filename="{job["filename"]}"'}
+    if job.get("size") is not None:
+        headers["Content-Length"] = str(job["size"])
+    return StreamingResponse(
+        report_jobs.blocos_arquivo(grid_out),
+        media_type="text/csv; charset=utf-8",
+        headers=headers,
+    )
+
 # LEGACY ENDPOINT (kept for compatibility)
 @api_router.get("/reports/attendance")
 async def get_attendance_report(
@@ -3361,67 +3797,23 @@ async def get_attendance_report(
     data_fim: Optional[date] = None,
     export_csv: bool = False,
     format: CSVFormat = CSVFormat.simple,
+    batch_size: int = Query(REPORT_BATCH_SIZE, ge=1, le=5000),
+    max_rows: Optional[int] = Query(None, ge=1),
     current_user: UserResponse = Depends(get_current_user)
 ):
-    """⚠️ DEPRECATED: Use POST /reports/csv-job instead for large exports"""
-    if export_csv:
-        # For small exports, redirect to job system for reliability
-        raise HTTPException(
-            status_code=410, 
-            detail="Use POST /reports/csv-job for CSV exports to avoid timeouts"
-        )
-    
-    # Non-CSV response (JSON) - kept working
+    """📊 Relatório de chamadas lido por cursor (JSON ou CSV em streaming).
+    Sem limite por padrão; `max_rows` aplica um limite explícito, sinalizado em
+    header (X-Row-Limit) e, no CSV, em uma linha final de aviso."""
     query = {}
     
     # 🔒 FILTROS DE PERMISSÃO POR TIPO DE USUÁRIO
-    if current_user.tipo == "instrutor":
-        # ✅ Instrutor só pode ver suas turmas REGULARES
-        turmas_instrutor = await db.turmas.find({
-            "instrutor_id": current_user.id,
-            "tipo_turma": "regular"
-        }).to_list(1000)
-        turmas_ids = [turma["id"] for turma in turmas_instrutor]
-        
-        if turmas_ids:
-            query["turma_id"] = {"$in": turmas_ids}
-        else:
-            # Se não tem turmas, retorna vazio
-            return []
-            
-    elif current_user.tipo == "pedagogo":
-        # ✅ Pedagogo só vê turmas de EXTENSÃO do seu curso/unidade
-        turmas_query = {"tipo_turma": "extensao"}
-        if getattr(current_user, 'curso_id', None):
-            turmas_query["curso_id"] = getattr(current_user, 'curso_id', None)
-        if getattr(current_user, 'unidade_id', None):
-            turmas_query["unidade_id"] = getattr(current_user, 'unidade_id', None)
-            
-        turmas_permitidas = await db.turmas.find(turmas_query).to_list(1000)
-        turmas_ids = [turma["id"] for turma in turmas_permitidas]
-        
-        if turmas_ids:
-            query["turma_id"] = {"$in": turmas_ids}
-        else:
-            # Se não tem turmas permitidas, retorna vazio
-            return [] if not export_csv else {"csv_data": ""}
-    
-    elif current_user.tipo == "monitor":
-        # Monitor pode ver qualquer tipo de turma do seu curso/unidade
-        turmas_query = {}
-        if getattr(current_user, 'curso_id', None):
-            turmas_query["curso_id"] = getattr(current_user, 'curso_id', None)
-        if getattr(current_user, 'unidade_id', None):
-            turmas_query["unidade_id"] = getattr(current_user, 'unidade_id', None)
-            
-        turmas_permitidas = await db.turmas.find(turmas_query).to_list(1000)
-        turmas_ids = [turma["id"] for turma in turmas_permitidas]
-        
-        if turmas_ids:
-            query["turma_id"] = {"$in": turmas_ids}
-        else:
+    # Instrutor: turmas REGULARES / Pedagogo: EXTENSÃO do curso/unidade / Monitor: curso/unidade
+    scope = await scope_resolver.resolve(current_user, "relatorios")
+    if not scope.unrestricted:
+        if not scope.turma_ids:
             # Se não tem turmas permitidas, retorna vazio
             return [] if not export_csv else {"csv_data": ""}
+        query["turma_id"] = scope.turma_filter()
     
     # Filtro por turma específica (aplicado após filtros de permissão)
     if turma_id:
@@ -3462,25 +3854,35 @@ async def get_attendance_report(
         query["data"] = {"$lte": data_fim.isoformat()}
     
     # 🎯 CORREÇÃO CRÍTICA: Usar collection 'attendances' (não 'chamadas')
-    chamadas = await db.attendances.find(query).to_list(1000)
+    # 🚀 Cursor em streaming: documentos chegam em lotes de `batch_size`, memória constante
+    chamadas = db.attendances.find(query).batch_size(batch_size)
+    headers = {}
+    if max_rows is not None:
+        headers["X-Row-Limit"] = str(max_rows)
     
     if export_csv:
         # 🚨 ANTI-TIMEOUT: Use StreamingResponse para evitar 504 Gateway Timeout
         if format == CSVFormat.complete:
             filename = f"relatorio_completo_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            return StreamingResponse(
-                generate_complete_csv_stream(chamadas),
-                media_type="text/csv",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
+            generator = generate_complete_csv_stream(chamadas, max_rows=max_rows)
         else:  # CSVFormat.simple
             filename = f"relatorio_simples_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            return StreamingResponse(
-                generate_simple_csv_stream(chamadas),
-                media_type="text/csv",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
-    return [parse_from_mongo(chamada) for chamada in chamadas]
+            generator = generate_simple_csv_stream(chamadas, max_rows=max_rows)
+        headers["Content-Disposition"] = f"attachment; filename={filename}"
+        return StreamingResponse(generator, media_type="text/csv", headers=headers)
+    
+    # JSON: limite explícito vem com o total real para o cliente saber que foi truncado
+    if max_rows is not None:
+        total = await db.attendances.count_documents(query)
+        chamadas = chamadas.limit(max_rows)
+        headers["X-Total-Count"] = str(total)
+        headers["X-Truncated"] = "true" if total > max_rows else "false"
+    
+    return StreamingResponse(
+        stream_json_array(chamadas, parse_from_mongo),
+        media_type="application/json",
+        headers=headers
+    )
 
 
 # � STREAMING CSV FUNCTIONS - ANTI-TIMEOUT PROTECTION
@@ -3489,30 +3891,29 @@ async def generate_csv_background(
     curso_id: Optional[str], data_inicio: Optional[date], data_fim: Optional[date],
     format: CSVFormat, current_user: UserResponse
 ):
-    """🔥 Background CSV generation - BULLETPROOF AGAINST TIMEOUTS"""
+    """🔥 Background CSV generation - BULLETPROOF AGAINST TIMEOUTS
+    O CSV vai direto para o GridFS em blocos; o job guarda só status e progresso"""
+    job = await report_jobs.obter(job_id)
+    if job is None:
+        return
+    filename = f"relatorio_chamadas_{job_id[:8]}.csv"
+    saida = None
     try:
-        import base64
-        
         # Update job status
-        csv_jobs[job_id]["status"] = "processing"
-        csv_jobs[job_id]["progress"] = 10
+        await report_jobs.atualizar(job_id, progress=10)
+        saida = report_jobs.abrir_saida(job, filename)
         
         # Build query with same permissions as original endpoint
         query = {}
         
-        # Apply user permissions (simplified for brevity)
-        if current_user.tipo == "instrutor":
-            turmas_instrutor = await db.turmas.find({
-                "instrutor_id": current_user.id,
-                "tipo_turma": "regular"
-            }).to_list(1000)
-            turmas_ids = [turma["id"] for turma in turmas_instrutor]
-            if turmas_ids:
-                query["turma_id"] = {"$in": turmas_ids}
-            else:
-                csv_jobs[job_id]["status"] = "completed"
-                csv_jobs[job_id]["csv_url"] = "data:text/csv;base64," + base64.b64encode("No data".encode()).decode()
+        # Apply user permissions (mesmo escopo de /reports/attendance)
+        scope = await scope_resolver.resolve(current_user, "relatorios")
+        if not scope.unrestricted:
+            if not scope.turma_ids:
+                await saida.escrever_texto("No data")
+                await report_jobs.concluir(job_id, saida, filename)
                 return
+            query["turma_id"] = scope.turma_filter()
         
         # Apply filters
         if turma_id and current_user.tipo == "admin":
@@ -3520,74 +3921,87 @@ async def generate_csv_background(
         if data_inicio and data_fim:
             query["data"] = {"$gte": data_inicio.isoformat(), "$lte": data_fim.isoformat()}
         
-        # Fetch data
-        csv_jobs[job_id]["progress"] = 30
-        chamadas = await db.attendances.find(query).to_list(None)
-        csv_jobs[job_id]["total_records"] = len(chamadas)
-        csv_jobs[job_id]["progress"] = 50
-        
-        # Generate CSV in memory (safe since background)
-        output = StringIO()
-        writer = csv.writer(output)
+        # Fetch data (cursor: as chamadas não ficam todas em memória)
+        total_records = await db.attendances.count_documents(query)
+        await report_jobs.atualizar(job_id, progress=50, total_records=total_records)
         
         # Simple CSV generation (optimized)
-        writer.writerow(["Aluno", "CPF", "Matricula", "Turma", "Data", "Status"])
+        await saida.escrever(["Aluno", "CPF", "Matricula", "Turma", "Data", "Status"])
         
+        # Chamadas em lotes: turmas e alunos de cada lote vêm em uma consulta $in cada
         processed = 0
-        for chamada in chamadas:
-            try:
-                turma = await db.turmas.find_one({"id": chamada.get("turma_id")})
-                if not turma:
-                    continue
-                
-                records = chamada.get("records", [])
-                for record in records:
-                    aluno_id = record.get("aluno_id")
-                    if not aluno_id:
-                        continue
-                    
-                    aluno = await db.alunos.find_one({"id": aluno_id})
-                    if not aluno:
-                        continue
-                    
-                    writer.writerow([
-                        aluno.get("nome", ""),
-                        aluno.get("cpf", ""),
-                        aluno.get("matricula", aluno.get("id", "")),
-                        turma.get("nome", ""),
-                        chamada.get("data", ""),
-                        "Presente" if record.get("presente", False) else "Ausente"
-                    ])
-                    processed += 1
-                    
-                    # Update progress
-                    if processed % 100 == 0:
-                        progress = 50 + int((processed / (csv_jobs[job_id]["total_records"] * 5)) * 40)
-                        csv_jobs[job_id]["progress"] = min(90, progress)
-                        
-            except Exception as e:
-                print(f"Error processing record: {e}")
-                continue
-        
-        # Convert to base64 data URL
-        csv_content = output.getvalue()
-        csv_base64 = base64.b64encode(csv_content.encode('utf-8')).decode('utf-8')
+        turmas_cache = {}
+        lote = []
+        async for chamada in db.attendances.find(query):
+            lote.append(chamada)
+            if len(lote) >= CSV_JOB_LOTE_CHAMADAS:
+                processed = await escrever_lote_csv_job(saida, lote, turmas_cache, processed)
+                lote = []
+                progress = 50 + int((processed / (total_records * 5)) * 40)
+                await report_jobs.atualizar(job_id, progress=min(90, progress))
+        if lote:
+            processed = await escrever_lote_csv_job(saida, lote, turmas_cache, processed)
         
         # Update job with result
-        csv_jobs[job_id]["status"] = "completed"
-        csv_jobs[job_id]["progress"] = 100
-        csv_jobs[job_id]["csv_url"] = f"data:text/csv;charset=utf-8;base64,{csv_base64}"
-        csv_jobs[job_id]["completed_at"] = datetime.now()
+        await report_jobs.concluir(job_id, saida, filename)
         
+    except asyncio.CancelledError:
+        # DELETE /reports/csv-job/{id} ou desligamento: o status já foi gravado por quem cancelou
+        await report_jobs.descartar(job_id, saida)
+        raise
     except Exception as e:
         print(f"❌ Job {job_id} failed: {e}")
-        csv_jobs[job_id]["status"] = "failed"
-        csv_jobs[job_id]["error"] = str(e)
-        csv_jobs[job_id]["progress"] = 0
+        await report_jobs.falhar(job_id, str(e), saida)
+
+
+CSV_JOB_LOTE_CHAMADAS = 200
+
 
+async def escrever_lote_csv_job(saida, chamadas: List[dict], turmas_cache: Dict[str, Any], processed: int) -> int:
+    """Escreve as linhas de um lote de chamadas (mesma ordem e regras do laço por registro)"""
+    faltando = {c.get("turma_id") for c in chamadas} - set(turmas_cache)
+    if faltando:
+        for turma_id in faltando:
+            turmas_cache[turma_id] = None
+        async for turma in db.turmas.find({"id": {"$in": list(faltando)}}, {"_id": 0, "id": 1, "nome": 1}):
+            turmas_cache[turma["id"]] = turma
 
-async def generate_simple_csv_stream(chamadas):
-    """Generate simple CSV format with STREAMING - NO MORE 504 TIMEOUTS!"""
+    aluno_ids = {
+        record.get("aluno_id")
+        for chamada in chamadas
+        for record in chamada.get("records", [])
+        if record.get("aluno_id")
+    }
+    alunos = {}
+    if aluno_ids:
+        async for aluno in db.alunos.find(
+            {"id": {"$in": list(aluno_ids)}}, {"_id": 0, "id": 1, "nome": 1, "cpf": 1, "matricula": 1}
+        ):
+            alunos.setdefault(aluno["id"], aluno)
+
+    for chamada in chamadas:
+        turma = turmas_cache.get(chamada.get("turma_id"))
+        if not turma:
+            continue
+        for record in chamada.get("records", []):
+            aluno = alunos.get(record.get("aluno_id"))
+            if not aluno:
+                continue
+            await saida.escrever([
+                aluno.get("nome", ""),
+                aluno.get("cpf", ""),
+                aluno.get("matricula", aluno.get("id", "")),
+                turma.get("nome", ""),
+                chamada.get("data", ""),
+                "Presente" if record.get("presente", False) else "Ausente"
+            ])
+            processed += 1
+    return processed
+
+
+async def generate_simple_csv_stream(chamadas, max_rows: Optional[int] = None):
+    """Generate simple CSV format with STREAMING - NO MORE 504 TIMEOUTS!
+    `chamadas` pode ser uma lista ou um cursor assíncrono; `max_rows` limita as linhas (com aviso no final)"""
     import io
     
     # Initialize buffer
@@ -3606,115 +4020,148 @@ async def generate_simple_csv_stream(chamadas):
     
     # Stream data row by row to prevent memory buildup
     processed = 0
-    MAX_SAFE_RECORDS = 10000  # Higher limit since we're streaming
+    truncated = False
+    
+    # 🚀 Caches do join em memória (uma consulta $in por coleção e por lote)
+    turmas_cache, cursos_cache, unidades_cache, usuarios_cache, alunos_cache = {}, {}, {}, {}, {}
+    aluno_projection = {"_id": 0, "id": 1, "nome": 1, "cpf": 1, "matricula": 1}
     
     # Process data with STREAMING (sends data as it processes)
-    for chamada in chamadas:
-        # Safety limit (but much higher since streaming)
-        if processed >= MAX_SAFE_RECORDS:
-            print(f"⚠️ CSV LIMIT REACHED: {MAX_SAFE_RECORDS} records processed")
+    async for lote in iter_chunks(chamadas, CSV_PREFETCH_CHUNK):
+        if truncated:
             break
-            
+        
         try:
-            # Buscar dados da turma
-            turma = await db.turmas.find_one({"id": chamada.get("turma_id")})
-            if not turma:
-                continue
-            
-            # Buscar dados do curso
-            curso = await db.cursos.find_one({"id": turma.get("curso_id")}) if turma.get("curso_id") else None
-            
-            # Buscar dados da unidade
-            unidade = await db.unidades.find_one({"id": turma.get("unidade_id")}) if turma.get("unidade_id") else None
-            
-            # Buscar dados do responsável
-            responsavel = await db.usuarios.find_one({"id": turma.get("instrutor_id")}) if turma.get("instrutor_id") else None
-            
-            # Dados da chamada
-            data_chamada = chamada.get("data", "")
-            observacoes_gerais = chamada.get("observacoes", "")
-            
-            # Horários da turma
-            hora_inicio = turma.get("horario_inicio", "08:00")
-            hora_fim = turma.get("horario_fim", "12:00")
-            
-            # Records de presença
-            records = chamada.get("records", [])
-            
-            # Para cada aluno na chamada
-            for record in records:
-                try:
-                    aluno_id = record.get("aluno_id")
-                    if not aluno_id:
-                        continue
-                    
-                    # Buscar dados do aluno
-                    aluno = await db.alunos.find_one({"id": aluno_id})
-                    if not aluno:
-                        continue
-                    
-                    # Status
-                    presente = record.get("presente", False)
-                    justificativa = record.get("justificativa", "")
-                    hora_registro = record.get("hora_registro", "")
-                    
-                    status = "Presente" if presente else "Ausente"
-                    
-                    # Observações
-                    obs_final = []
-                    if justificativa:
-                        obs_final.append(justificativa)
-                    if observacoes_gerais:
-                        obs_final.append(f"Obs. turma: {observacoes_gerais}")
-                    observacoes_texto = "; ".join(obs_final)
-                    
-                    # Tipo de turma e responsável
-                    tipo_turma = turma.get("tipo_turma", "regular")
-                    tipo_turma_label = "Extensão" if tipo_turma == "extensao" else "Regular"
-                    
-                    tipo_responsavel = responsavel.get("tipo", "instrutor") if responsavel else "instrutor"
-                    tipo_responsavel_label = "Pedagogo" if tipo_responsavel == "pedagogo" else "Instrutor"
-                    
-                    # Write row to buffer and stream immediately
-                    writer.writerow([
-                        aluno.get("nome", ""),
-                        aluno.get("cpf", ""),
-                        aluno.get("matricula", aluno.get("id", "")),
-                        turma.get("nome", ""),
-                        tipo_turma_label,
-                        curso.get("nome", "") if curso else "",
-                        data_chamada,
-                        hora_inicio,
-                        hora_fim,
-                        status,
-                        hora_registro,
-                        responsavel.get("nome", "") if responsavel else "",
-                        tipo_responsavel_label,
-                        unidade.get("nome", "") if unidade else "",
-                        observacoes_texto
-                    ])
-                    
-                    # 🚨 STREAM THE ROW IMMEDIATELY (prevents timeout!)
-                    yield buffer.getvalue()
-                    buffer.seek(0)
-                    buffer.truncate(0)
-                    
-                    processed += 1  # 📊 Count processed records
-                    
-                except Exception as e:
-                    print(f"Erro ao processar record: {e}")
-                    continue
-                    
+            await prefetch_by_ids(db.turmas, [c.get("turma_id") for c in lote], turmas_cache)
+            turmas_lote = [t for t in (turmas_cache.get(c.get("turma_id")) for c in lote) if t]
+            await prefetch_by_ids(db.cursos, [t.get("curso_id") for t in turmas_lote], cursos_cache)
+            await prefetch_by_ids(db.unidades, [t.get("unidade_id") for t in turmas_lote], unidades_cache)
+            await prefetch_by_ids(db.usuarios, [t.get("instrutor_id") for t in turmas_lote], usuarios_cache)
+            await prefetch_by_ids(
+                db.alunos,
+                [r.get("aluno_id") for c in lote for r in c.get("records", [])],
+                alunos_cache,
+                aluno_projection
+            )
         except Exception as e:
-            print(f"Erro ao processar chamada {chamada.get('id', 'unknown')}: {e}")
+            print(f"Erro ao pré-carregar lote de chamadas: {e}")
             continue
+        
+        for chamada in lote:
+            if truncated:
+                break
+                
+            try:
+                # Dados da turma
+                turma = turmas_cache.get(chamada.get("turma_id"))
+                if not turma:
+                    continue
+                
+                # Dados do curso, unidade e responsável
+                curso = cursos_cache.get(turma.get("curso_id")) if turma.get("curso_id") else None
+                unidade = unidades_cache.get(turma.get("unidade_id")) if turma.get("unidade_id") else None
+                responsavel = usuarios_cache.get(turma.get("instrutor_id")) if turma.get("instrutor_id") else None
+                
+                # Dados da chamada
+                data_chamada = chamada.get("data", "")
+                observacoes_gerais = chamada.get("observacoes", "")
+                
+                # Horários da turma
+                hora_inicio = turma.get("horario_inicio", "08:00")
+                hora_fim = turma.get("horario_fim", "12:00")
+                
+                # Records de presença
+                records = chamada.get("records", [])
+                
+                # Para cada aluno na chamada
+                for record in records:
+                    # Limite explícito pedido pelo cliente
+                    if max_rows is not None and processed >= max_rows:
+                        truncated = True
+                        break
+                    
+                    try:
+                        aluno_id = record.get("aluno_id")
+                        if not aluno_id:
+                            continue
+                        
+                        # Dados do aluno
+                        aluno = alunos_cache.get(aluno_id)
+                        if not aluno:
+                            continue
+                        
+                        # Status
+                        presente = record.get("presente", False)
+                        justificativa = record.get("justificativa", "")
+                        hora_registro = record.get("hora_registro", "")
+                        
+                        status = "Presente" if presente else "Ausente"
+                        
+                        # Observações
+                        obs_final = []
+                        if justificativa:
+                            obs_final.append(justificativa)
+                        if observacoes_gerais:
+                            obs_final.append(f"Obs. turma: {observacoes_gerais}")
+                        observacoes_texto = "; ".join(obs_final)
+                        
+                        # Tipo de turma e responsável
+                        tipo_turma = turma.get("tipo_turma", "regular")
+                        tipo_turma_label = "Extensão" if tipo_turma == "extensao" else "Regular"
+                        
+                        tipo_responsavel = responsavel.get("tipo", "instrutor") if responsavel else "instrutor"
+                        tipo_responsavel_label = "Pedagogo" if tipo_responsavel == "pedagogo" else "Instrutor"
+                        
+                        # Write row to buffer and stream immediately
+                        writer.writerow([
+                            aluno.get("nome", ""),
+                            aluno.get("cpf", ""),
+                            aluno.get("matricula", aluno.get("id", "")),
+                            turma.get("nome", ""),
+                            tipo_turma_label,
+                            curso.get("nome", "") if curso else "",
+                            data_chamada,
+                            hora_inicio,
+                            hora_fim,
+                            status,
+                            hora_registro,
+                            responsavel.get("nome", "") if responsavel else "",
+                            tipo_responsavel_label,
+                            unidade.get("nome", "") if unidade else "",
+                            observacoes_texto
+                        ])
+                        
+                        # 🚨 STREAM THE ROW IMMEDIATELY (prevents timeout!)
+                        yield buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate(0)
+                        
+                        processed += 1  # 📊 Count processed records
+                        
+                    except Exception as e:
+                        print(f"Erro ao processar record: {e}")
+                        continue
+                        
+            except Exception as e:
+                print(f"Erro ao processar chamada {chamada.get('id', 'unknown')}: {e}")
+                continue
+    
+    # ⚠️ Trailer explícito quando o limite foi aplicado
+    if truncated:
+        print(f"⚠️ CSV LIMIT REACHED: {max_rows} records processed")
+        writer.writerow([f"# AVISO: relatório truncado em {max_rows} linhas (max_rows)"])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
     
     # Final stream completion
     print(f"✅ CSV Simples concluído: {processed} registros processados")
 
 
-async def generate_complete_csv_stream(chamadas):
-    """Generate complete CSV format with STREAMING - NO MORE TIMEOUTS!"""
+async def generate_complete_csv_stream(chamadas, max_rows: Optional[int] = None):
+    """Generate complete CSV format with STREAMING - NO MORE TIMEOUTS!
+    Uma única passada pelo cursor, em qualquer ordem: as marcações ficam em arrays
+    compactos (JanelaFrequencia) e as métricas por data são calculadas no fim"""
     import io
     
     # Initialize buffer
@@ -3736,114 +4183,100 @@ async def generate_complete_csv_stream(chamadas):
     buffer.truncate(0)
     
     # Calculate student statistics
-    student_stats = {}
-    MAX_SAFE_RECORDS_COMPLETE = 5000  # Conservative limit for complex processing
-
-
-
+    # Marcações acumuladas em arrays; as métricas por data saem no fim, em uma passada vetorizada
+    janela = JanelaFrequencia(dias_janela=30, ultimas_aulas=5)
+    # aluno_id -> {turma_id: ordem da primeira aparição} (define a turma exibida na linha)
+    student_turmas = {}
+    ordem = 0
     
     # Process all records to build statistics (STREAM-SAFE)
-    for chamada in chamadas:
-        records = chamada.get("records", [])
-        data_chamada = chamada.get("data", "")
-        
-        for record in records:
-            aluno_id = record.get("aluno_id")
-            if not aluno_id:
-                continue
-                
-            if aluno_id not in student_stats:
-                student_stats[aluno_id] = {
-                    "total_chamadas": 0,
-                    "presencas": 0,
-                    "faltas": 0,
-                    "ultima_chamada": "",
-                    "faltas_consecutivas": 0,
-                    "presencas_recentes": []
-                }
-            
-            student_stats[aluno_id]["total_chamadas"] += 1
-            student_stats[aluno_id]["ultima_chamada"] = data_chamada
-            
-            if record.get("presente", False):
-                student_stats[aluno_id]["presencas"] += 1
-                student_stats[aluno_id]["faltas_consecutivas"] = 0
-            else:
-                student_stats[aluno_id]["faltas"] += 1
-                student_stats[aluno_id]["faltas_consecutivas"] += 1
+    async for lote in iter_chunks(chamadas, CSV_PREFETCH_CHUNK):
+        janela.adicionar(lote)
+        for chamada in lote:
+            turma_chamada = chamada.get("turma_id")
+            for aluno_id, _ in iter_attendance_marks(chamada):
+                turmas_aluno = student_turmas.setdefault(aluno_id, {})
+                if turma_chamada not in turmas_aluno:
+                    turmas_aluno[turma_chamada] = ordem
+                ordem += 1
+    student_stats = janela.calcular()
+    
+    # 🚀 Join em memória: turmas e entidades relacionadas em poucas consultas $in
+    turmas_cache, cursos_cache, unidades_cache, usuarios_cache, pedagogos_cache = {}, {}, {}, {}, {}
+    turma_ids = {t for turmas_aluno in student_turmas.values() for t in turmas_aluno}
+    await prefetch_by_ids(db.turmas, turma_ids, turmas_cache)
+    turmas_validas = [t for t in turmas_cache.values() if t]
+    await prefetch_by_ids(db.cursos, [t.get("curso_id") for t in turmas_validas], cursos_cache)
+    await prefetch_by_ids(db.unidades, [t.get("unidade_id") for t in turmas_validas], unidades_cache)
+    await prefetch_by_ids(db.usuarios, [t.get("instrutor_id") for t in turmas_validas], usuarios_cache)
+    for unidade_turma in {t.get("unidade_id") for t in turmas_validas if t.get("unidade_id")}:
+        # Buscar pedagogo (assumindo que está na coleção usuarios com tipo pedagogo)
+        pedagogos_cache[unidade_turma] = await db.usuarios.find_one({
+            "tipo": "pedagogo",
+            "unidade_id": unidade_turma
+        })
+    
+    # Cada aluno aparece uma vez, na primeira turma existente em que foi registrado
+    linhas = []
+    for aluno_id, turmas_aluno in student_turmas.items():
+        validas = [(pos, t_id) for t_id, pos in turmas_aluno.items() if turmas_cache.get(t_id)]
+        if validas:
+            pos, t_id = min(validas)
+            linhas.append((pos, t_id, aluno_id))
+    linhas.sort()
+    student_turmas.clear()
     
     # Generate rows for unique students (STREAM EACH ROW)
-    processed_students = set()
     processed = 0
-    
-    for chamada in chamadas:
-        try:
-            # Buscar dados da turma
-            turma = await db.turmas.find_one({"id": chamada.get("turma_id")})
-            if not turma:
-                continue
-            
-            # Buscar dados do curso
-            curso = await db.cursos.find_one({"id": turma.get("curso_id")}) if turma.get("curso_id") else None
-            
-            # Buscar dados da unidade
-            unidade = await db.unidades.find_one({"id": turma.get("unidade_id")}) if turma.get("unidade_id") else None
-            
-            # Buscar responsáveis
-            instrutor = await db.usuarios.find_one({"id": turma.get("instrutor_id")}) if turma.get("instrutor_id") else None
-            
-            # Buscar pedagogo (assumindo que está na coleção usuarios com tipo pedagogo)
-            pedagogo = await db.usuarios.find_one({
-                "tipo": "pedagogo", 
-                "unidade_id": turma.get("unidade_id")
-            }) if turma.get("unidade_id") else None
-            
-            # 🚨 TIMEOUT PROTECTION
-            if processed >= MAX_SAFE_RECORDS_COMPLETE:
-                print(f"⚠️ CSV Completo LIMIT REACHED: {MAX_SAFE_RECORDS_COMPLETE} records")
+    truncated = False
+    alunos_cache = {}
+    
+    for start in range(0, len(linhas), CSV_PREFETCH_CHUNK):
+        lote = linhas[start:start + CSV_PREFETCH_CHUNK]
+        alunos_cache.clear()
+        await prefetch_by_ids(db.alunos, [aluno_id for _, _, aluno_id in lote], alunos_cache)
+        
+        for _, turma_id, aluno_id in lote:
+            # Limite explícito pedido pelo cliente
+            if max_rows is not None and processed >= max_rows:
+                truncated = True
                 break
+            
+            try:
+                turma = turmas_cache[turma_id]
+                curso = cursos_cache.get(turma.get("curso_id")) if turma.get("curso_id") else None
+                unidade = unidades_cache.get(turma.get("unidade_id")) if turma.get("unidade_id") else None
+                instrutor = usuarios_cache.get(turma.get("instrutor_id")) if turma.get("instrutor_id") else None
+                pedagogo = pedagogos_cache.get(turma.get("unidade_id")) if turma.get("unidade_id") else None
                 
-            # Process each student only once
-            records = chamada.get("records", [])
-            for record in records:
-                aluno_id = record.get("aluno_id")
-                if not aluno_id or aluno_id in processed_students:
-                    continue
-                
-                processed_students.add(aluno_id)
-                
-                # Buscar dados completos do aluno
-                aluno = await db.alunos.find_one({"id": aluno_id})
+                # Dados completos do aluno
+                aluno = alunos_cache.get(aluno_id)
                 if not aluno:
                     continue
                 
-                stats = student_stats.get(aluno_id, {})
+                stats = student_stats[aluno_id]
                 
                 # Calculate percentages
-                total = stats.get("total_chamadas", 0)
-                presencas = stats.get("presencas", 0)
-                faltas = stats.get("faltas", 0)
+                total = stats.total_chamadas
+                presencas = stats.presencas
+                faltas = stats.faltas
                 
                 perc_total = f"{(presencas/total*100):.1f}%" if total > 0 else "0%"
-                perc_30_dias = perc_total  # Simplified for now
+                perc_janela = stats.percentual_janela()
+                perc_30_dias = f"{perc_janela:.1f}%" if perc_janela is not None else "N/A"
                 
                 # Classification logic
                 perc_num = (presencas/total*100) if total > 0 else 0
-                if perc_num >= 80:
-                    risco = "Baixo"
-                elif perc_num >= 60:
-                    risco = "Médio"
-                else:
-                    risco = "Alto"
+                risco = classificar(perc_num, FAIXAS_CSV_COMPLETO, FAIXA_CSV_COMPLETO_PADRAO)
                 
                 # Generate enhanced observations
                 observacoes = []
-                faltas_consecutivas = stats.get("faltas_consecutivas", 0)
-                if faltas_consecutivas >= 3:
+                faltas_consecutivas = stats.faltas_consecutivas
+                if faltas_consecutivas >= FALTAS_CONSECUTIVAS_ALERTA:
                     observacoes.append(f"Aluno com {faltas_consecutivas} faltas consecutivas – risco {risco.lower()}")
                 elif perc_num == 100:
                     observacoes.append("Excelente frequência e desempenho")
-                elif perc_num < 70:
+                elif perc_num < LIMITE_BAIXA_FREQUENCIA:
                     observacoes.append("Aluno com baixa frequência e risco alto de evasão")
                 
                 # Write complete row to buffer
@@ -3867,9 +4300,9 @@ async def generate_complete_csv_stream(chamadas):
                     faltas,     # Faltas
                     perc_total, # % Presença (Total)
                     perc_30_dias,  # % Presença (Últimos 30 Dias)
-                    stats.get("ultima_chamada", ""),  # Última Chamada Registrada
+                    stats.ultima_chamada,  # Última Chamada Registrada
                     faltas_consecutivas,  # Dias Consecutivos de Falta
-                    min(presencas, 5),    # Presenças Recentes (simplified)
+                    stats.presencas_recentes,  # Presenças Recentes (Últimas 5 aulas)
                     risco,      # Classificação de Risco
                     aluno.get("status", "Ativo"),  # Status do Aluno
                     aluno.get("motivo_desistencia", ""),  # Motivo de Desistência
@@ -3885,9 +4318,20 @@ async def generate_complete_csv_stream(chamadas):
                 
                 processed += 1
                 
-        except Exception as e:
-            print(f"Erro ao processar dados completos: {e}")
-            continue
+            except Exception as e:
+                print(f"Erro ao processar dados completos: {e}")
+                continue
+        
+        if truncated:
+            break
+    
+    # ⚠️ Trailer explícito quando o limite foi aplicado
+    if truncated:
+        print(f"⚠️ CSV Completo LIMIT REACHED: {max_rows} records")
+        writer.writerow([f"# AVISO: relatório truncado em {max_rows} linhas (max_rows)"])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
     
     # Final stream completion
     print(f"✅ CSV Completo concluído: {processed} registros processados")
@@ -3918,54 +4362,22 @@ async def get_student_frequency_report(
     data_inicio: Optional[date] = None,
     data_fim: Optional[date] = None,
     export_csv: bool = False,
+    batch_size: int = Query(REPORT_BATCH_SIZE, ge=1, le=5000),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
     current_user: UserResponse = Depends(get_current_user)
 ):
-    """Gerar relatório de frequência por aluno com estatísticas completas"""
+    """Gerar relatório de frequência por aluno com estatísticas completas
+    (CSV em streaming com export_csv=true; senão JSON paginado por skip/limit)"""
     
     # 🔒 Aplicar filtros de permissão por tipo de usuário (mesmo código do endpoint anterior)
     query = {}
     
-    if current_user.tipo == "instrutor":
-        turmas_instrutor = await db.turmas.find({
-            "instrutor_id": current_user.id,
-            "tipo_turma": "regular"
-        }).to_list(1000)
-        turmas_ids = [turma["id"] for turma in turmas_instrutor]
-        
-        if turmas_ids:
-            query["turma_id"] = {"$in": turmas_ids}
-        else:
-            return [] if not export_csv else {"csv_data": ""}
-            
-    elif current_user.tipo == "pedagogo":
-        turmas_query = {"tipo_turma": "extensao"}
-        if getattr(current_user, 'curso_id', None):
-            turmas_query["curso_id"] = getattr(current_user, 'curso_id', None)
-        if getattr(current_user, 'unidade_id', None):
-            turmas_query["unidade_id"] = getattr(current_user, 'unidade_id', None)
-            
-        turmas_permitidas = await db.turmas.find(turmas_query).to_list(1000)
-        turmas_ids = [turma["id"] for turma in turmas_permitidas]
-        
-        if turmas_ids:
-            query["turma_id"] = {"$in": turmas_ids}
-        else:
-            return [] if not export_csv else {"csv_data": ""}
-    
-    elif current_user.tipo == "monitor":
-        turmas_query = {}
-        if getattr(current_user, 'curso_id', None):
-            turmas_query["curso_id"] = getattr(current_user, 'curso_id', None)
-        if getattr(current_user, 'unidade_id', None):
-            turmas_query["unidade_id"] = getattr(current_user, 'unidade_id', None)
-            
-        turmas_permitidas = await db.turmas.find(turmas_query).to_list(1000)
-        turmas_ids = [turma["id"] for turma in turmas_permitidas]
-        
-        if turmas_ids:
-            query["turma_id"] = {"$in": turmas_ids}
-        else:
-            return [] if not export_csv else {"csv_data": ""}
+    scope = await scope_resolver.resolve(current_user, "relatorios")
+    if not scope.unrestricted:
+        if not scope.turma_ids:
+            return relatorio_frequencia_vazio(export_csv, skip, limit)
+        query["turma_id"] = scope.turma_filter()
 
     # Filtros administrativos (para admin)
     if current_user.tipo == "admin":
@@ -3982,7 +4394,7 @@ async def get_student_frequency_report(
             if turmas_ids:
                 query["turma_id"] = {"$in": turmas_ids}
             else:
-                return [] if not export_csv else {"csv_data": ""}
+                return relatorio_frequencia_vazio(export_csv, skip, limit)
 
     # Filtro por turma específica
     if turma_id:
@@ -4002,224 +4414,121 @@ async def get_student_frequency_report(
     elif data_fim:
         query["data"] = {"$lte": data_fim.isoformat()}
 
-    # Buscar todas as attendances
-    attendances = await db.attendances.find(query).to_list(1000)
-    
+    # 📊 Frequência, percentual e risco calculados no pipeline (frequency_report.py)
+    por_resumos = not data_inicio and not data_fim
     if export_csv:
-        # 📊 CALCULAR ESTATÍSTICAS POR ALUNO
-        aluno_stats = {}
-        
-        # Processar cada attendance
-        for attendance in attendances:
-            turma_id = attendance.get("turma_id")
-            records = attendance.get("records", [])
-            
-            for record in records:
-                aluno_id = record.get("aluno_id")
-                presente = record.get("presente", False)
-                
-                if aluno_id not in aluno_stats:
-                    aluno_stats[aluno_id] = {
-                        "total_chamadas": 0,
-                        "total_presencas": 0,
-                        "total_faltas": 0,
-                        "turma_id": turma_id  # Para buscar dados da turma depois
-                    }
-                
-                aluno_stats[aluno_id]["total_chamadas"] += 1
-                if presente:
-                    aluno_stats[aluno_id]["total_presencas"] += 1
-                else:
-                    aluno_stats[aluno_id]["total_faltas"] += 1
-        
-        # Gerar CSV
-        output = StringIO()
-        writer = csv.writer(output)
-        
-        # Cabeçalhos conforme a imagem
-        writer.writerow([
-            "Nome do Aluno", "CPF", "Total de Chamadas", "Presencas", "Faltas", 
-            "% Presença (Preciso)", "Classificação de Risco", "Status do Aluno", 
-            "Data de Nascimento", "Email"
-        ])
-        
-        # Processar cada aluno
-        for aluno_id, stats in aluno_stats.items():
-            try:
-                # Buscar dados do aluno
-                aluno = await db.alunos.find_one({"id": aluno_id})
-                if not aluno:
-                    continue
-                
-                # Calcular percentual preciso
-                total_chamadas = stats["total_chamadas"]
-                total_presencas = stats["total_presencas"]
-                percentual = round((total_presencas / total_chamadas * 100), 2) if total_chamadas > 0 else 0.0
-                
-                # Classificação de risco
-                if percentual >= 75:
-                    risco = "Situação Normal"
-                elif percentual >= 50:
-                    risco = "Atenção"
-                else:
-                    risco = "Situação Crítica"
-                
-                # Formatar data de nascimento
-                data_nasc = aluno.get("data_nascimento")
-                if data_nasc:
-                    if isinstance(data_nasc, str):
-                        data_nasc_str = data_nasc
-                    else:
-                        data_nasc_str = data_nasc.strftime("%d/%m/%Y") if hasattr(data_nasc, 'strftime') else str(data_nasc)
-                else:
-                    data_nasc_str = "N/A"
-                
-                # Escrever linha
-                writer.writerow([
-                    aluno.get("nome", ""),
-                    aluno.get("cpf", ""),
-                    stats["total_chamadas"],
-                    stats["total_presencas"],
-                    stats["total_faltas"],
-                    f"{percentual:.2f}%",
-                    risco,
-                    aluno.get("status", "ativo").title(),
-                    data_nasc_str,
-                    aluno.get("email", "N/A")
-                ])
-                
-            except Exception as e:
-                print(f"Erro ao processar aluno {aluno_id}: {e}")
-                continue
-        
-        output.seek(0)
-        return {"csv_data": output.getvalue()}
-    
-    # Se não for export_csv, retorna dados estruturados
-    return {"message": "Use export_csv=true para baixar CSV"}
-
-# � Função auxiliar para verificar dias de aula
-def eh_dia_de_aula(data_verificar: date, dias_aula: List[str]) -> bool:
-    """Verifica se uma data específica é dia de aula baseado na configuração do curso"""
-    dias_semana = {
-        0: "segunda",
-        1: "terca", 
-        2: "quarta",
-        3: "quinta", 
-        4: "sexta",
-        5: "sabado",
-        6: "domingo"
-    }
-    
-    dia_da_semana = data_verificar.weekday()
-    nome_dia = dias_semana.get(dia_da_semana, "")
-    
-    return nome_dia in dias_aula
+        collection, pipeline = frequency_pipeline(query, por_resumos)
+        cursor = db[collection].aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+        return resposta_frequencia_csv(cursor)
+    
+    # JSON: as mesmas linhas, paginadas
+    collection, pipeline = frequency_pipeline(query, por_resumos, skip=skip, limit=limit)
+    resultado = await db[collection].aggregate(pipeline, allowDiskUse=True).to_list(1)
+    pagina = resultado[0] if resultado else {"items": [], "total": []}
+    total = pagina["total"][0]["n"] if pagina["total"] else 0
+    return {"items": pagina["items"], "total": total, "skip": skip, "limit": limit}
+
+
+def resposta_frequencia_csv(linhas):
+    filename = f"frequencia_alunos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return StreamingResponse(
+        stream_student_frequency_csv(linhas),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
+async def sem_linhas():
+    """Escopo vazio: o CSV sai só com o cabeçalho"""
+    for linha in ():
+        yield linha
+
+
+def relatorio_frequencia_vazio(export_csv: bool, skip: int, limit: int):
+    """Mesmo formato da resposta com dados (CSV em streaming ou JSON paginado)"""
+    if export_csv:
+        return resposta_frequencia_csv(sem_linhas())
+    return {"items": [], "total": 0, "skip": skip, "limit": limit}
+
+
+async def stream_student_frequency_csv(cursor):
+    """Linhas do pipeline direto para o CSV, um bloco por lote do cursor"""
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FREQUENCY_CSV_HEADER)
+    async for linha in cursor:
+        writer.writerow(frequency_csv_row(linha))
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
 
 # �🚨 SISTEMA DE NOTIFICAÇÕES - Chamadas Pendentes (Personalizado por Curso)
 @api_router.get("/notifications/pending-calls")
-async def get_pending_calls(current_user: UserResponse = Depends(get_current_user)):
-    """Verificar chamadas não realizadas baseado nos dias de aula do curso"""
+async def get_pending_calls(
+    dias: int = Query(PENDING_LOOKBACK_DAYS, ge=1, le=PENDING_LOOKBACK_MAX),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Verificar chamadas não realizadas nos últimos `dias` dias, baseado no calendário da turma"""
     
     # Data atual
     hoje = date.today()
-    ontem = hoje - timedelta(days=1)
-    anteontem = hoje - timedelta(days=2)
+    datas = datas_recentes(hoje, dias)
     
-    # Query para turmas baseado no tipo de usuário
-    query_turmas = {"ativo": True}
+    # Turmas ativas baseado no tipo de usuário (admin vê todas)
+    scope = await scope_resolver.resolve(current_user, "chamadas")
+    turmas = list(scope.turmas)
+    chamadas_pendentes = []
     
-    if current_user.tipo == "instrutor":
-        query_turmas["instrutor_id"] = current_user.id
-    elif current_user.tipo in ["pedagogo", "monitor"]:
-        if getattr(current_user, 'curso_id', None):
-            query_turmas["curso_id"] = getattr(current_user, 'curso_id', None)
-        if getattr(current_user, 'unidade_id', None):
-            query_turmas["unidade_id"] = getattr(current_user, 'unidade_id', None)
-    # Admin vê todas as turmas
+    # 🚀 Consultas fixas para todas as turmas: cursos, instrutores, unidades e chamadas da janela
+    cursos = await buscar_por_ids(db.cursos, (t.get("curso_id") for t in turmas), {"nome": 1, "dias_aula": 1, "dias_semana": 1})
+    instrutores = await buscar_por_ids(db.usuarios, (t.get("instrutor_id") for t in turmas), {"nome": 1})
+    unidades = await buscar_por_ids(db.unidades, (t.get("unidade_id") for t in turmas), {"nome": 1})
+    realizadas = await chamadas_realizadas(db, (t["id"] for t in turmas), datas)
     
-    turmas = await db.turmas.find(query_turmas).to_list(1000)
-    chamadas_pendentes = []
+    # 📆 Dias de aula (semana da turma/curso, período e feriados) de todas as turmas de uma vez
+    calendarios = await schedule_cache.calendarios(turmas, cursos)
+    tem_aula = grade([calendarios[t["id"]] for t in turmas], datas)
     
-    for turma in turmas:
+    for posicao, turma in enumerate(turmas):
         try:
-            # 📅 Buscar dados do curso para verificar dias de aula
-            curso = await db.cursos.find_one({"id": turma.get("curso_id")})
-            dias_aula = curso.get("dias_aula", ["segunda", "terca", "quarta", "quinta"]) if curso else ["segunda", "terca", "quarta", "quinta"]
+            curso = cursos.get(turma.get("curso_id"))
+            dias_aula = calendarios[turma["id"]].dias_aula
             
-            # Buscar dados do instrutor, unidade e curso
-            instrutor = await db.usuarios.find_one({"id": turma.get("instrutor_id")}) if turma.get("instrutor_id") else None
-            unidade = await db.unidades.find_one({"id": turma.get("unidade_id")}) if turma.get("unidade_id") else None
+            instrutor = instrutores.get(turma.get("instrutor_id")) if turma.get("instrutor_id") else None
+            unidade = unidades.get(turma.get("unidade_id")) if turma.get("unidade_id") else None
             
             instrutor_nome = instrutor.get("nome", "Instrutor não encontrado") if instrutor else "Sem instrutor"
             unidade_nome = unidade.get("nome", "Unidade não encontrada") if unidade else "Sem unidade"
             curso_nome = curso.get("nome", "Curso não encontrado") if curso else "Sem curso"
             
-            # 📅 HOJE: Verificar se hoje é dia de aula e se tem chamada
-            if eh_dia_de_aula(hoje, dias_aula):
-                # 🎯 CORREÇÃO CRÍTICA: Usar collection 'attendances' (não 'chamadas')
-                chamada_hoje = await db.attendances.find_one({
-                    "turma_id": turma["id"],
-                    "data": hoje.isoformat()
-                })
+            # 📅 Hoje (alta), ontem (media) e dias anteriores (baixa)
+            for dias_atras, data_verificar in enumerate(datas):
+                if not tem_aula[posicao, dias_atras]:
+                    continue
+                if (turma["id"], data_verificar.isoformat()) in realizadas:
+                    continue
                 
-                if not chamada_hoje:
-                    chamadas_pendentes.append({
-                        "turma_id": turma["id"],
-                        "turma_nome": turma["nome"],
-                        "instrutor_id": turma.get("instrutor_id"),
-                        "instrutor_nome": instrutor_nome,
-                        "unidade_nome": unidade_nome,
-                        "curso_nome": curso_nome,
-                        "data_faltante": hoje.isoformat(),
-                        "prioridade": "alta",
-                        "motivo": f"Chamada não realizada hoje ({hoje.strftime('%d/%m/%Y')})",
-                        "dias_aula": dias_aula
-                    })
-            
-            # 📅 ONTEM: Verificar se ontem era dia de aula e se tem chamada
-            if eh_dia_de_aula(ontem, dias_aula):
-                # 🎯 CORREÇÃO CRÍTICA: Usar collection 'attendances' (não 'chamadas')
-                chamada_ontem = await db.attendances.find_one({
-                    "turma_id": turma["id"],
-                    "data": ontem.isoformat()
-                })
+                if dias_atras == 0:
+                    prioridade, motivo = "alta", f"Chamada não realizada hoje ({data_verificar.strftime('%d/%m/%Y')})"
+                elif dias_atras == 1:
+                    prioridade, motivo = "media", f"Chamada não realizada ontem ({data_verificar.strftime('%d/%m/%Y')})"
+                else:
+                    prioridade, motivo = "baixa", f"Chamada não realizada em {data_verificar.strftime('%d/%m/%Y')}"
                 
-                if not chamada_ontem:
-                    chamadas_pendentes.append({
-                        "turma_id": turma["id"],
-                        "turma_nome": turma["nome"],
-                        "instrutor_id": turma.get("instrutor_id"),
-                        "instrutor_nome": instrutor_nome,
-                        "unidade_nome": unidade_nome,
-                        "curso_nome": curso_nome,
-                        "data_faltante": ontem.isoformat(),
-                        "prioridade": "media",
-                        "motivo": f"Chamada não realizada ontem ({ontem.strftime('%d/%m/%Y')})",
-                        "dias_aula": dias_aula
-                    })
-            
-            # 📅 ANTEONTEM: Verificar se anteontem era dia de aula e se tem chamada
-            if eh_dia_de_aula(anteontem, dias_aula):
-                # 🎯 CORREÇÃO CRÍTICA: Usar collection 'attendances' (não 'chamadas')
-                chamada_anteontem = await db.attendances.find_one({
+                chamadas_pendentes.append({
                     "turma_id": turma["id"],
-                    "data": anteontem.isoformat()
+                    "turma_nome": turma["nome"],
+                    "instrutor_id": turma.get("instrutor_id"),
+                    "instrutor_nome": instrutor_nome,
+                    "unidade_nome": unidade_nome,
+                    "curso_nome": curso_nome,
+                    "data_faltante": data_verificar.isoformat(),
+                    "prioridade": prioridade,
+                    "motivo": motivo,
+                    "dias_aula": dias_aula
                 })
-                
-                if not chamada_anteontem:
-                    chamadas_pendentes.append({
-                        "turma_id": turma["id"],
-                        "turma_nome": turma["nome"],
-                        "instrutor_id": turma.get("instrutor_id"),
-                        "instrutor_nome": instrutor_nome,
-                        "unidade_nome": unidade_nome,
-                        "curso_nome": curso_nome,
-                        "data_faltante": anteontem.isoformat(),
-                        "prioridade": "baixa",
-                        "motivo": f"Chamada não realizada em {anteontem.strftime('%d/%m/%Y')}",
-                        "dias_aula": dias_aula
-                    })
                     
         except Exception as e:
             print(f"Erro ao processar turma {turma.get('id', 'unknown')}: {e}")
@@ -4236,40 +4545,39 @@ async def get_pending_calls(current_user: UserResponse = Depends(get_current_use
 async def get_dashboard_stats(current_user: UserResponse = Depends(get_current_user)):
     hoje = date.today()
     primeiro_mes = hoje.replace(day=1)
+    inicio_semana = hoje - timedelta(days=hoje.weekday())
+    periodos = {"mes": primeiro_mes.isoformat(), "semana": inicio_semana.isoformat()}
     
+    # 🧠 Payload pronto por escopo: admins compartilham, demais por usuário/curso/unidade
     if current_user.tipo == "admin":
-        # 👑 ADMIN: Visão geral completa
-        total_unidades = await db.unidades.count_documents({"ativo": True})
-        total_cursos = await db.cursos.count_documents({"ativo": True})
-        
-        # 🔧 CORREÇÃO CRÍTICA: Contar alunos únicos corretamente
-        all_alunos = await db.alunos.find({}).to_list(10000)
-        alunos_ativos = len([a for a in all_alunos if a.get("status") == "ativo"])
-        alunos_desistentes = len([a for a in all_alunos if a.get("status") == "desistente"])
+        chave = ("admin", hoje.isoformat())
+    else:
+        chave = (current_user.tipo, current_user.id, getattr(current_user, 'unidade_id', None),
+                 getattr(current_user, 'curso_id', None), hoje.isoformat())
+    stats = dashboard_cache.get(chave)
+    if stats is not None:
+        return stats
+    
+    if current_user.tipo == "admin":
+        # 👑 ADMIN: Visão geral completa, todas as contagens em paralelo
+        total_unidades, total_cursos, total_turmas, status_alunos, chamadas_hoje, rollup = await asyncio.gather(
+            db.unidades.count_documents({"ativo": True}),
+            db.cursos.count_documents({"ativo": True}),
+            db.turmas.count_documents({"ativo": True}),
+            contar_status_alunos(db),
+            db.attendances.count_documents({"data": hoje.isoformat()}),
+            somar_rollup_periodos(db, periodos),
+        )
+        alunos_ativos = status_alunos["ativo"]
+        alunos_desistentes = status_alunos["desistente"]
         total_alunos = alunos_ativos + alunos_desistentes
         
-        total_turmas = await db.turmas.count_documents({"ativo": True})
-        
         print(f"🔧 DASHBOARD ADMIN: {total_alunos} alunos únicos ({alunos_ativos} ativos + {alunos_desistentes} desistentes)")
         
-        # 🎯 CORRIGIR: Usar collection 'attendances' (não 'chamadas')
-        chamadas_hoje = await db.attendances.count_documents({"data": hoje.isoformat()})
-        
-        # Stats mensais
-        chamadas_mes = await db.attendances.find({"data": {"$gte": primeiro_mes.isoformat()}}).to_list(1000)
-        
-        # 🎯 CORRIGIR: Calcular presenças e faltas a partir dos records
-        total_presencas_mes = 0
-        total_faltas_mes = 0
+        total_presencas_mes, total_faltas_mes = rollup["mes"]
+        presencas_semana, faltas_semana = rollup["semana"]
         
-        for chamada in chamadas_mes:
-            records = chamada.get("records", [])
-            presentes = len([r for r in records if r.get("presente", False)])
-            ausentes = len(records) - presentes
-            total_presencas_mes += presentes
-            total_faltas_mes += ausentes
-        
-        return {
+        stats = {
             "total_unidades": total_unidades,
             "total_cursos": total_cursos,
             "total_alunos": total_alunos,
@@ -4279,92 +4587,37 @@ async def get_dashboard_stats(current_user: UserResponse = Depends(get_current_u
             "chamadas_hoje": chamadas_hoje,
             "presencas_mes": total_presencas_mes,
             "faltas_mes": total_faltas_mes,
-            "taxa_presenca_mes": round((total_presencas_mes / (total_presencas_mes + total_faltas_mes) * 100) if (total_presencas_mes + total_faltas_mes) > 0 else 0, 1)
+            "taxa_presenca_mes": taxa_presenca(total_presencas_mes, total_faltas_mes),
+            "taxa_presenca_semana": taxa_presenca(presencas_semana, faltas_semana)
         }
     
     elif current_user.tipo == "instrutor":
         # 👨‍🏫 INSTRUTOR: Apenas suas turmas para estatísticas de chamada
-        minhas_turmas = await db.turmas.find({"instrutor_id": current_user.id, "ativo": True}).to_list(1000)
-        turmas_ids = [turma["id"] for turma in minhas_turmas]
-        
-        # � ALUNOS ATIVOS: TODOS DO CURSO (não apenas das turmas do instrutor)
-        if getattr(current_user, 'curso_id', None):
-            # Buscar TODAS as turmas do curso (não só do instrutor)
-            todas_turmas_curso = await db.turmas.find({
-                "curso_id": getattr(current_user, 'curso_id', None),
-                "ativo": True
-            }).to_list(1000)
-            
-            # Coletar IDs únicos de TODOS os alunos do curso
-            alunos_unicos_curso = set()
-            for turma in todas_turmas_curso:
-                for aluno_id in turma.get("alunos_ids", []):
-                    alunos_unicos_curso.add(aluno_id)
-            
-            # 🎯 CONTAR APENAS ALUNOS DO CURSO (alternativa por problema com $in)
-            alunos_ativos = 0
-            alunos_desistentes = 0
-            
-            if alunos_unicos_curso:
-                # ALTERNATIVA: Usar aggregation pipeline para contornar problema $in
-                pipeline_ativos = [
-                    {"$match": {"id": {"$in": list(alunos_unicos_curso)}, "status": "ativo"}},
-                    {"$count": "total"}
-                ]
-                
-                pipeline_desistentes = [
-                    {"$match": {"id": {"$in": list(alunos_unicos_curso)}, "status": "desistente"}},
-                    {"$count": "total"}
-                ]
-                
-                result_ativos = await db.alunos.aggregate(pipeline_ativos).to_list(1)
-                result_desistentes = await db.alunos.aggregate(pipeline_desistentes).to_list(1)
-                
-                alunos_ativos = result_ativos[0]["total"] if result_ativos else 0
-                alunos_desistentes = result_desistentes[0]["total"] if result_desistentes else 0
-        else:
-            # Fallback se não tiver curso_id definido
-            alunos_ativos = 0
-            alunos_desistentes = 0
-        
-        # 🎯 CORRIGIR: Chamadas do instrutor usando collection 'attendances'
-        chamadas_hoje = await db.attendances.count_documents({
-            "turma_id": {"$in": turmas_ids},
-            "data": hoje.isoformat()
-        })
-        
-        # Stats mensais das suas turmas
-        chamadas_mes = await db.attendances.find({
-            "turma_id": {"$in": turmas_ids},
-            "data": {"$gte": primeiro_mes.isoformat()}
-        }).to_list(1000)
-        
-        # 🎯 CORRIGIR: Calcular presenças e faltas a partir dos records
-        total_presencas_mes = 0
-        total_faltas_mes = 0
-        
-        for chamada in chamadas_mes:
-            records = chamada.get("records", [])
-            presentes = len([r for r in records if r.get("presente", False)])
-            ausentes = len(records) - presentes
-            total_presencas_mes += presentes
-            total_faltas_mes += ausentes
-        
-        # Buscar dados do curso do instrutor
-        curso_nome = "Seu Curso"
-        unidade_nome = "Sua Unidade"
-        
-        if getattr(current_user, 'curso_id', None):
-            curso = await db.cursos.find_one({"id": getattr(current_user, 'curso_id', None)})
-            if curso:
-                curso_nome = curso.get("nome", "Seu Curso")
-        
-        if getattr(current_user, 'unidade_id', None):
-            unidade = await db.unidades.find_one({"id": getattr(current_user, 'unidade_id', None)})
-            if unidade:
-                unidade_nome = unidade.get("nome", "Sua Unidade")
+        scope = await scope_resolver.resolve(current_user, "chamadas")
+        minhas_turmas = list(scope.turmas)
+        turmas_ids = list(scope.turma_ids)
+        curso_id = getattr(current_user, 'curso_id', None)
+        
+        async def status_alunos_do_curso():
+            # 👥 ALUNOS ATIVOS: TODOS DO CURSO (não apenas das turmas do instrutor)
+            if not curso_id:
+                return {"ativo": 0, "desistente": 0}
+            alunos_curso = await db.turmas.distinct("alunos_ids", {"curso_id": curso_id, "ativo": True})
+            return await contar_status_alunos(db, alunos_curso)
+        
+        status_alunos, chamadas_hoje, rollup, curso_nome, unidade_nome = await asyncio.gather(
+            status_alunos_do_curso(),
+            db.attendances.count_documents({"turma_id": {"$in": turmas_ids}, "data": hoje.isoformat()}),
+            somar_rollup_periodos(db, periodos, turma_ids=turmas_ids),
+            buscar_nome(db.cursos, curso_id, "Seu Curso"),
+            buscar_nome(db.unidades, getattr(current_user, 'unidade_id', None), "Sua Unidade"),
+        )
+        alunos_ativos = status_alunos["ativo"]
+        alunos_desistentes = status_alunos["desistente"]
+        total_presencas_mes, total_faltas_mes = rollup["mes"]
+        presencas_semana, faltas_semana = rollup["semana"]
         
-        return {
+        stats = {
             "total_unidades": 1,  # Sua unidade
             "total_cursos": 1,    # Seu curso
             "total_alunos": alunos_ativos + alunos_desistentes,  # Total baseado nos status
@@ -4374,7 +4627,8 @@ async def get_dashboard_stats(current_user: UserResponse = Depends(get_current_u
             "chamadas_hoje": chamadas_hoje,
             "presencas_mes": total_presencas_mes,
             "faltas_mes": total_faltas_mes,
-            "taxa_presenca_mes": round((total_presencas_mes / (total_presencas_mes + total_faltas_mes) * 100) if (total_presencas_mes + total_faltas_mes) > 0 else 0, 1),
+            "taxa_presenca_mes": taxa_presenca(total_presencas_mes, total_faltas_mes),
+            "taxa_presenca_semana": taxa_presenca(presencas_semana, faltas_semana),
             "curso_nome": curso_nome,
             "unidade_nome": unidade_nome,
             "tipo_usuario": "Instrutor"
@@ -4382,77 +4636,43 @@ async def get_dashboard_stats(current_user: UserResponse = Depends(get_current_u
     
     elif current_user.tipo in ["pedagogo", "monitor"]:
         # 👩‍🎓 PEDAGOGO/MONITOR: Turmas do seu curso/unidade
-        query_turmas = {"ativo": True}
-        if getattr(current_user, 'curso_id', None):
-            query_turmas["curso_id"] = getattr(current_user, 'curso_id', None)
-        if getattr(current_user, 'unidade_id', None):
-            query_turmas["unidade_id"] = getattr(current_user, 'unidade_id', None)
-        
-        turmas_permitidas = await db.turmas.find(query_turmas).to_list(1000)
-        turmas_ids = [turma["id"] for turma in turmas_permitidas]
-        
-        # 🔄 CONTAR ALUNOS ÚNICOS (SEM DUPLICAÇÃO)
-        alunos_unicos = set()
-        for turma in turmas_permitidas:
-            for aluno_id in turma.get("alunos_ids", []):
-                alunos_unicos.add(aluno_id)
-        
-        # Buscar status apenas dos alunos únicos
-        alunos_ativos = 0
-        alunos_desistentes = 0
-        
-        if alunos_unicos:
-            alunos_lista = await db.alunos.find({"id": {"$in": list(alunos_unicos)}}).to_list(1000)
-            for aluno in alunos_lista:
-                if aluno.get("status") == "ativo":
-                    alunos_ativos += 1
-                elif aluno.get("status") == "desistente":
-                    alunos_desistentes += 1
-        
-        # 🎯 CORRIGIR: Chamadas das turmas permitidas usando collection 'attendances'
-        chamadas_hoje = await db.attendances.count_documents({
-            "turma_id": {"$in": turmas_ids},
-            "data": hoje.isoformat()
-        })
-        
-        # Stats mensais
-        chamadas_mes = await db.attendances.find({
-            "turma_id": {"$in": turmas_ids},
-            "data": {"$gte": primeiro_mes.isoformat()}
-        }).to_list(1000)
-        
-        total_presencas_mes = sum(c.get("total_presentes", 0) for c in chamadas_mes)
-        total_faltas_mes = sum(c.get("total_faltas", 0) for c in chamadas_mes)
-        
-        # Buscar dados do curso/unidade
-        curso_nome = "Seu Curso"
-        unidade_nome = "Sua Unidade"
-        
-        if getattr(current_user, 'curso_id', None):
-            curso = await db.cursos.find_one({"id": getattr(current_user, 'curso_id', None)})
-            if curso:
-                curso_nome = curso.get("nome", "Seu Curso")
-        
-        if getattr(current_user, 'unidade_id', None):
-            unidade = await db.unidades.find_one({"id": getattr(current_user, 'unidade_id', None)})
-            if unidade:
-                unidade_nome = unidade.get("nome", "Sua Unidade")
+        scope = await scope_resolver.resolve(current_user, "chamadas")
+        turmas_permitidas = list(scope.turmas)
+        turmas_ids = list(scope.turma_ids)
+        
+        # 🔄 ALUNOS ÚNICOS (SEM DUPLICAÇÃO) já vêm do escopo
+        alunos_unicos = scope.aluno_ids
+        
+        status_alunos, chamadas_hoje, rollup, curso_nome, unidade_nome = await asyncio.gather(
+            contar_status_alunos(db, alunos_unicos),
+            db.attendances.count_documents({"turma_id": {"$in": turmas_ids}, "data": hoje.isoformat()}),
+            somar_rollup_periodos(db, periodos, turma_ids=turmas_ids),
+            buscar_nome(db.cursos, getattr(current_user, 'curso_id', None), "Seu Curso"),
+            buscar_nome(db.unidades, getattr(current_user, 'unidade_id', None), "Sua Unidade"),
+        )
+        total_presencas_mes, total_faltas_mes = rollup["mes"]
+        presencas_semana, faltas_semana = rollup["semana"]
         
-        return {
+        stats = {
             "total_unidades": 1,  # Sua unidade
             "total_cursos": 1,    # Seu curso
             "total_alunos": len(alunos_unicos),
             "total_turmas": len(turmas_permitidas),
-            "alunos_ativos": alunos_ativos,
-            "alunos_desistentes": alunos_desistentes,
+            "alunos_ativos": status_alunos["ativo"],
+            "alunos_desistentes": status_alunos["desistente"],
             "chamadas_hoje": chamadas_hoje,
             "presencas_mes": total_presencas_mes,
             "faltas_mes": total_faltas_mes,
-            "taxa_presenca_mes": round((total_presencas_mes / (total_presencas_mes + total_faltas_mes) * 100) if (total_presencas_mes + total_faltas_mes) > 0 else 0, 1),
+            "taxa_presenca_mes": taxa_presenca(total_presencas_mes, total_faltas_mes),
+            "taxa_presenca_semana": taxa_presenca(presencas_semana, faltas_semana),
             "curso_nome": curso_nome,
             "unidade_nome": unidade_nome,
             "tipo_usuario": current_user.tipo.title()
         }
+    
+    if stats is not None:
+        dashboard_cache.set(chave, stats)
+    return stats
 
 # MIGRAÇÃO DE DADOS - Corrigir alunos sem data_nascimento
 @api_router.post("/migrate/fix-students")
@@ -4525,6 +4745,7 @@ async def migrate_turmas_tipo():
             
             print(f"✅ Turma '{turma.get('nome', 'sem nome')}' → {tipo_turma}")
         
+        scope_resolver.invalidate()
         print(f"✅ Migração concluída: {len(turmas_sem_tipo)} turmas atualizadas")
         
     except Exception as e:
@@ -4540,6 +4761,57 @@ async def migrate_turmas_tipo_endpoint(current_user: UserResponse = Depends(get_
     await migrate_turmas_tipo()
     return {"message": "Migração de tipo_turma executada com sucesso"}
 
+# 🔄 MIGRAÇÃO: Reconstruir resumos de frequência por aluno
+@api_router.post("/migrate/attendance-summary")
+async def rebuild_attendance_summary_endpoint(current_user: UserResponse = Depends(get_current_user)):
+    """Reconstrói student_attendance_summary a partir de todas as chamadas"""
+    if current_user.tipo != "admin":
+        raise HTTPException(status_code=403, detail="Apenas admin pode executar migrações")
+    
+    try:
+        total = await rebuild_student_attendance_summary(db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro na migração: {str(e)}")
+    
+    return {"message": "Resumos de frequência reconstruídos", "documentos": total}
+
+# 🔄 MIGRAÇÃO: Reconstruir rollup diário por turma
+@api_router.post("/migrate/turma-daily-rollup")
+async def rebuild_turma_daily_rollup_endpoint(current_user: UserResponse = Depends(get_current_user)):
+    """Reconstrói turma_daily_rollup a partir de todas as chamadas"""
+    if current_user.tipo != "admin":
+        raise HTTPException(status_code=403, detail="Apenas admin pode executar migrações")
+    
+    try:
+        total = await rebuild_turma_daily_rollup(db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro na migração: {str(e)}")
+    
+    return {"message": "Rollup diário por turma reconstruído", "documentos": total}
+
+# 🗂️ ÍNDICES: Relatório e reconciliação dos índices declarados em indexes.py
+@api_router.get("/migrate/indexes")
+async def get_index_report(current_user: UserResponse = Depends(get_current_user)):
+    """Índices ausentes, divergentes, não declarados e sem uso"""
+    if current_user.tipo != "admin":
+        raise HTTPException(status_code=403, detail="Apenas admin pode executar migrações")
+    
+    try:
+        return await index_report(db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao gerar relatório de índices: {str(e)}")
+
+@api_router.post("/migrate/indexes")
+async def reconcile_indexes_endpoint(current_user: UserResponse = Depends(get_current_user)):
+    """Cria os índices declarados que estiverem faltando (nunca remove)"""
+    if current_user.tipo != "admin":
+        raise HTTPException(status_code=403, detail="Apenas admin pode executar migrações")
+    
+    try:
+        return await reconcile_indexes(db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro na migração: {str(e)}")
+
 # 🎯 PRODUÇÃO: Sistema de inicialização removido - sem dados de exemplo
 
 # 🎯 PRODUÇÃO: Função de criação de dados de exemplo removida
@@ -4569,31 +4841,18 @@ async def get_dynamic_teacher_stats(
             query_turmas["curso_id"] = curso_id
         if turma_id:
             query_turmas["id"] = turma_id
-    elif current_user.tipo == "instrutor":
-        # ✅ Instrutor: apenas turmas REGULARES que ele instrui
-        query_turmas["instrutor_id"] = current_user.id
-        query_turmas["tipo_turma"] = "regular"
-    elif current_user.tipo == "pedagogo":
-        # ✅ Pedagogo: apenas turmas de EXTENSÃO da sua unidade/curso
-        if getattr(current_user, 'curso_id', None):
-            query_turmas["curso_id"] = getattr(current_user, 'curso_id', None)
-        if getattr(current_user, 'unidade_id', None):
-            query_turmas["unidade_id"] = getattr(current_user, 'unidade_id', None)
-        query_turmas["tipo_turma"] = "extensao"
-    elif current_user.tipo == "monitor":
-        # Monitor: pode ver qualquer tipo de turma que monitora
-        if getattr(current_user, 'curso_id', None):
-            query_turmas["curso_id"] = getattr(current_user, 'curso_id', None)
-        if getattr(current_user, 'unidade_id', None):
-            query_turmas["unidade_id"] = getattr(current_user, 'unidade_id', None)
-    
-    # 📈 Buscar turmas do usuário
-    turmas = await db.turmas.find(query_turmas).to_list(1000)
+        turmas = await db.turmas.find(query_turmas).to_list(1000)
+    else:
+        # ✅ Instrutor: turmas REGULARES / Pedagogo: EXTENSÃO da sua unidade/curso / Monitor: curso/unidade
+        scope = await scope_resolver.resolve(current_user, "relatorios")
+        turmas = [turma for turma in scope.turmas if turma.get("ativo") is True]
+    
+    # 📈 Turmas do usuário
     turma_ids = [turma["id"] for turma in turmas]
     
     # 🔍 DEBUG: Log para debugar desistentes
     print(f"📊 STATS DEBUG - Usuário: {current_user.nome} ({current_user.tipo})")
-    print(f"   📝 Query turmas: {query_turmas}")
+    print(f"   📝 Query turmas: {query_turmas if current_user.tipo == 'admin' else 'escopo relatorios (ativas)'}")
     print(f"   🎯 Turmas encontradas: {len(turmas)}")
     for turma in turmas:
         print(f"      • {turma['nome']} (ID: {turma['id']}) - Alunos: {len(turma.get('alunos_ids', []))}")
@@ -4609,6 +4868,31 @@ async def get_dynamic_teacher_stats(
             "resumo_turmas": []
         }
     
+    # 📊 Contadores por (turma, aluno) em UMA leitura por escopo:
+    # sem filtro de data vêm de student_attendance_summary, com filtro de uma passada em attendances
+    if not data_inicio and not data_fim:
+        contagens = await load_summary_counts(db, turma_ids)
+        sessoes = await count_sessions_by_turma(db, turma_ids)
+    else:
+        # 🧮 Período recortado nas matrizes em cache (colunas = chamadas em ordem de data)
+        inicio = data_inicio.isoformat() if data_inicio else None
+        fim = data_fim.isoformat() if data_fim else None
+        contagens, sessoes = {}, {}
+        for turma_id_matriz, matriz in (await attendance_matrices.get_many(turma_ids, inicio, fim)).items():
+            total_sessoes = matriz.sessions(inicio, fim)
+            if total_sessoes:
+                sessoes[turma_id_matriz] = total_sessoes
+            for aluno_id, contador in matriz.counts(inicio, fim).items():
+                contagens[(turma_id_matriz, aluno_id)] = contador
+    
+    # 👥 Alunos de todas as turmas em uma consulta (ordem natural preservada por turma)
+    todos_ids = list({aluno_id for turma in turmas for aluno_id in turma.get("alunos_ids", [])})
+    alunos_por_id = {}
+    if todos_ids:
+        async for aluno in db.alunos.find({"id": {"$in": todos_ids}}):
+            alunos_por_id.setdefault(aluno["id"], aluno)
+    ordem_natural = {aluno_id: i for i, aluno_id in enumerate(alunos_por_id)}
+    
     # 📊 Calcular estatísticas dinâmicas por aluno
     alunos_stats = []
     for turma in turmas:
@@ -4616,37 +4900,15 @@ async def get_dynamic_teacher_stats(
         if not aluno_ids:
             continue
             
-        # Buscar alunos da turma
-        alunos = await db.alunos.find({"id": {"$in": aluno_ids}}).to_list(1000)
+        # Alunos da turma
+        membros = sorted((i for i in set(aluno_ids) if i in ordem_natural), key=ordem_natural.get)
+        alunos = [alunos_por_id[i] for i in membros]
         
         for aluno in alunos:
-            # Contar presenças e faltas do aluno nesta turma com filtro de data
-            query_chamadas = {"turma_id": turma["id"]}
-            
-            # Aplicar filtro de data se fornecido
-            if data_inicio and data_fim:
-                query_chamadas["data"] = {"$gte": data_inicio.isoformat(), "$lte": data_fim.isoformat()}
-            elif data_inicio:
-                query_chamadas["data"] = {"$gte": data_inicio.isoformat()}
-            elif data_fim:
-                query_chamadas["data"] = {"$lte": data_fim.isoformat()}
-            
-            # 🎯 CORREÇÃO CRÍTICA: Usar collection 'attendances' (não 'chamadas')
-            chamadas = await db.attendances.find(query_chamadas).to_list(1000)
-            
-            total_aulas = len(chamadas)
-            presencas = 0
-            faltas = 0
-            
-            for chamada in chamadas:
-                # ✅ CORREÇÃO: Usar 'records' em vez de 'presencas'
-                records = chamada.get("records", [])
-                for record in records:
-                    if record.get("aluno_id") == aluno["id"]:
-                        if record.get("presente", False):
-                            presencas += 1
-                        else:
-                            faltas += 1
+            resumo = contagens.get((turma["id"], aluno["id"])) or {}
+            presencas = resumo.get("presencas", 0)
+            faltas = resumo.get("faltas", 0)
+            total_aulas = sessoes.get(turma["id"], 0)
             
             if total_aulas > 0:
                 taxa_presenca = (presencas / total_aulas) * 100
@@ -4707,7 +4969,7 @@ async def get_dynamic_teacher_stats(
         taxa_media = sum(a["taxa_presenca"] for a in alunos_unicos_list) / len(alunos_unicos_list)
         
         # 🎯 CORREÇÃO: Alunos em risco baseado em alunos únicos
-        alunos_em_risco_unicos = [a for a in alunos_unicos_list if a["taxa_presenca"] < 75]
+        alunos_em_risco_unicos = [a for a in alunos_unicos_list if em_risco(a["taxa_presenca"])]
         
         print(f"   🎯 RESULTADO: {len(desistentes_unicos)} desistentes únicos calculados")
         print(f"   🎯 CORREÇÃO: Taxa média recalculada: {round(taxa_media, 1)}%")
@@ -4724,9 +4986,14 @@ async def get_dynamic_teacher_stats(
         maiores_presencas = []
         maiores_faltas = []
     
+    # 📆 Aulas previstas pelo calendário da turma (até hoje), todas as turmas de uma vez
+    calendarios = await schedule_cache.calendarios(turmas)
+    fim_previstas = min(data_fim, date.today()) if data_fim else date.today()
+    aulas_previstas = contar_aulas([calendarios[turma["id"]] for turma in turmas], data_inicio or date.min, fim_previstas)
+    
     # 📋 Resumo por turma
     resumo_turmas = []
-    for turma in turmas:
+    for posicao, turma in enumerate(turmas):
         turma_alunos = [a for a in alunos_stats if a["turma"] == turma["nome"]]
         if turma_alunos:
             media_turma = sum(a["taxa_presenca"] for a in turma_alunos) / len(turma_alunos)
@@ -4737,7 +5004,9 @@ async def get_dynamic_teacher_stats(
             "nome": turma["nome"],
             "total_alunos": len(turma_alunos),
             "taxa_media": round(media_turma, 1),
-            "alunos_risco": len([a for a in turma_alunos if a["taxa_presenca"] < 75])
+            "alunos_risco": len([a for a in turma_alunos if em_risco(a["taxa_presenca"])]),
+            "aulas_previstas": int(aulas_previstas[posicao]) if data_inicio or turma.get("data_inicio") else None,
+            "aulas_realizadas": sessoes.get(turma["id"], 0)
         })
     
     total_alunos_correto = len(alunos_unicos)
@@ -4771,13 +5040,123 @@ async def get_dynamic_teacher_stats(
         "resumo_turmas": resumo_turmas
     }
 
+# 🚨 RISCO DE EVASÃO: todos os alunos do escopo pontuados em lote (risk_scoring.py)
+RISK_SNAPSHOT_LOTE_TURMAS = 200
+
+async def turmas_risco(current_user: UserResponse, unidade_id=None, curso_id=None, turma_id=None) -> List[dict]:
+    """Turmas ativas do relatório (todas para admin, escopo "relatorios" para os demais),
+    com os filtros de unidade/curso/turma aplicados para qualquer perfil"""
+    filtros = {"unidade_id": unidade_id, "curso_id": curso_id, "id": turma_id}
+    filtros = {campo: valor for campo, valor in filtros.items() if valor}
+    if current_user.tipo == "admin":
+        return await db.turmas.find({"ativo": True, **filtros}, {"_id": 0, "id": 1, "nome": 1, "alunos_ids": 1}).to_list(None)
+    scope = await scope_resolver.resolve(current_user, "relatorios")
+    return [
+        turma for turma in scope.turmas
+        if turma.get("ativo") is True and all(turma.get(campo) == valor for campo, valor in filtros.items())
+    ]
+
+async def alunos_ativos(aluno_ids) -> set:
+    """Ids com status "ativo" (sem status conta como ativo, como nos demais relatórios)"""
+    aluno_ids = list({aluno_id for aluno_id in aluno_ids if aluno_id})
+    if not aluno_ids:
+        return set()
+    cursor = db.alunos.find(
+        {"id": {"$in": aluno_ids}, "$or": [{"status": "ativo"}, {"status": {"$exists": False}}]},
+        {"_id": 0, "id": 1},
+    )
+    return {aluno["id"] async for aluno in cursor}
+
+async def pontuar_turmas(turmas: List[dict], hoje: Optional[date] = None) -> List[dict]:
+    """Linhas de risco dos alunos ativos matriculados (com chamadas) nas turmas, sem ordem definida"""
+    hoje = hoje or date.today()
+    ativos = await alunos_ativos(aluno_id for turma in turmas for aluno_id in turma.get("alunos_ids", []) or [])
+    membros = {turma["id"]: [a for a in turma.get("alunos_ids", []) or [] if a in ativos] for turma in turmas}
+    matrizes = await attendance_matrices.get_many(membros)
+    return metricas_risco(matrizes, membros, hoje)
+
+async def pontuar_em_lotes(turmas: List[dict], hoje: Optional[date] = None) -> List[dict]:
+    """pontuar_turmas em lotes, para não montar as matrizes de todas as turmas de uma vez"""
+    linhas = []
+    for inicio in range(0, len(turmas), RISK_SNAPSHOT_LOTE_TURMAS):
+        linhas.extend(await pontuar_turmas(turmas[inicio:inicio + RISK_SNAPSHOT_LOTE_TURMAS], hoje))
+    return linhas
+
+async def gerar_snapshot_risco() -> List[dict]:
+    """Todas as turmas ativas"""
+    turmas = await db.turmas.find({"ativo": True}, {"_id": 0, "id": 1, "alunos_ids": 1}).to_list(None)
+    return await pontuar_em_lotes(turmas)
+
+risk_snapshots = RiskSnapshotter(db, gerar_snapshot_risco)
+
+@api_router.get("/reports/risk")
+async def get_risk_report(
+    unidade_id: Optional[str] = None,
+    curso_id: Optional[str] = None,
+    turma_id: Optional[str] = None,
+    nivel: Optional[str] = Query(None, pattern="^(alto|medio|baixo)$"),
+    data: Optional[date] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """🚨 Alunos ordenados por risco de evasão (maior pontuação primeiro).
+    Sem `data` calcula agora; com `data` lê o snapshot gravado naquele dia."""
+    if current_user.tipo not in ["instrutor", "pedagogo", "monitor", "admin"]:
+        raise HTTPException(status_code=403, detail="Acesso restrito")
+
+    turmas = await turmas_risco(current_user, unidade_id, curso_id, turma_id)
+    vazio = {"items": [], "total": 0, "skip": skip, "limit": limit, "data": data.isoformat() if data else None}
+    if not turmas:
+        return vazio
+    turmas_por_id = {turma["id"]: turma for turma in turmas}
+
+    if data:
+        filtro = {"data": data.isoformat(), "turma_id": {"$in": list(turmas_por_id)}}
+        if nivel:
+            filtro["nivel"] = nivel
+        total = await db.risk_snapshots.count_documents(filtro)
+        linhas = await db.risk_snapshots.find(filtro, {"_id": 0, "data": 0, "created_at": 0}).sort(
+            [("pontuacao", -1), ("taxa_geral", 1), ("aluno_id", 1)]
+        ).skip(skip).limit(limit).to_list(None)
+        gerado_em = data.isoformat()
+    else:
+        linhas = ordenar_por_risco(await pontuar_em_lotes(turmas))
+        if nivel:
+            linhas = [linha for linha in linhas if linha["nivel"] == nivel]
+        total = len(linhas)
+        linhas = linhas[skip:skip + limit]
+        gerado_em = datetime.now(timezone.utc).isoformat()
+
+    # 👥 Nomes só da página devolvida
+    nomes = {}
+    aluno_ids = list({linha["aluno_id"] for linha in linhas})
+    if aluno_ids:
+        async for aluno in db.alunos.find({"id": {"$in": aluno_ids}}, {"_id": 0, "id": 1, "nome": 1}):
+            nomes[aluno["id"]] = aluno.get("nome", "")
+    for linha in linhas:
+        linha["nome"] = nomes.get(linha["aluno_id"], "")
+        linha["turma"] = turmas_por_id.get(linha["turma_id"], {}).get("nome", "")
+
+    return {**vazio, "items": linhas, "total": total, "gerado_em": gerado_em}
+
+@api_router.post("/reports/risk/snapshot")
+async def create_risk_snapshot(forcar: bool = False, current_user: UserResponse = Depends(get_current_user)):
+    """Grava o snapshot de risco de hoje (o mesmo que roda toda noite)"""
+    if current_user.tipo != "admin":
+        raise HTTPException(status_code=403, detail="Apenas administradores")
+    return await risk_snapshots.executar(forcar=forcar)
+
 # TEACHER STATS ENDPOINT - CORRIGIDO PARA PEDAGOGO/INSTRUTOR
 # ENDPOINT REMOVIDO - DUPLICADO
 
 # 🚀 NOVOS ENDPOINTS PARA SISTEMA DE CHAMADAS PENDENTES
 
 @api_router.get("/instructor/me/pending-attendances", response_model=PendingAttendancesResponse)
-async def get_pending_attendances_for_instructor(current_user: UserResponse = Depends(get_current_user)):
+async def get_pending_attendances_for_instructor(
+    dias: int = Query(PENDING_LOOKBACK_DAYS, ge=1, le=PENDING_LOOKBACK_MAX),
+    current_user: UserResponse = Depends(get_current_user)
+):
     """
     🎯 RBAC - Lista chamadas pendentes baseado no tipo de usuário:
     - ADMIN: Todas as chamadas pendentes do sistema
@@ -4785,11 +5164,12 @@ async def get_pending_attendances_for_instructor(current_user: UserResponse = De
     - PEDAGOGO: Turmas da sua unidade/curso
     - MONITOR: Turmas que monitora
     
-    🗓️ REGRAS DE DIAS: Considera apenas dias de aula programados (seg-sex + cursos específicos)
-    - Segunda a Sexta: Padrão para todos os cursos
-    - Sábado: Apenas cursos específicos que têm aula
-    - Domingo: Nenhuma aula
-    - Sexta: Nem sempre (conforme programação do curso)
+    🗓️ REGRAS DE DIAS: calendário da turma (schedule.py)
+    - Dias da semana da turma; sem eles, os do curso; sem nenhum, segunda a quinta (DIAS_AULA_PADRAO)
+    - Somente dentro do período da turma (data_inicio/data_fim)
+    - Feriados gerais e da unidade não contam como dia de aula
+    
+    📆 JANELA: hoje e os `dias - 1` dias anteriores (padrão PENDING_LOOKBACK_DAYS)
     """
     
     hoje = today_iso_date()
@@ -4802,105 +5182,39 @@ async def get_pending_attendances_for_instructor(current_user: UserResponse = De
         print(f"🔍 [DEBUG] Data hoje: {hoje_date}")
         
         # 🎯 RBAC - Filtrar turmas baseado no tipo de usuário
-        if current_user.tipo == "admin":
-            # 👑 ADMIN: Ver todas as turmas ativas do sistema
-            cursor = db.turmas.find({"ativo": True})
-            print(f"🔍 [DEBUG] Admin - buscando todas as turmas ativas")
-            
-        elif current_user.tipo == "instrutor":
-            # 🧑‍🏫 INSTRUTOR: Apenas suas turmas
-            cursor = db.turmas.find({
-                "instrutor_id": current_user.id,
-                "ativo": True
-            })
-            print(f"🔍 [DEBUG] Instrutor - buscando turmas do instrutor_id: {current_user.id}")
-            
-        elif current_user.tipo == "pedagogo":
-            # 👩‍🎓 PEDAGOGO: Turmas da sua unidade/curso
-            query_turmas = {"ativo": True}
-            if getattr(current_user, 'curso_id', None):
-                query_turmas["curso_id"] = getattr(current_user, 'curso_id', None)
-            if getattr(current_user, 'unidade_id', None):
-                query_turmas["unidade_id"] = getattr(current_user, 'unidade_id', None)
-            cursor = db.turmas.find(query_turmas)
-            
-        elif current_user.tipo == "monitor":
-            # 👨‍💻 MONITOR: Turmas que ele monitora (mesmo critério do pedagogo)
-            query_turmas = {"ativo": True}
-            if getattr(current_user, 'curso_id', None):
-                query_turmas["curso_id"] = getattr(current_user, 'curso_id', None)
-            if getattr(current_user, 'unidade_id', None):
-                query_turmas["unidade_id"] = getattr(current_user, 'unidade_id', None)
-            cursor = db.turmas.find(query_turmas)
-            
-        else:
+        # Admin: todas as ativas / Instrutor: suas turmas / Pedagogo e monitor: unidade/curso
+        if current_user.tipo not in ["admin", "instrutor", "pedagogo", "monitor"]:
             raise HTTPException(status_code=403, detail="Tipo de usuário não autorizado")
         
-        turmas = await cursor.to_list(length=1000)
+        scope = await scope_resolver.resolve(current_user, "chamadas")
+        turmas = list(scope.turmas)
         print(f"🔍 [DEBUG] Encontradas {len(turmas)} turmas")
         pending = []
         
+        # 🚀 Calendários e chamadas da janela em consultas fixas para todas as turmas
+        datas = datas_recentes(hoje_date, dias)
+        calendarios = await schedule_cache.calendarios(turmas)
+        tem_aula = grade([calendarios[t["id"]] for t in turmas], datas)
+        realizadas = await chamadas_realizadas(db, (t.get("id") for t in turmas), datas)
+        turmas_com_pendencia = {}
+        
         # 🚀 LÓGICA DE CHAMADAS PENDENTES: Verificar baseado nos dias de aula
         
-        for t in turmas:
+        for posicao, t in enumerate(turmas):
             tid = t.get("id")
             turma_nome = t.get("nome", "Turma sem nome")
-            curso_id = t.get("curso_id")
-            
-            # 🎯 BUSCAR DIAS DA SEMANA DO CURSO (NÃO DA TURMA!)
-            dias_semana = []
-            if curso_id:
-                curso = await db.cursos.find_one({"id": curso_id})
-                if curso:
-                    dias_semana = curso.get("dias_semana", [])
-            
-            # Se o curso não tem dias específicos, usar dias úteis como padrão (segunda=0 a sexta=4)
-            if not dias_semana:
-                dias_semana = [0, 1, 2, 3, 4]  # Segunda a Sexta
-                
-            # 📅 VERIFICAR PERÍODO DA TURMA
-            data_inicio = t.get("data_inicio")
-            data_fim = t.get("data_fim")
-            
-            # Converter strings para date se necessário
-            if isinstance(data_inicio, str):
-                data_inicio = datetime.fromisoformat(data_inicio).date()
-            if isinstance(data_fim, str):
-                data_fim = datetime.fromisoformat(data_fim).date()
             
-            # 🎯 VERIFICAR APENAS HOJE E ONTEM (máximo 2 dias atrás)
-            # Não mostrar chamadas muito antigas para evitar confusão
-            for dias_atras in range(3):  # 0 = hoje, 1 = ontem, 2 = anteontem
-                data_verificar = hoje_date - timedelta(days=dias_atras)
+            # 🎯 VERIFICAR A JANELA (0 = hoje, 1 = ontem, ...)
+            for dias_atras, data_verificar in enumerate(datas):
                 data_iso = data_verificar.isoformat()
                 
-                # 🎯 FILTROS IMPORTANTES:
-                
-                # 1) Verificar se está no período da turma
-                if data_inicio and data_fim:
-                    if not (data_inicio <= data_verificar <= data_fim):
-                        continue  # Data fora do período da turma
-                
-                # 2) Verificar se é dia de aula (baseado em dias_semana do curso)
-                dia_semana = data_verificar.weekday()  # 0=segunda, 6=domingo
-                if dia_semana not in dias_semana:
-                    continue  # Não é dia de aula programado
+                # 🎯 Dia de aula da turma (semana, período e feriados)
+                if not tem_aula[posicao, dias_atras]:
+                    continue
                 
                 # Verificar se já existe attendance para esta data
-                att = await db.attendances.find_one({"turma_id": tid, "data": data_iso})
-                
-                if not att:  # Não tem attendance = pendente
-                    # Buscar dados básicos dos alunos da turma
-                    alunos_ids = t.get("alunos_ids", [])
-                    if alunos_ids:
-                        # CORREÇÃO: Usar collection 'alunos' que é a correta no sistema
-                        alunos_cursor = db.alunos.find(
-                            {"id": {"$in": alunos_ids}}, 
-                            {"id": 1, "nome": 1}
-                        )
-                        alunos = await alunos_cursor.to_list(1000)
-                    else:
-                        alunos = []
+                if (tid, data_iso) not in realizadas:  # Não tem attendance = pendente
+                    turmas_com_pendencia[tid] = t
                     
                     # Determinar prioridade baseada na data
                     if dias_atras == 0:
@@ -4920,11 +5234,16 @@ async def get_pending_attendances_for_instructor(current_user: UserResponse = De
                         "dias_atras": dias_atras,
                         "prioridade": prioridade,
                         "status_msg": status_msg,
-                        "alunos": [{"id": a.get("id"), "nome": a.get("nome")} for a in alunos],
+                        "alunos": [],  # preenchido abaixo com um único roster
                         "vagas": t.get("vagas_total", 0),
                         "horario": f"{t.get('horario_inicio', '')}-{t.get('horario_fim', '')}"
                     })
         
+        # 👥 Alunos de todas as turmas pendentes em uma consulta
+        alunos_por_turma = await rosters(db, turmas_com_pendencia.values())
+        for item in pending:
+            item["alunos"] = alunos_por_turma.get(item["turma_id"], [])
+        
         # Ordenar por prioridade: urgente -> importante -> pendente, depois por data (mais recente primeiro)
         prioridade_ordem = {"urgente": 0, "importante": 1, "pendente": 2}
         pending.sort(key=lambda x: (prioridade_ordem.get(x["prioridade"], 3), x["dias_atras"]))
@@ -4936,6 +5255,127 @@ async def get_pending_attendances_for_instructor(current_user: UserResponse = De
         print(f"❌ Erro ao buscar chamadas pendentes: {e}")
         raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
 
+# 🔔 PUSH DE CHAMADAS PENDENTES (notifications.py): recalcula só quando algo muda
+async def calcular_notificacoes(user: UserResponse):
+    """Os mesmos payloads dos dois endpoints de polling, mais as turmas que disparam recálculo"""
+    scope = await scope_resolver.resolve(user, "chamadas")
+    eventos = {"pending-calls": await get_pending_calls(dias=PENDING_LOOKBACK_DAYS, current_user=user)}
+    if user.tipo in ["admin", "instrutor", "pedagogo", "monitor"]:
+        pendentes = await get_pending_attendances_for_instructor(dias=PENDING_LOOKBACK_DAYS, current_user=user)
+        eventos["pending-attendances"] = pendentes.model_dump()
+    return eventos, scope.turma_ids
+
+def chave_notificacoes(user: UserResponse):
+    """Mesmo escopo, mesmos eventos: admins compartilham, demais por usuário/curso/unidade"""
+    if user.tipo == "admin":
+        return ("admin",)
+    return (user.tipo, user.id, user.unidade_id, user.curso_id)
+
+pending_notifier = PendingNotifier(db, calcular_notificacoes, chave_notificacoes)
+stream_tickets = StreamTickets(db)
+notification_bearer = HTTPBearer(auto_error=False)
+
+async def principal_ativo(email: str) -> Optional[UserResponse]:
+    """Usuário do stream, relido a cada keepalive: None se sumiu ou foi desativado"""
+    principal = await load_principal(email)
+    return principal.model_copy() if principal is not None and principal.ativo else None
+
+@api_router.post("/notifications/stream-ticket")
+async def create_stream_ticket(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """🎫 Troca o JWT por um ticket de uso único para abrir /notifications/stream
+    (EventSource não envia cabeçalhos e o JWT na URL acabaria nos logs)"""
+    current_user = await get_current_user(credentials)
+    if not current_user.ativo:
+        raise HTTPException(status_code=401, detail="Usuário inativo")
+    payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    ticket = await stream_tickets.emitir(current_user.email, float(payload["exp"]))
+    return {"ticket": ticket, "expires_in": NOTIFY_TICKET_TTL_SECONDS}
+
+@api_router.get("/notifications/stream")
+async def stream_pending_notifications(
+    ticket: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(notification_bearer)
+):
+    """🔔 Server-Sent Events com os eventos "pending-calls" e "pending-attendances".
+    O navegador abre com ?ticket= (POST /notifications/stream-ticket); clientes que
+    enviam cabeçalhos podem usar o Bearer. O stream fecha quando o JWT expira."""
+    if credentials is not None:
+        try:
+            payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        except jwt.PyJWTError:
+            raise HTTPException(status_code=401, detail="Token inválido")
+        email, token_exp = payload.get("sub"), payload.get("exp")
+    elif ticket:
+        dados = await stream_tickets.consumir(ticket)
+        if dados is None:
+            raise HTTPException(status_code=401, detail="Ticket inválido ou expirado")
+        email, token_exp = dados["email"], dados["token_exp"]
+    else:
+        raise HTTPException(status_code=401, detail="Ticket ausente")
+    
+    current_user = await principal_ativo(email) if email and token_exp else None
+    if current_user is None:
+        raise HTTPException(status_code=401, detail="Token inválido")
+    
+    try:
+        pending_notifier.verificar_limite()
+    except LimiteConexoes as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    
+    return StreamingResponse(
+        pending_notifier.stream(current_user, lambda: principal_ativo(email), float(token_exp)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ⏰ TAREFAS AGENDADAS (scheduler.py): só a réplica líder roda as globais
+CACHE_WARMUP_HOUR = int(os.environ.get("CACHE_WARMUP_HOUR", "7"))
+CACHE_WARMUP_MINUTE = int(os.environ.get("CACHE_WARMUP_MINUTE", "40"))
+ROLLUP_RECONCILE_HOUR = int(os.environ.get("ROLLUP_RECONCILE_HOUR", "1"))
+CACHE_WARMUP_MAX_TURMAS = 512  # tamanho do cache de matrizes
+
+async def turmas_com_aula_hoje() -> List[dict]:
+    hoje = date.today()
+    turmas = await db.turmas.find({"ativo": True}, {"_id": 0}).to_list(None)
+    calendarios = await schedule_cache.calendarios(turmas)
+    tem_aula = grade([calendarios[t["id"]] for t in turmas], [hoje])
+    return [turma for turma, aula in zip(turmas, tem_aula[:, 0]) if aula]
+
+async def reconciliar_rollup_de_ontem() -> dict:
+    ontem = (date.today() - timedelta(days=1)).isoformat()
+    return await reconcile_daily_rollup(db, ontem)
+
+async def snapshot_risco_diario() -> dict:
+    return await risk_snapshots.executar()
+
+async def limpar_relatorios_expirados() -> dict:
+    resultado = await report_jobs.limpar_expirados()
+    if resultado["arquivos"] or resultado["jobs_orfaos"]:
+        print(f"🧹 Relatórios: {resultado['arquivos']} arquivo(s) expirado(s) removido(s), "
+              f"{resultado['jobs_orfaos']} job(s) órfão(s) encerrado(s)")
+    return resultado
+
+async def aquecer_caches() -> dict:
+    """Antes do pico da manhã, em cada réplica: calendários e matrizes das turmas de hoje"""
+    turmas = await turmas_com_aula_hoje()
+    matrizes = await attendance_matrices.get_many([t["id"] for t in turmas[:CACHE_WARMUP_MAX_TURMAS]])
+    return {"turmas_com_aula": len(turmas), "matrizes": len(matrizes)}
+
+scheduler = Scheduler(db)
+scheduler.registrar("rollup-diario", reconciliar_rollup_de_ontem, Diariamente(ROLLUP_RECONCILE_HOUR, 30))
+scheduler.registrar("snapshot-risco", snapshot_risco_diario, Diariamente(RISK_SNAPSHOT_HOUR))
+scheduler.registrar("limpeza-relatorios", limpar_relatorios_expirados, ACada(REPORT_JOB_CLEANUP), sem_agendador=True)
+scheduler.registrar("aquecer-caches", aquecer_caches, Diariamente(CACHE_WARMUP_HOUR, CACHE_WARMUP_MINUTE), local=True)
+
+@api_router.get("/admin/scheduler")
+async def get_scheduler_status(
+    limite: int = Query(50, ge=1, le=500),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """⏰ Líder atual, agenda e métricas por tarefa e últimas execuções"""
+    check_admin_permission(current_user)
+    return await scheduler.status(limite)
+
 @api_router.get("/classes/{turma_id}/attendance/today")
 async def get_attendance_today(turma_id: str, current_user: UserResponse = Depends(get_current_user)):
     """Verificar se já existe chamada para turma hoje"""
@@ -5011,6 +5451,7 @@ async def create_attendance_for_date(
         # Inserir com chave única (turma_id, data)
         # IMPORTANTE: Criar índice único no MongoDB primeiro!
         res = await db.attendances.insert_one(doc)
+        await update_attendance_rollups(doc)
         
         # Log para auditoria
         print(f"✅ Chamada criada: turma={turma_id}, data={data_iso}, by={current_user.id}")
@@ -5080,153 +5521,14 @@ async def ping_server():
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await import_jobs.parar()
+    await report_pool.parar()
+    await scheduler.parar()
+    await pending_notifier.parar()
     client.close()
+    password_hasher.shutdown()
 
 # Railway compatibility - run server if executed directly
-@api_router.get("/teacher/stats")
-async def get_teacher_stats(current_user: dict = Depends(get_current_user)):
-    """✅ CORRIGIDO: Estatísticas por tipo de usuário com cálculos corretos"""
-    try:
-        # 🎯 FILTRAR DADOS BASEADO NO TIPO DE USUÁRIO
-        if current_user["tipo"] == "admin":
-            # Admin: todas as turmas e chamadas
-            query_turmas = {"ativo": True}
-            query_chamadas = {}
-            query_alunos = {}
-        elif current_user["tipo"] == "instrutor":
-            # ✅ Instrutor: apenas suas turmas REGULARES
-            query_turmas = {"instrutor_id": current_user["id"], "ativo": True, "tipo_turma": "regular"}
-        elif current_user["tipo"] == "pedagogo":
-            # ✅ Pedagogo: apenas turmas de EXTENSÃO da unidade/curso
-            query_turmas = {"ativo": True, "tipo_turma": "extensao"}
-            if current_user.get("unidade_id"):
-                query_turmas["unidade_id"] = current_user["unidade_id"]
-            if current_user.get("curso_id"):
-                query_turmas["curso_id"] = current_user["curso_id"]
-        elif current_user["tipo"] == "monitor":
-            # Monitor: turmas que monitora
-            query_turmas = {"monitor_id": current_user["id"], "ativo": True}
-        else:
-            # Tipo desconhecido
-            query_turmas = {}
-        
-        # 📊 BUSCAR TURMAS DO USUÁRIO
-        turmas = await db.turmas.find(query_turmas).to_list(1000)
-        turma_ids = [turma["id"] for turma in turmas]
-        
-        if not turma_ids and current_user["tipo"] != "admin":
-            # Usuário sem turmas: retornar dados zerados
-            return {
-                "taxa_media_presenca": "0.0%",
-                "total_alunos": 0,
-                "alunos_em_risco": 0,
-                "desistentes": 0,
-                "chamadas_hoje": 0,
-                "total_turmas": 0,
-                "ultima_atualizacao": datetime.now().isoformat()
-            }
-        
-        # 📅 FILTRAR CHAMADAS POR TURMAS DO USUÁRIO
-        if current_user["tipo"] == "admin":
-            query_chamadas = {}
-        else:
-            query_chamadas = {"turma_id": {"$in": turma_ids}}
-            
-        todas_chamadas = await db.attendances.find(query_chamadas).to_list(1000)
-        
-        # 🧮 CÁLCULOS DE PRESENÇA
-        total_presentes = 0
-        total_registros = 0
-        alunos_stats = {}
-        
-        for chamada in todas_chamadas:
-            records = chamada.get('records', [])
-            for record in records:
-                aluno_id = record.get('aluno_id')
-                presente = record.get('presente', False)
-                
-                total_registros += 1
-                if presente:
-                    total_presentes += 1
-                
-                # Stats por aluno
-                if aluno_id not in alunos_stats:
-                    alunos_stats[aluno_id] = {'presentes': 0, 'faltas': 0}
-                
-                if presente:
-                    alunos_stats[aluno_id]['presentes'] += 1
-                else:
-                    alunos_stats[aluno_id]['faltas'] += 1
-        
-        # ✅ TAXA DE PRESENÇA REAL
-        taxa_presenca = (total_presentes / total_registros * 100) if total_registros > 0 else 0
-        
-        # 🚨 ALUNOS EM RISCO (mais de 25% faltas)
-        alunos_risco = 0
-        for stats in alunos_stats.values():
-            total_aulas = stats['presentes'] + stats['faltas']
-            if total_aulas > 0 and (stats['faltas'] / total_aulas) > 0.25:
-                alunos_risco += 1
-        
-        # 👥 CONTAR ALUNOS ÚNICOS DAS TURMAS DO USUÁRIO
-        alunos_unicos = set()
-        for turma in turmas:
-            alunos_ids = turma.get("alunos_ids", [])
-            alunos_unicos.update(alunos_ids)
-        total_alunos_usuario = len(alunos_unicos)
-        
-        # 📊 FILTRAR DESISTENTES POR ESCOPO DO USUÁRIO
-        if current_user["tipo"] == "admin":
-            desistentes = await db.alunos.count_documents({"status": "desistente"})
-        else:
-            # ✅ CORREÇÃO: Desistentes apenas dos alunos das turmas do usuário (com tipo de turma)
-            alunos_ids_list = list(alunos_unicos)
-            if alunos_ids_list:
-                # Buscar alunos desistentes que estão nas turmas do usuário
-                desistentes = await db.alunos.count_documents({
-                    "id": {"$in": alunos_ids_list},
-                    "status": "desistente"
-                })
-                print(f"🔍 DEBUG Desistentes {current_user['tipo']}: {desistentes} alunos desistentes de {len(alunos_ids_list)} alunos totais")
-            else:
-                desistentes = 0
-        
-        # 📅 CHAMADAS DE HOJE
-        hoje = date.today().isoformat()
-        if current_user["tipo"] == "admin":
-            chamadas_hoje = await db.attendances.count_documents({"data": hoje})
-        else:
-            chamadas_hoje = await db.attendances.count_documents({
-                "turma_id": {"$in": turma_ids},
-                "data": hoje
-            }) if turma_ids else 0
-        
-        print(f"📊 STATS {current_user['tipo'].upper()}: {taxa_presenca:.1f}% ({total_presentes}/{total_registros}) - Turmas: {len(turmas)}")
-        
-        return {
-            "taxa_media_presenca": f"{taxa_presenca:.1f}%",
-            "total_alunos": total_alunos_usuario,
-            "alunos_em_risco": alunos_risco,
-            "desistentes": desistentes,
-            "chamadas_hoje": chamadas_hoje,
-            "total_turmas": len(turmas),
-            "total_presentes": total_presentes,
-            "total_faltas": total_registros - total_presentes,
-            "usuario_tipo": current_user["tipo"],
-            "ultima_atualizacao": datetime.now().isoformat()
-        }
-        
-    except Exception as e:
-        print(f"❌ Erro teacher/stats: {e}")
-        return {
-            "taxa_media_presenca": "0.0%",
-            "total_alunos": 0,
-            "alunos_em_risco": 0,
-            "desistentes": 0,
-            "chamadas_hoje": 0,
-            "error": str(e)
-        }
-
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
@@ -0,0 +1,99 @@
+import io
+import sys
+from pathlib import Path
+
+import pytest
+from bson import ObjectId
+from gridfs.errors import NoFile
+
+# Os módulos do backend são importados pelo nome, como o server faz
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def _corrigir_find_and_modify():
+    """mongomock só refaz a busca do documento atualizado pelo _id quando a projeção
+    o inclui; com {"_id": 0} e ReturnDocument.AFTER ele reaplica o filtro original e
+    devolve None se o update mudou um campo filtrado (o MongoDB devolve o documento)"""
+    import mongomock.collection
+
+    original = mongomock.collection.Collection._find_and_modify
+    if getattr(original, "corrigido", False):
+        return
+
+    def find_and_modify(self, query, projection=None, *args, **kwargs):
+        projecao = dict(projection) if isinstance(projection, dict) else projection
+        sem_id = isinstance(projecao, dict) and projecao.get("_id") == 0
+        if sem_id:
+            projecao.pop("_id")
+        documento = original(self, query, projecao or None, *args, **kwargs)
+        if documento is not None and sem_id:
+            documento.pop("_id", None)
+        return documento
+
+    find_and_modify.corrigido = True
+    mongomock.collection.Collection._find_and_modify = find_and_modify
+
+
+@pytest.fixture
+def db():
+    """Banco em memória (mongomock) com a API assíncrona do Motor"""
+    from mongomock_motor import AsyncMongoMockClient
+
+    _corrigir_find_and_modify()
+    return AsyncMongoMockClient()["teste"]
+
+
+class _Envio:
+    def __init__(self, arquivos, nome, metadata):
+        self._id = ObjectId()
+        self._arquivos, self._buffer = arquivos, io.BytesIO()
+        self.metadata = metadata
+
+    async def write(self, dados: bytes):
+        self._buffer.write(dados)
+
+    async def close(self):
+        self._arquivos[self._id] = self._buffer.getvalue()
+
+    async def abort(self):
+        pass
+
+
+class _Leitura:
+    def __init__(self, dados: bytes):
+        self._buffer = io.BytesIO(dados)
+
+    async def read(self, n: int = -1) -> bytes:
+        return self._buffer.read(n)
+
+
+class BucketEmMemoria:
+    """Subconjunto do AsyncIOMotorGridFSBucket usado pelos jobs (o mongomock não tem GridFS).
+    Como no GridFS, instâncias sobre o mesmo banco e bucket veem os mesmos arquivos"""
+
+    _arquivos_por_bucket = {}
+
+    def __init__(self, db=None, bucket_name: str = "fs"):
+        self.arquivos = self._arquivos_por_bucket.setdefault((id(db), bucket_name), {})
+
+    def open_upload_stream(self, nome, metadata=None):
+        return _Envio(self.arquivos, nome, metadata)
+
+    async def open_download_stream(self, file_id):
+        if file_id not in self.arquivos:
+            raise NoFile(file_id)
+        return _Leitura(self.arquivos[file_id])
+
+    async def delete(self, file_id):
+        if self.arquivos.pop(file_id, None) is None:
+            raise NoFile(file_id)
+
+
+class Upload:
+    """UploadFile mínimo: só read(n) assíncrono"""
+
+    def __init__(self, dados: bytes):
+        self._buffer = io.BytesIO(dados)
+
+    async def read(self, n: int = -1) -> bytes:
+        return self._buffer.read(n)
@@ -0,0 +1,104 @@
+"""JanelaFrequencia contra uma contagem direta por aluno"""
+
+import random
+from datetime import date, timedelta
+
+from attendance_analytics import JanelaFrequencia
+from attendance_rollups import iter_attendance_marks
+
+
+def _referencia(chamadas, dias_janela, ultimas_aulas):
+    """Marcações de cada aluno ordenadas por data (empate: ordem de leitura), contadas uma a uma"""
+    marcas = {}
+    for leitura, chamada in enumerate(chamadas):
+        for aluno_id, presente in iter_attendance_marks(chamada):
+            marcas.setdefault(aluno_id, []).append((chamada.get("data") or "", leitura, presente))
+
+    validas = [date.fromisoformat(c["data"][:10]) for c in chamadas if _valida(c.get("data"))]
+    limite = (max(validas) - timedelta(days=dias_janela - 1)).isoformat() if validas else None
+
+    resultado = {}
+    for aluno_id, lista in marcas.items():
+        lista.sort(key=lambda m: (m[0], m[1]))
+        presencas = [p for _, _, p in lista]
+        seguidas = 0
+        for presente in reversed(presencas):
+            if presente:
+                break
+            seguidas += 1
+        janela = [p for d, _, p in lista if limite is not None and _valida(d) and d[:10] >= limite]
+        resultado[aluno_id] = {
+            "total_chamadas": len(lista),
+            "presencas": sum(presencas),
+            "faltas": len(lista) - sum(presencas),
+            "ultima_chamada": lista[-1][0],
+            "faltas_consecutivas": seguidas,
+            "presencas_recentes": sum(presencas[-ultimas_aulas:]),
+            "chamadas_janela": len(janela),
+            "presencas_janela": sum(janela),
+        }
+    return resultado
+
+
+def _valida(texto) -> bool:
+    try:
+        date.fromisoformat((texto or "")[:10])
+        return True
+    except ValueError:
+        return False
+
+
+def _chamadas(rnd: random.Random):
+    inicio = date(2025, 1, 1)
+    chamadas = []
+    for turma in range(6):
+        alunos = [f"a{(turma * 7 + k) % 25}" for k in range(rnd.randint(1, 10))]
+        for dia in rnd.sample(range(120), rnd.randint(1, 40)):
+            data = (inicio + timedelta(days=dia)).isoformat()
+            if rnd.random() < 0.15:
+                # Formato legado (POST /attendance)
+                chamadas.append({"turma_id": f"t{turma}", "data": data,
+                                 "presencas": {a: {"presente": rnd.random() < 0.7} for a in alunos}})
+            else:
+                chamadas.append({"turma_id": f"t{turma}", "data": data,
+                                 "records": [{"aluno_id": a, "presente": rnd.random() < 0.7} for a in alunos]})
+    chamadas.append({"turma_id": "t0", "data": "sem-data", "records": [{"aluno_id": "a0", "presente": False}]})
+    rnd.shuffle(chamadas)
+    return chamadas
+
+
+def test_metricas_iguais_a_contagem_direta_em_qualquer_ordem():
+    for semente in range(20):
+        rnd = random.Random(semente)
+        chamadas = _chamadas(rnd)
+        janela = JanelaFrequencia(dias_janela=30, ultimas_aulas=5)
+        # Lotes de tamanhos variados, como chegam do cursor
+        for inicio in range(0, len(chamadas), 17):
+            janela.adicionar(chamadas[inicio:inicio + 17])
+
+        calculado = {aluno: vars(stats) for aluno, stats in janela.calcular().items()}
+        assert calculado == _referencia(chamadas, 30, 5)
+
+
+def test_janela_termina_na_chamada_mais_recente():
+    chamadas = [
+        {"turma_id": "t", "data": "2025-03-01", "records": [{"aluno_id": "a", "presente": True}]},
+        {"turma_id": "t", "data": "2025-03-31", "records": [{"aluno_id": "a", "presente": False}]},
+        {"turma_id": "t", "data": "2025-03-02", "records": [{"aluno_id": "a", "presente": True}]},
+        {"turma_id": "t", "data": "2025-03-30", "records": [{"aluno_id": "b", "presente": False}]},
+    ]
+    janela = JanelaFrequencia(dias_janela=30, ultimas_aulas=2)
+    janela.adicionar(chamadas)
+    stats = janela.calcular()
+
+    # 2025-03-01 fica de fora: a janela de 30 dias vai de 02/03 a 31/03
+    assert (stats["a"].chamadas_janela, stats["a"].presencas_janela) == (2, 1)
+    assert stats["a"].percentual_janela() == 50
+    assert stats["a"].ultima_chamada == "2025-03-31"
+    assert stats["a"].faltas_consecutivas == 1
+    assert stats["a"].presencas_recentes == 1
+    assert (stats["b"].total_chamadas, stats["b"].faltas_consecutivas) == (1, 1)
+
+
+def test_sem_chamadas():
+    assert JanelaFrequencia().calcular() == {}
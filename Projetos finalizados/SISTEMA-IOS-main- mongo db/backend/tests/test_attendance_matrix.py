@@ -0,0 +1,100 @@
+"""Matrizes de presença contra a varredura de attendances que o teacher-stats fazia"""
+
+import asyncio
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from attendance_analytics import MARKS_PROJECTION, accumulate_marks
+from attendance_matrix import AttendanceMatrixCache
+
+INICIO = date(2025, 2, 3)
+JANELAS = [
+    (None, None),
+    ("2025-02-10", None),
+    (None, "2025-03-15"),
+    ("2025-02-20", "2025-03-20"),
+    ("2025-03-01", "2025-03-01"),
+    ("2026-01-01", None),
+]
+
+
+async def _popular(db, turmas: int = 8):
+    rnd = random.Random(3)
+    for t in range(turmas):
+        alunos = [f"a{(t * 5 + k) % 30}" for k in range(rnd.randint(0, 9))]
+        for dia in rnd.sample(range(90), rnd.randint(0, 30)):
+            chamada = {"id": f"c{t}-{dia}", "turma_id": f"t{t}", "data": (INICIO + timedelta(days=dia)).isoformat()}
+            if rnd.random() < 0.2:
+                chamada["presencas"] = {a: {"presente": rnd.random() < 0.7} for a in alunos}
+            else:
+                chamada["records"] = [{"aluno_id": a, "presente": rnd.random() < 0.7} for a in alunos if rnd.random() < 0.9]
+            await db.attendances.insert_one(chamada)
+    return [f"t{t}" for t in range(turmas)]
+
+
+async def _varredura(db, turma_ids, inicio, fim):
+    """Implementação anterior: attendances do período, uma passada com accumulate_marks"""
+    query = {"turma_id": {"$in": turma_ids}}
+    periodo = {}
+    if inicio:
+        periodo["$gte"] = inicio
+    if fim:
+        periodo["$lte"] = fim
+    if periodo:
+        query["data"] = periodo
+    return accumulate_marks([c async for c in db.attendances.find(query, MARKS_PROJECTION)])
+
+
+async def _pelas_matrizes(cache, turma_ids, inicio, fim):
+    contagens, sessoes = {}, {}
+    for turma_id, matriz in (await cache.get_many(turma_ids, inicio, fim)).items():
+        if matriz.sessions(inicio, fim):
+            sessoes[turma_id] = matriz.sessions(inicio, fim)
+        for aluno_id, contador in matriz.counts(inicio, fim).items():
+            contagens[(turma_id, aluno_id)] = contador
+    return contagens, sessoes
+
+
+@pytest.mark.parametrize("maxsize", [512, 3], ids=["escopo-no-cache", "escopo-maior-que-o-cache"])
+def test_matrizes_iguais_a_varredura_do_periodo(db, maxsize):
+    async def cenario():
+        turma_ids = await _popular(db)
+        cache = AttendanceMatrixCache(db, maxsize=maxsize)
+        for inicio, fim in JANELAS:
+            assert await _pelas_matrizes(cache, turma_ids, inicio, fim) == await _varredura(db, turma_ids, inicio, fim)
+
+    asyncio.run(cenario())
+
+
+def test_escopo_maior_que_o_cache_nao_guarda_matrizes_do_periodo(db):
+    async def cenario():
+        turma_ids = await _popular(db)
+        cache = AttendanceMatrixCache(db, maxsize=3)
+        matrizes = await cache.get_many(turma_ids, "2025-03-01", "2025-03-10")
+        assert len(cache.cache) == 0
+        assert all(not m.datas or ("2025-03-01" <= min(m.datas) and max(m.datas) <= "2025-03-10") for m in matrizes.values())
+
+        # Escopo que cabe: histórico completo, guardado
+        completas = await cache.get_many(turma_ids[:3])
+        assert len(cache.cache) == 3
+        assert sum(len(m.datas) for m in completas.values()) == await db.attendances.count_documents(
+            {"turma_id": {"$in": turma_ids[:3]}}
+        )
+
+    asyncio.run(cenario())
+
+
+def test_invalidacao_reflete_chamada_nova(db):
+    async def cenario():
+        turma_ids = await _popular(db)
+        cache = AttendanceMatrixCache(db)
+        await cache.get_many(turma_ids)
+        await db.attendances.insert_one(
+            {"turma_id": "t0", "data": "2025-06-01", "records": [{"aluno_id": "novo", "presente": True}]}
+        )
+        cache.invalidate("t0")
+        assert await _pelas_matrizes(cache, turma_ids, None, None) == await _varredura(db, turma_ids, None, None)
+
+    asyncio.run(cenario())
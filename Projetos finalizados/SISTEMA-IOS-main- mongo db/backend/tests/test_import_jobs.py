@@ -0,0 +1,129 @@
+"""Jobs de importação: retomada pelo checkpoint e lease assumido após queda do worker"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import import_jobs
+from conftest import BucketEmMemoria, Upload
+from import_jobs import ImportJobRunner, TipoImportacao, id_deterministico
+
+TOTAL_LINHAS = 10
+
+
+@pytest.fixture(autouse=True)
+def lotes_pequenos(monkeypatch):
+    monkeypatch.setattr(import_jobs, "IMPORT_JOB_BATCH", 3)
+    monkeypatch.setattr(import_jobs, "AsyncIOMotorGridFSBucket", BucketEmMemoria)
+
+
+def _tipo(db, lotes_vistos, travar_na_linha=None):
+    """Importa uma linha por aluno com id determinístico; pode travar numa linha (queda simulada)"""
+    trava = asyncio.Event()
+
+    async def preparar(job):
+        return {"job_id": job["id"]}
+
+    async def linhas(arquivo, job, estado):
+        conteudo = (await arquivo.read()).decode()
+
+        async def gerar():
+            for numero, nome in enumerate(conteudo.splitlines(), start=2):
+                yield {"line": numero, "nome": nome}
+        return gerar()
+
+    async def processar_lote(estado, lote):
+        lotes_vistos.append([linha["line"] for linha in lote])
+        for linha in lote:
+            if linha["line"] == travar_na_linha:
+                await trava.wait()
+            await db.alunos.update_one(
+                {"id": id_deterministico(estado["job_id"], linha["line"])},
+                {"$setOnInsert": {"nome": linha["nome"]}},
+                upsert=True,
+            )
+        return {"processados": len(lote)}, []
+
+    return TipoImportacao(preparar, linhas, processar_lote)
+
+
+def _arquivo() -> Upload:
+    return Upload("\n".join(f"Aluno {i}" for i in range(TOTAL_LINHAS)).encode())
+
+
+async def _esperar(condicao, tentativas: int = 200):
+    for _ in range(tentativas):
+        if await condicao():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condição não atingida")
+
+
+async def _derrubar_no_segundo_lote(db):
+    """Worker A confirma o primeiro lote, grava parte do segundo e morre sem liberar o lease"""
+    vistos_a = []
+    a = ImportJobRunner(db)
+    a.registrar("teste", _tipo(db, vistos_a, travar_na_linha=6))
+    job = await a.criar("teste", _arquivo(), "alunos.csv", "u1", {})
+    await _esperar(lambda: _contou(db, 4))
+    for tarefa in list(a._tarefas.values()):
+        tarefa.cancel()
+    await asyncio.sleep(0)
+    return a, job
+
+
+async def _contou(db, quantidade):
+    return await db.alunos.count_documents({}) >= quantidade
+
+
+def test_outro_worker_assume_so_depois_do_lease_expirar(db):
+    async def cenario():
+        a, job = await _derrubar_no_segundo_lote(db)
+        b = ImportJobRunner(db)
+        b.registrar("teste", _tipo(db, []))
+
+        # Lease de A ainda válido: B não pega o job
+        assert await b._reservar(job["id"]) is None
+        assert await b.retomar_pendentes() == 0
+
+        await db.import_jobs.update_one(
+            {"id": job["id"]}, {"$set": {"lease_until": datetime.now(timezone.utc) - timedelta(seconds=1)}}
+        )
+        assert await b.retomar_pendentes() == 1
+        await asyncio.gather(*b._tarefas.values())
+
+        final = await db.import_jobs.find_one({"id": job["id"]})
+        assert final["status"] == "completed"
+        assert final["attempts"] == 2
+        assert final["lease_owner"] is None
+        # O worker antigo não consegue mais confirmar lotes
+        assert await a._checkpoint(job["id"], {"processados": 3}, 3, 0) is False
+
+    asyncio.run(cenario())
+
+
+def test_retomada_parte_do_checkpoint_sem_duplicar_alunos(db):
+    async def cenario():
+        _, job = await _derrubar_no_segundo_lote(db)
+        parcial = await db.import_jobs.find_one({"id": job["id"]})
+        assert parcial["processed_rows"] == 3
+        assert await db.alunos.count_documents({}) == 4  # lote 1 + primeira linha do lote 2
+
+        vistos_b = []
+        b = ImportJobRunner(db)
+        b.registrar("teste", _tipo(db, vistos_b))
+        await db.import_jobs.update_one({"id": job["id"]}, {"$set": {"lease_until": None}})
+        await b.retomar_pendentes()
+        await asyncio.gather(*b._tarefas.values())
+
+        # Linhas confirmadas (2-4) não voltam; o lote interrompido é refeito inteiro
+        assert vistos_b == [[5, 6, 7], [8, 9, 10], [11]]
+        final = await db.import_jobs.find_one({"id": job["id"]})
+        assert final["processed_rows"] == TOTAL_LINHAS
+        assert final["counters"] == {"processados": TOTAL_LINHAS}
+        ids = [aluno["id"] async for aluno in db.alunos.find({})]
+        assert len(ids) == len(set(ids)) == TOTAL_LINHAS
+        assert set(ids) == {id_deterministico(job["id"], linha) for linha in range(2, TOTAL_LINHAS + 2)}
+
+    asyncio.run(cenario())
@@ -0,0 +1,66 @@
+"""validar_lote (NumPy) contra as funções linha a linha nas mesmas linhas"""
+
+import random
+
+from import_validation import normalize_cpf, parse_date_str, validar_lote, validate_cpf
+
+
+def _cpf_valido(rnd: random.Random) -> str:
+    base = [rnd.randint(0, 9) for _ in range(9)]
+    for tamanho in (9, 10):
+        resto = sum(d * (tamanho + 1 - i) for i, d in enumerate(base)) % 11
+        base.append(0 if resto < 2 else 11 - resto)
+    return "".join(map(str, base))
+
+
+def _cpfs(rnd: random.Random, n: int):
+    especiais = [None, "", "000.000.000-00", "11111111111", "123", "１２３.４５６.７８９-０９", "٣" * 11,
+                 "x" * 40 + "52998224725", "529.982.247-25", " 529 982 247 25 ", "52998224724"]
+    linhas = list(especiais)
+    while len(linhas) < n:
+        cpf = _cpf_valido(rnd)
+        if rnd.random() < 0.3:
+            cpf = f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"
+        if rnd.random() < 0.2:
+            cpf = cpf[:-1] + str((int(cpf[-1]) + 1) % 10)
+        linhas.append(cpf)
+    return linhas
+
+
+def _datas(rnd: random.Random, n: int):
+    especiais = [None, "", "31/02/2001", "0000-01-01", "2024-13-01", "29/02/2024", "29/02/2023", "2024/02/29",
+                 "1-2-2003", "2003-1-2", " 05/06/2007 ", "05-06-2007", "5 de junho", "June 5 2007",
+                 "２００７-０６-０５", "20070605", "abc"]
+    linhas = list(especiais)
+    formatos = ("{a:04d}-{m:02d}-{d:02d}", "{d:02d}/{m:02d}/{a:04d}", "{d:02d}-{m:02d}-{a:04d}", "{a:04d}/{m:02d}/{d:02d}")
+    while len(linhas) < n:
+        a, m, d = rnd.randint(1900, 2030), rnd.randint(0, 13), rnd.randint(0, 32)
+        linhas.append(rnd.choice(formatos).format(a=a, m=m, d=d))
+    return linhas
+
+
+def _referencia_data(valor):
+    if not valor:
+        return None, None
+    try:
+        return parse_date_str(valor).isoformat(), None
+    except Exception as e:
+        return None, str(e)
+
+
+def test_validar_lote_igual_as_funcoes_linha_a_linha():
+    rnd = random.Random(12)
+    cpfs, datas = _cpfs(rnd, 3000), _datas(rnd, 3000)
+
+    lote = validar_lote(cpfs, datas)
+
+    for i, (cpf, data) in enumerate(zip(cpfs, datas)):
+        normalizado = normalize_cpf(cpf)
+        assert lote.cpf_normalizado[i] == normalizado, cpf
+        assert bool(lote.cpf_valido[i]) == validate_cpf(normalizado), cpf
+        assert (lote.data_iso[i], lote.data_erro[i]) == _referencia_data(data), data
+
+
+def test_lote_vazio():
+    lote = validar_lote([], [])
+    assert lote.cpf_normalizado == [] and lote.data_iso == [] and len(lote.mascara_erro) == 0
@@ -0,0 +1,267 @@
+"""Stream de pendências: tickets de uso único, revalidação da sessão e cálculo compartilhado"""
+
+import asyncio
+import time
+
+import pytest
+from pymongo.errors import AutoReconnect, OperationFailure
+
+import notifications
+from notifications import PendingNotifier, StreamTickets
+
+
+@pytest.fixture(autouse=True)
+def tempos(monkeypatch):
+    monkeypatch.setattr(notifications, "NOTIFY_KEEPALIVE_SECONDS", 0.05)
+    monkeypatch.setattr(notifications, "NOTIFY_DEBOUNCE_SECONDS", 0.01)
+    monkeypatch.setattr(notifications, "NOTIFY_WATCH_RETRY_SECONDS", 0.01)
+
+
+class Usuario:
+    def __init__(self, id, tipo="instrutor"):
+        self.id = id
+        self.tipo = tipo
+
+    def __eq__(self, outro):
+        return (self.id, self.tipo) == (outro.id, outro.tipo)
+
+
+def _notifier(db, chamadas):
+    rodada = iter(range(1_000_000))
+
+    async def calcular(user):
+        chamadas.append(user.id)
+        await asyncio.sleep(0.01)
+        return {"pending-calls": {"rodada": next(rodada)}}, ["t1"]
+
+    return PendingNotifier(db, calcular, lambda user: "admin" if user.tipo == "admin" else user.id)
+
+
+def _sempre(user):
+    async def revalidar():
+        return user
+    return revalidar
+
+
+async def _proximo(stream):
+    """Próxima mensagem que não é keepalive"""
+    while True:
+        mensagem = await stream.__anext__()
+        if not mensagem.startswith(":"):
+            return mensagem
+
+
+def test_ticket_vale_uma_vez(db):
+    async def cenario():
+        tickets = StreamTickets(db)
+        ticket = await tickets.emitir("a@x.com", 123.0)
+        assert await tickets.consumir(ticket) == {"email": "a@x.com", "token_exp": 123.0}
+        assert await tickets.consumir(ticket) is None
+        assert await tickets.consumir("inventado") is None
+
+    asyncio.run(cenario())
+
+
+def test_ticket_vencido_e_recusado(db, monkeypatch):
+    async def cenario():
+        monkeypatch.setattr(notifications, "NOTIFY_TICKET_TTL_SECONDS", -1)
+        tickets = StreamTickets(db)
+        ticket = await tickets.emitir("a@x.com", 123.0)
+        assert await tickets.consumir(ticket) is None
+        # Só o hash fica no banco
+        assert await db[notifications.TICKETS_COLLECTION].count_documents({"_id": ticket}) == 0
+
+    asyncio.run(cenario())
+
+
+def test_conexoes_da_mesma_chave_compartilham_o_calculo(db):
+    async def cenario():
+        chamadas = []
+        notifier = _notifier(db, chamadas)
+        expira = time.time() + 60
+        admins = [notifier.stream(Usuario(f"a{i}", "admin"), _sempre(Usuario(f"a{i}", "admin")), expira)
+                  for i in range(5)]
+        instrutor = notifier.stream(Usuario("i1"), _sempre(Usuario("i1")), expira)
+        streams = admins + [instrutor]
+        for stream in streams:
+            await stream.__anext__()  # retry
+        await asyncio.gather(*(_proximo(stream) for stream in streams))
+        assert sorted(chamadas) == ["a0", "i1"]
+
+        # O relógio acorda todos: de novo um cálculo por chave, não por conexão
+        chamadas.clear()
+        notifier.avisar()
+        mensagens = await asyncio.gather(*(_proximo(stream) for stream in streams))
+        assert len(chamadas) == 2
+        assert all(m.startswith("event: pending-calls") for m in mensagens)
+        for stream in streams:
+            await stream.aclose()
+        assert notifier.conexoes == 0 and notifier._calculos == {}
+
+    asyncio.run(cenario())
+
+
+def test_stream_fecha_quando_o_usuario_e_desativado(db):
+    async def cenario():
+        notifier = _notifier(db, [])
+        ativo = {"valor": True}
+
+        async def revalidar():
+            return Usuario("i1") if ativo["valor"] else None
+
+        stream = notifier.stream(Usuario("i1"), revalidar, time.time() + 60)
+        await stream.__anext__()
+        await _proximo(stream)
+        ativo["valor"] = False
+        assert (await _proximo(stream)).startswith("event: sessao-encerrada")
+        with pytest.raises(StopAsyncIteration):
+            await stream.__anext__()
+        assert notifier.conexoes == 0
+
+    asyncio.run(cenario())
+
+
+def test_stream_fecha_quando_o_token_expira(db, monkeypatch):
+    async def cenario():
+        monkeypatch.setattr(notifications, "NOTIFY_KEEPALIVE_SECONDS", 60)
+        notifier = _notifier(db, [])
+        stream = notifier.stream(Usuario("i1"), _sempre(Usuario("i1")), time.time() + 0.2)
+        await stream.__anext__()
+        await _proximo(stream)
+        inicio = time.monotonic()
+        assert (await _proximo(stream)).startswith("event: sessao-encerrada")
+        # Não esperou o keepalive de 60s
+        assert time.monotonic() - inicio < 5
+
+    asyncio.run(cenario())
+
+
+def test_mudanca_de_perfil_recalcula_com_o_usuario_novo(db):
+    async def cenario():
+        chamadas = []
+        notifier = _notifier(db, chamadas)
+        atual = {"user": Usuario("i1")}
+
+        async def revalidar():
+            return atual["user"]
+
+        stream = notifier.stream(Usuario("i1"), revalidar, time.time() + 60)
+        await stream.__anext__()
+        await _proximo(stream)
+        atual["user"] = Usuario("i1", "admin")
+        await _proximo(stream)
+        assert chamadas == ["i1", "i1"]
+        assert notifier.chave(next(iter(notifier._conexoes)).user) == "admin"
+        await stream.aclose()
+
+    asyncio.run(cenario())
+
+
+def test_falha_no_calculo_nao_derruba_o_stream(db):
+    async def cenario():
+        tentativas = []
+
+        async def calcular(user):
+            tentativas.append(user.id)
+            if len(tentativas) == 1:
+                raise AutoReconnect("primário trocado")
+            return {"pending-calls": {"total": 0}}, ["t1"]
+
+        notifier = PendingNotifier(db, calcular, lambda user: user.id)
+        stream = notifier.stream(Usuario("i1"), _sempre(Usuario("i1")), time.time() + 60)
+        await stream.__anext__()
+        assert (await _proximo(stream)).startswith("event: erro")
+        assert notifier._calculos == {}
+        # Sem sinal nenhum, tenta de novo no keepalive seguinte
+        assert (await _proximo(stream)).startswith("event: pending-calls")
+        assert tentativas == ["i1", "i1"]
+        await stream.aclose()
+
+    asyncio.run(cenario())
+
+
+class _Mudancas:
+    def __init__(self, mudancas):
+        self.mudancas = list(mudancas)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *erro):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.mudancas:
+            # Fica aberto até o teste cancelar
+            await asyncio.Event().wait()
+        return self.mudancas.pop(0)
+
+
+class _Attendances:
+    """watch() falha com os erros dados, na ordem, e depois entrega as mudanças"""
+
+    def __init__(self, erros, mudancas=()):
+        self.erros = list(erros)
+        self.mudancas = mudancas
+        self.aberturas = 0
+
+    def watch(self, pipeline, full_document=None):
+        self.aberturas += 1
+        if self.erros:
+            raise self.erros.pop(0)
+        return _Mudancas(self.mudancas)
+
+
+class _Banco:
+    def __init__(self, attendances):
+        self.attendances = attendances
+
+
+def _avisos(notifier):
+    recebidos = []
+
+    def avisar(turma_id=None):
+        recebidos.append(turma_id)
+
+    notifier.avisar = avisar
+    return recebidos
+
+
+def test_change_stream_reabre_depois_de_queda():
+    async def cenario():
+        attendances = _Attendances(
+            [AutoReconnect("failover"), OperationFailure("cursor perdido", code=43)],
+            [{"fullDocument": {"turma_id": "t9"}}],
+        )
+        notifier = PendingNotifier(_Banco(attendances), None, lambda user: user)
+        avisos = _avisos(notifier)
+        tarefa = asyncio.create_task(notifier._observar())
+        for _ in range(200):
+            if "t9" in avisos:
+                break
+            await asyncio.sleep(0.01)
+        assert not tarefa.done()
+        tarefa.cancel()
+        await asyncio.gather(tarefa, return_exceptions=True)
+        assert attendances.aberturas == 3
+        # Reaberto: todos recalculam (None) antes das mudanças novas
+        assert avisos == [None, "t9"]
+
+    asyncio.run(cenario())
+
+
+@pytest.mark.parametrize("erro", [
+    OperationFailure("The $changeStream stage is only supported on replica sets", code=40573),
+    NotImplementedError("watch"),
+])
+def test_change_stream_desiste_sem_replica_set(erro):
+    async def cenario():
+        attendances = _Attendances([erro])
+        notifier = PendingNotifier(_Banco(attendances), None, lambda user: user)
+        await asyncio.wait_for(notifier._observar(), 1)
+        assert attendances.aberturas == 1
+
+    asyncio.run(cenario())
@@ -0,0 +1,94 @@
+"""Envio de jobs de relatório: limites sob concorrência e fila cheia"""
+
+import asyncio
+
+import pytest
+
+import report_jobs
+from conftest import BucketEmMemoria
+from report_jobs import LimiteRelatorios, ReportJobStore, ReportWorkerPool
+
+
+@pytest.fixture(autouse=True)
+def limites(monkeypatch):
+    monkeypatch.setattr(report_jobs, "AsyncIOMotorGridFSBucket", BucketEmMemoria)
+    monkeypatch.setattr(report_jobs, "REPORT_MAX_PER_USER", 2)
+    monkeypatch.setattr(report_jobs, "REPORT_MAX_GLOBAL", 3)
+
+
+async def _nada(job, contexto):
+    pass
+
+
+def _pools(db, quantidade=2, fila_max=20):
+    """Pools sem workers sobre o mesmo banco, como processos diferentes do uvicorn"""
+    return [ReportWorkerPool(ReportJobStore(db), _nada, fila_max=fila_max) for _ in range(quantidade)]
+
+
+async def _enviar_todos(envios):
+    resultados = await asyncio.gather(*envios, return_exceptions=True)
+    aceitos = [r for r in resultados if isinstance(r, dict)]
+    recusados = [r for r in resultados if isinstance(r, LimiteRelatorios)]
+    assert len(aceitos) + len(recusados) == len(resultados)
+    return aceitos, recusados
+
+
+def test_limite_por_usuario_nao_estoura_com_envios_simultaneos(db):
+    async def cenario():
+        a, b = _pools(db)
+        aceitos, recusados = await _enviar_todos(
+            [pool.enviar("u1", {}, None) for _ in range(4) for pool in (a, b)]
+        )
+        assert 1 <= len(aceitos) <= 2
+        # Os recusados não ficam como ativos nem na fila de ninguém
+        assert await db.report_jobs.count_documents({"status": "failed"}) == len(recusados)
+        assert a.fila.qsize() + b.fila.qsize() == len(aceitos)
+        assert set(a._na_fila) | set(b._na_fila) == {job["id"] for job in aceitos}
+
+        # Passada a disputa, as vagas restantes continuam utilizáveis até o limite exato
+        while len(aceitos) < 2:
+            aceitos.append(await a.enviar("u1", {}, None))
+        with pytest.raises(LimiteRelatorios):
+            await b.enviar("u1", {}, None)
+        assert await a.store.contar_ativos("u1") == 2
+
+    asyncio.run(cenario())
+
+
+def test_limite_global_nao_estoura_com_envios_simultaneos(db):
+    async def cenario():
+        a, b = _pools(db)
+        await _enviar_todos([pool.enviar(f"u{i}", {}, None) for i in range(5) for pool in (a, b)])
+        assert 1 <= await a.store.contar_ativos() <= 3
+
+        usuario = 10
+        while await a.store.contar_ativos() < 3:
+            await a.enviar(f"u{usuario}", {}, None)
+            usuario += 1
+        with pytest.raises(LimiteRelatorios):
+            await b.enviar(f"u{usuario}", {}, None)
+        assert await a.store.contar_ativos() == 3
+
+    asyncio.run(cenario())
+
+
+def test_queue_full_marca_job_como_falho(db, monkeypatch):
+    async def cenario():
+        (pool,) = _pools(db, quantidade=1, fila_max=1)
+        conferir = pool._conferir_limites
+
+        async def fila_tomada_no_meio(job):
+            # Outro produtor ocupa a última vaga depois da checagem de full()
+            pool.fila.put_nowait("outro")
+            await conferir(job)
+
+        monkeypatch.setattr(pool, "_conferir_limites", fila_tomada_no_meio)
+        with pytest.raises(LimiteRelatorios):
+            await pool.enviar("u1", {}, None)
+
+        job = await db.report_jobs.find_one({"user_id": "u1"})
+        assert job["status"] == "failed"
+        assert job["id"] not in pool._na_fila
+        assert await pool.store.contar_ativos("u1") == 0
+
+    asyncio.run(cenario())
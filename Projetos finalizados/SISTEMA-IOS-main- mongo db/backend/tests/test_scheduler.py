@@ -0,0 +1,106 @@
+"""Agendador: eleição de líder, troca de líder quando o lease vence e SCHEDULER_ENABLED=0"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import scheduler as agendador
+from scheduler import ACada, LOCK_ID, Scheduler
+
+
+def _replica(db, execucoes):
+    """Uma réplica com a tarefa global "rollup" e a limpeza que roda sem agendador"""
+    replica = Scheduler(db)
+
+    async def rollup():
+        execucoes.append(("rollup", replica.instancia))
+
+    async def limpeza():
+        execucoes.append(("limpeza", replica.instancia))
+
+    replica.registrar("rollup", rollup, ACada(3600))
+    replica.registrar("limpeza", limpeza, ACada(3600), sem_agendador=True)
+    return replica
+
+
+async def _ciclo(replica):
+    await replica._ciclo()
+    rodando = [t.rodando for t in replica.tarefas.values() if t.rodando]
+    await asyncio.gather(*rodando)
+
+
+async def _vencer_lease(db):
+    passado = datetime.now(timezone.utc) - timedelta(seconds=1)
+    await db.scheduler_locks.update_one({"_id": LOCK_ID}, {"$set": {"lease_until": passado}})
+
+
+def test_so_uma_replica_e_lider(db):
+    async def cenario():
+        execucoes = []
+        a, b = _replica(db, execucoes), _replica(db, execucoes)
+        await _ciclo(a)
+        await _ciclo(b)
+        assert a.lider and not b.lider
+        assert (await db.scheduler_locks.find_one({"_id": LOCK_ID}))["owner"] == a.instancia
+        assert sorted(execucoes) == [("limpeza", a.instancia), ("rollup", a.instancia)]
+
+        # Lease válido: o líder renova, a outra continua de fora
+        await _ciclo(a)
+        await _ciclo(b)
+        assert a.lider and not b.lider
+
+    asyncio.run(cenario())
+
+
+def test_outra_replica_assume_quando_o_lease_vence(db):
+    async def cenario():
+        execucoes = []
+        a, b = _replica(db, execucoes), _replica(db, execucoes)
+        await _ciclo(a)
+        await _ciclo(b)
+
+        # A para de renovar e a tarefa vence enquanto ninguém é líder
+        await _vencer_lease(db)
+        passado = (datetime.now() - timedelta(minutes=5)).isoformat()
+        await db.scheduler_jobs.update_one({"_id": "rollup"}, {"$set": {"proxima_local": passado}})
+        execucoes.clear()
+
+        await _ciclo(b)
+        assert b.lider
+        # Só o que venceu roda: a limpeza segue a agenda que A gravou (daqui a 1h)
+        assert execucoes == [("rollup", b.instancia)]
+        # O que ficou para trás roda uma vez só; a agenda segue gravada pelo novo líder
+        await _ciclo(b)
+        assert len(execucoes) == 1
+        proxima = datetime.fromisoformat((await db.scheduler_jobs.find_one({"_id": "rollup"}))["proxima_local"])
+        assert proxima > datetime.now() + timedelta(minutes=50)
+
+        # A volta, vê o lease de B e deixa de ser líder
+        await _ciclo(a)
+        assert not a.lider
+
+    asyncio.run(cenario())
+
+
+def test_parar_libera_o_lease(db):
+    async def cenario():
+        a, b = _replica(db, []), _replica(db, [])
+        await _ciclo(a)
+        await a.parar()
+        await _ciclo(b)
+        assert b.lider
+
+    asyncio.run(cenario())
+
+
+def test_sem_agendador_so_a_limpeza_roda_em_cada_replica(db, monkeypatch):
+    async def cenario():
+        monkeypatch.setattr(agendador, "SCHEDULER_ENABLED", False)
+        execucoes = []
+        a, b = _replica(db, execucoes), _replica(db, execucoes)
+        await _ciclo(a)
+        await _ciclo(b)
+        assert sorted(execucoes) == sorted([("limpeza", a.instancia), ("limpeza", b.instancia)])
+        assert await db.scheduler_locks.count_documents({}) == 0
+        assert not a.lider and not b.lider
+
+    asyncio.run(cenario())